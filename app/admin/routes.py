@@ -1,23 +1,44 @@
 # app/admin/routes.py
 from typing import List, Optional
 from datetime import datetime
-from pathlib import Path
 
+import httpx
 from fastapi import APIRouter, Depends, HTTPException, Body, Query
-from sqlalchemy.orm import Session, joinedload
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload, selectinload
 from pydantic import BaseModel
 from passlib.hash import bcrypt
-from sqlalchemy import and_
+from sqlalchemy import and_, func, or_
 
 from app.database import get_db
-from app.models import User, Ad, AdImage, AdModerationLog
+from app.models import User, Ad, AdImage, AdImageRendition, AdModerationLog, ImageBlob
+from app.ads.images import TARGET_MAX_SIDE
+from app.ads.encoder import BYTE_BUDGET
+from app.ads.executor import memory_budget
+from app.ads.blobs import release_image
+from app.ads.serializers import image_payload
+from app.ads.phash import near_duplicate_hints
+from app.ads.deleter import enqueue_deletions, notify as notify_deleter
+from app.ads.storage import StorageError
+from app.ads.tiering import drop_bundle, rehydrate
 from app.auth.dependencies import get_current_admin  # ✅ valida Bearer + is_admin
 
 # ⚠️ SIN prefix aquí; el prefix se añade en app/main.py
 router = APIRouter(tags=["Admin"])
 
-# Ruta base del proyecto para borrar archivos físicos de imágenes
-PROJECT_ROOT = Path(__file__).resolve().parents[2]  # .../deotramano_fastapi
+# ---------- Borrado de ficheros de imagen (diferido) ----------
+def _release_image_files(db: Session, img: AdImage, orphans: List[str]) -> None:
+    # Sólo se borran ficheros cuando nadie más usa el blob (ver app/ads/blobs.py);
+    # se apuntan en pending_deletions con el mismo commit (ver app/ads/deleter.py)
+    orphans.extend(release_image(db, img))
+
+def _delete_image_rows(db: Session, ad_id: int) -> None:
+    """Borra en bloque las filas de imágenes (y variantes) de un anuncio."""
+    image_ids = db.query(AdImage.id).filter(AdImage.ad_id == ad_id)
+    db.query(AdImageRendition).filter(
+        AdImageRendition.image_id.in_(image_ids.scalar_subquery())
+    ).delete(synchronize_session=False)
+    db.query(AdImage).filter(AdImage.ad_id == ad_id).delete(synchronize_session=False)
 
 # ---------- Utilidad email (stub de consola) ----------
 def send_email(to: str, subject: str, body: str) -> None:
@@ -147,23 +168,21 @@ def delete_user(
         .filter(Ad.user_id == user.id)
         .all()
     )
+    orphans: List[str] = []
     for ad in ads:
-        # borrar ficheros físicos
+        # soltar ficheros (se borran en segundo plano tras el commit)
         for img in (ad.images or []):
-            fpath = PROJECT_ROOT / img.url.lstrip("/")
-            if fpath.is_file():
-                try:
-                    fpath.unlink(missing_ok=True)
-                except Exception:
-                    pass
+            _release_image_files(db, img, orphans)
         # borrar registros hijos
-        db.query(AdImage).filter(AdImage.ad_id == ad.id).delete(synchronize_session=False)
+        _delete_image_rows(db, ad.id)
         db.query(AdModerationLog).filter(AdModerationLog.ad_id == ad.id).delete(synchronize_session=False)
         # borrar el anuncio
         db.delete(ad)
 
     db.delete(user)
+    enqueue_deletions(db, orphans)
     db.commit()
+    notify_deleter()
     return {"message": "Usuario eliminado"}
 
 @router.post("/users/{user_id}/set-password")
@@ -240,7 +259,7 @@ def get_all_ads(
 ):
     ads = (
         db.query(Ad)
-        .options(joinedload(Ad.user), joinedload(Ad.images))
+        .options(joinedload(Ad.user), joinedload(Ad.images).selectinload(AdImage.renditions))
         .all()
     )
     return [
@@ -249,10 +268,11 @@ def get_all_ads(
             "title": ad.title,
             "description": ad.description,
             "user_email": ad.user.email if ad.user else None,
-            "images": [{"id": im.id, "url": im.url} for im in (ad.images or [])],
+            "images": [image_payload(im) for im in (ad.images or [])],
             "status": (ad.status or "active"),
             "reject_reason": ad.reject_reason,
             "reviewed_at": ad.reviewed_at.isoformat() if ad.reviewed_at else None,
+            "images_cold": ad.images_cold_at is not None,
         }
         for ad in ads
     ]
@@ -272,22 +292,20 @@ def delete_ad(
     if not ad:
         raise HTTPException(status_code=404, detail="Anuncio no encontrado")
 
-    # 1) Borrar imágenes físicas (best-effort)
+    # 1) Soltar imágenes físicas (se borran en segundo plano tras el commit)
+    orphans: List[str] = []
     for img in (ad.images or []):
-        fpath = PROJECT_ROOT / img.url.lstrip("/")
-        if fpath.is_file():
-            try:
-                fpath.unlink(missing_ok=True)
-            except Exception:
-                pass
+        _release_image_files(db, img, orphans)
 
     # 2) Borrar registros hijos para evitar violación de FK en Postgres
-    db.query(AdImage).filter(AdImage.ad_id == ad.id).delete(synchronize_session=False)
+    _delete_image_rows(db, ad.id)
     db.query(AdModerationLog).filter(AdModerationLog.ad_id == ad.id).delete(synchronize_session=False)
 
     # 3) Borrar el anuncio
     db.delete(ad)
+    enqueue_deletions(db, orphans)
     db.commit()
+    notify_deleter()
     return {"message": "Anuncio eliminado"}
 
 # ✳️ Compatibilidad con AdminPanel actual:
@@ -355,18 +373,16 @@ def bulk_delete_ads(
         .filter(Ad.id.in_(body.ids))
         .all()
     )
+    orphans: List[str] = []
     for ad in items:
         for img in (ad.images or []):
-            fpath = PROJECT_ROOT / img.url.lstrip("/")
-            if fpath.is_file():
-                try:
-                    fpath.unlink(missing_ok=True)
-                except Exception:
-                    pass
-        db.query(AdImage).filter(AdImage.ad_id == ad.id).delete(synchronize_session=False)
+            _release_image_files(db, img, orphans)
+        _delete_image_rows(db, ad.id)
         db.query(AdModerationLog).filter(AdModerationLog.ad_id == ad.id).delete(synchronize_session=False)
         db.delete(ad)
+    enqueue_deletions(db, orphans)
     db.commit()
+    notify_deleter()
     return {"deleted": len(items)}
 
 # --- borrar UNA imagen de un anuncio ---
@@ -383,18 +399,137 @@ def delete_one_image(
     if not img:
         raise HTTPException(404, "Imagen no encontrada")
 
-    # borrar archivo físico
-    fpath = PROJECT_ROOT / img.url.lstrip("/")
-    if fpath.is_file():
-        try:
-            fpath.unlink(missing_ok=True)
-        except Exception:
-            pass
+    # borrar archivos físicos (principal + variantes) en segundo plano tras el commit
+    orphans: List[str] = []
+    _release_image_files(db, img, orphans)
 
     db.delete(img)
+    enqueue_deletions(db, orphans)
     db.commit()
+    notify_deleter()
     return {"message": "Imagen eliminada"}
 
+# --- ahorro del codificador adaptativo (app/ads/encoder.py) ---
+@router.get("/images/stats")
+def image_stats(
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin),
+):
+    """Bytes subidos frente a bytes guardados (imagen principal), por formato de salida."""
+    rows = (
+        db.query(
+            ImageBlob.format,
+            func.count(ImageBlob.id),
+            func.sum(ImageBlob.source_bytes),
+            func.sum(ImageBlob.bytes),
+            func.avg(ImageBlob.quality),
+        )
+        .filter(ImageBlob.bytes.isnot(None))
+        .group_by(ImageBlob.format)
+        .all()
+    )
+    by_format = []
+    total_source = total_stored = 0
+    for fmt, n, source, stored, quality in rows:
+        source, stored = int(source or 0), int(stored or 0)
+        total_source += source
+        total_stored += stored
+        by_format.append({
+            "format": fmt, "images": n, "source_bytes": source, "stored_bytes": stored,
+            "avg_quality": round(float(quality), 1) if quality is not None else None,
+        })
+    return {
+        "source_bytes": total_source,
+        "stored_bytes": total_stored,
+        "saved_bytes": total_source - total_stored,
+        "saved_ratio": round(1 - total_stored / total_source, 4) if total_source else None,
+        "without_stats": db.query(func.count(ImageBlob.id)).filter(ImageBlob.bytes.is_(None)).scalar(),
+        "by_format": sorted(by_format, key=lambda r: -r["stored_bytes"]),
+    }
+
+# --- informes de almacenamiento: SQL sobre los metadatos de AdImage, sin abrir ficheros ---
+@router.get("/images/memory")
+def image_memory(admin: User = Depends(get_current_admin)):
+    """Presupuesto de píxeles decodificados de este proceso (app/ads/executor.py): uso, cola y rechazos."""
+    return memory_budget().stats()
+
+@router.get("/images/storage")
+def image_storage(
+    top: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin),
+):
+    """Bytes guardados por formato (cada fichero una vez) y usuarios con más bytes referenciados."""
+    files = (
+        db.query(AdImage.url, AdImage.format, AdImage.bytes)
+        .filter(AdImage.bytes.isnot(None))
+        .distinct()
+        .subquery()
+    )
+    by_format = (
+        db.query(files.c.format, func.count(), func.sum(files.c.bytes))
+        .group_by(files.c.format)
+        .all()
+    )
+    by_user = (
+        db.query(Ad.user_id, User.email, func.count(AdImage.id), func.sum(AdImage.bytes))
+        .join(Ad, Ad.id == AdImage.ad_id)
+        .join(User, User.id == Ad.user_id)
+        .filter(AdImage.bytes.isnot(None))
+        .group_by(Ad.user_id, User.email)
+        .order_by(func.sum(AdImage.bytes).desc())
+        .limit(top)
+        .all()
+    )
+    return {
+        "files": sum(n for _, n, _ in by_format),
+        "stored_bytes": sum(int(b or 0) for _, _, b in by_format),
+        "by_format": sorted(
+            ({"format": fmt, "files": n, "bytes": int(b or 0)} for fmt, n, b in by_format),
+            key=lambda r: -r["bytes"],
+        ),
+        "top_users": [
+            {"user_id": uid, "email": email, "images": n, "referenced_bytes": int(b or 0)}
+            for uid, email, n, b in by_user
+        ],
+        # Filas anteriores a los metadatos: scripts/backfill_image_metadata.py
+        "without_metadata": db.query(func.count(AdImage.id))
+        .filter(AdImage.bytes.is_(None), AdImage.url != "")
+        .scalar(),
+    }
+
+@router.get("/images/oversize")
+def oversize_images(
+    max_side: int = Query(TARGET_MAX_SIDE, ge=1),
+    max_bytes: int = Query(BYTE_BUDGET, ge=0, description="0 = sin límite de bytes"),
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin),
+):
+    """Imágenes que superan el lado máximo o el presupuesto de bytes, de mayor a menor."""
+    conds = [AdImage.width > max_side, AdImage.height > max_side]
+    if max_bytes > 0:
+        conds.append(AdImage.bytes > max_bytes)
+    too_big = or_(*conds)
+    rows = (
+        db.query(AdImage.id, AdImage.ad_id, AdImage.url, AdImage.width, AdImage.height, AdImage.bytes, AdImage.format)
+        .filter(too_big)
+        .order_by(AdImage.bytes.desc(), AdImage.id)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return {
+        "total": db.query(func.count(AdImage.id)).filter(too_big).scalar(),
+        "max_side": max_side,
+        "max_bytes": max_bytes,
+        "items": [
+            {"id": i, "ad_id": ad_id, "url": url, "width": w, "height": h, "bytes": b, "format": fmt}
+            for i, ad_id, url, w, h, b, fmt in rows
+        ],
+    }
+
 # =================================================
 #               MODERACIÓN (ADMIN)
 # =================================================
@@ -413,9 +548,10 @@ def moderation_queue(
         .order_by(Ad.created_at.desc())
         .offset(offset)
         .limit(limit)
-        .options(joinedload(Ad.images), joinedload(Ad.user))
+        .options(joinedload(Ad.images).selectinload(AdImage.renditions), joinedload(Ad.user))
         .all()
     )
+    hints = near_duplicate_hints(db, q)
     result = []
     for a in q:
         result.append({
@@ -427,8 +563,11 @@ def moderation_queue(
             "status": a.status,
             "created_at": a.created_at.isoformat() if a.created_at else None,
             "reviewed_at": a.reviewed_at.isoformat() if a.reviewed_at else None,
+            "images_cold": a.images_cold_at is not None,
             "reject_reason": a.reject_reason,
-            "images": [{"id": im.id, "url": im.url} for im in (a.images or [])],
+            "images": [image_payload(im) for im in (a.images or [])],
+            # Otros anuncios con fotos casi idénticas (re-publicaciones, spam)
+            "near_duplicates": hints.get(a.id, []),
         })
     return {"items": result, "count": len(result), "status": status, "offset": offset, "limit": limit}
 
@@ -505,21 +644,34 @@ def moderation_archive(
     return {"message": "Anuncio archivado", "ad_id": ad.id, "status": ad.status}
 
 @router.post("/moderation/{ad_id}/restore")
-def moderation_restore(
+async def moderation_restore(
     ad_id: int,
     db: Session = Depends(get_db),
     admin: User = Depends(get_current_admin),
 ):
-    ad = db.query(Ad).filter(Ad.id == ad_id).first()
+    # async por la rehidratación: el trabajo síncrono (DB, disco) va a hilos
+    ad = await run_in_threadpool(lambda: db.query(Ad).filter(Ad.id == ad_id).first())
     if not ad:
         raise HTTPException(404, "Anuncio no encontrado")
-    ad.status = "pending"
-    ad.reviewed_by_id = admin.id
-    ad.reviewed_at = datetime.utcnow()
-    ad.reject_reason = None
-    db.commit()
-
-    db.add(AdModerationLog(ad_id=ad.id, admin_id=admin.id, action="restored", reason=None))
-    db.commit()
-
-    return {"message": "Anuncio movido a pendiente", "ad_id": ad.id, "status": ad.status}
+    # Imágenes en el nivel frío (app/ads/tiering.py): se rehidratan primero
+    was_cold = ad.images_cold_at is not None
+    try:
+        images = await rehydrate(db, ad)
+    except (StorageError, httpx.HTTPError) as e:
+        print(f"[storage] No se pudieron rehidratar las imágenes del anuncio {ad_id}: {e}")
+        raise HTTPException(503, "El almacenamiento de imágenes no está disponible. Inténtalo más tarde.")
+
+    def _reopen() -> dict:
+        ad.status = "pending"
+        ad.reviewed_by_id = admin.id
+        ad.reviewed_at = datetime.utcnow()
+        ad.reject_reason = None
+        db.commit()
+        if was_cold:
+            drop_bundle(ad.id)
+
+        db.add(AdModerationLog(ad_id=ad.id, admin_id=admin.id, action="restored", reason=None))
+        db.commit()
+        return {"message": "Anuncio movido a pendiente", "ad_id": ad.id, "status": ad.status, "images": images}
+
+    return await run_in_threadpool(_reopen)
@@ -0,0 +1,100 @@
+# app/ads/blobs.py
+#
+# Almacenamiento direccionado por contenido (deduplicado) de imágenes.
+# Cada fichero procesado es un ImageBlob identificado por el SHA-256 de sus
+# bytes; varios AdImage pueden apuntar al mismo blob. El blob lleva un
+# contador de referencias y sus ficheros sólo se borran al soltar la última.
+#
+# Este módulo sólo toca la DB: quien llama decide cómo guardar/borrar ficheros.
+import hashlib
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.models import AdImage, AdImageRendition, ImageBlob
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def find_by_raw_hash(db: Session, raw_sha256: str) -> Optional[ImageBlob]:
+    return db.query(ImageBlob).filter(ImageBlob.raw_sha256 == raw_sha256).first()
+
+
+def find_by_hash(db: Session, sha256: str) -> Optional[ImageBlob]:
+    return db.query(ImageBlob).filter(ImageBlob.sha256 == sha256).first()
+
+
+def acquire(db: Session, blob: ImageBlob) -> bool:
+    """
+    Suma una referencia (UPDATE atómico en la DB, no read-modify-write).
+    Devuelve False si el blob ya no existe: otra transacción soltó su última
+    referencia y lo borró después de que lo leyéramos (sus ficheros van a la
+    cola de borrado). SQLite no hace cumplir la FK, así que hay que mirarlo aquí.
+    """
+    updated = db.query(ImageBlob).filter(ImageBlob.id == blob.id).update(
+        {ImageBlob.refcount: ImageBlob.refcount + 1}, synchronize_session=False
+    )
+    return updated == 1
+
+
+def image_from_blob(db: Session, blob: ImageBlob, ad_id: int) -> Optional[AdImage]:
+    """
+    Nuevo AdImage que reutiliza un blob existente (sin procesar ni escribir nada):
+    copia URL y variantes de otra imagen que ya apunte al mismo blob.
+    Suma la referencia. Devuelve None si no hay ninguna imagen de referencia
+    o si el blob se ha borrado entretanto (ver acquire).
+    """
+    sibling = db.query(AdImage).filter(AdImage.blob_id == blob.id).first()
+    if sibling is None or not acquire(db, blob):
+        return None
+    image = AdImage(
+        url=blob.url,
+        ad_id=ad_id,
+        blob_id=blob.id,
+        renditions_version=sibling.renditions_version,
+        phash=sibling.phash,
+        placeholder=sibling.placeholder,
+        width=sibling.width,
+        height=sibling.height,
+        bytes=sibling.bytes,
+        format=sibling.format,
+        sha256=sibling.sha256,
+    )
+    for r in sibling.renditions:
+        image.renditions.append(AdImageRendition(
+            width=r.width, height=r.height, format=r.format, url=r.url,
+        ))
+    return image
+
+
+def release_image(db: Session, image: AdImage) -> List[str]:
+    """
+    Suelta la referencia de `image` a su blob (la fila AdImage la borra quien llama).
+    Devuelve las URLs que ya no usa nadie y hay que borrar del almacenamiento:
+    todas si era la última referencia (o una imagen antigua sin blob), ninguna si no.
+    """
+    urls = image.all_urls
+    if image.blob_id is None:
+        return urls
+
+    db.query(ImageBlob).filter(ImageBlob.id == image.blob_id).update(
+        {ImageBlob.refcount: ImageBlob.refcount - 1}, synchronize_session=False
+    )
+    remaining = db.query(ImageBlob.refcount).filter(ImageBlob.id == image.blob_id).scalar()
+    if remaining is not None and remaining > 0:
+        return []
+    db.query(ImageBlob).filter(ImageBlob.id == image.blob_id).delete(synchronize_session=False)
+    return urls
+
+
+def referenced_urls(db: Session, urls: Iterable[str]) -> Set[str]:
+    """Las de `urls` que todavía usa alguna fila (imagen, variante o blob)."""
+    urls = list(dict.fromkeys(u for u in urls if u))
+    used: Set[str] = set()
+    if not urls:
+        return used
+    for model in (AdImage, AdImageRendition, ImageBlob):
+        used.update(u for (u,) in db.query(model.url).filter(model.url.in_(urls)).all())
+    return used
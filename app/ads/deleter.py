@@ -0,0 +1,199 @@
+# app/ads/deleter.py
+#
+# Borrado diferido de ficheros de imagen. Los endpoints que borran anuncios,
+# imágenes o usuarios no tocan el almacenamiento: apuntan las URLs que quedan
+# sin uso en la tabla pending_deletions dentro de su propia transacción
+# (enqueue_deletions antes del commit) y responden en cuanto la DB confirma.
+# Si el commit falla no queda nada apuntado; si el proceso muere después, los
+# pendientes siguen en la tabla.
+#
+# Este borrador (una tarea asyncio por proceso de la app, como el worker de
+# imágenes) vacía la tabla por lotes: agrupa por backend y usa el borrado en
+# bloque de cada uno (DeleteObjects en S3, delete_resources en Cloudinary).
+# Varios procesos pueden compartir la tabla: cada lote se reclama con un
+# UPDATE condicional y un lease (claimed_at); un fallo deja el lote para
+# reintentarlo cuando caduca el lease, hasta MAX_ATTEMPTS.
+#
+# Con blobs direccionados por contenido una URL borrada puede volver a subirse
+# antes de que se vacíe la cola: justo antes de borrar se comprueba que
+# ninguna fila la usa y, si la usa, se descarta el pendiente. Con cada lote
+# borrado se invalidan también sus variantes de /img (app/ads/resize.py).
+#
+# Variables de entorno:
+#   DELETER_BATCH = URLs por lote (por defecto: 500)
+#   DELETER_POLL  = segundos entre sondeos de la tabla (por defecto: 10)
+#   DELETER_LEASE = segundos antes de reintentar un lote reclamado (por defecto: 300)
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import PendingDeletion
+from app.ads.blobs import referenced_urls
+from app.ads.resize import drop_variants
+from app.ads.storage import StorageError, owner_of
+
+DELETER_BATCH = int(os.getenv("DELETER_BATCH", "500") or 500)
+POLL_SECONDS = float(os.getenv("DELETER_POLL", "10") or 10)
+LEASE_SECONDS = float(os.getenv("DELETER_LEASE", "300") or 300)
+MAX_ATTEMPTS = 5
+
+_task: Optional["asyncio.Task"] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+def enqueue_deletions(db: Session, urls: Iterable[str]) -> int:
+    """Apunta URLs para borrar (sin commit: entra en la transacción de quien llama)."""
+    urls = list(dict.fromkeys(u for u in urls if u))
+    db.add_all(PendingDeletion(url=u) for u in urls)
+    return len(urls)
+
+
+def notify() -> None:
+    """Despierta al borrador de este proceso (hay pendientes recién confirmados)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+# ======================
+#   LOTES
+# ======================
+def _claimable(now: datetime):
+    expired = now - timedelta(seconds=LEASE_SECONDS)
+    return (PendingDeletion.attempts < MAX_ATTEMPTS) & (
+        PendingDeletion.claimed_at.is_(None) | (PendingDeletion.claimed_at < expired)
+    )
+
+
+def _claim(limit: int) -> List[Tuple[int, str]]:
+    """
+    Reclama un lote: UPDATE condicional de todo el lote y relectura por
+    claimed_at (el sello de este reclamo), a prueba de varios procesos.
+    Descarta en el acto las URLs que vuelve a usar alguna fila.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        ids = [
+            i for (i,) in db.query(PendingDeletion.id)
+            .filter(_claimable(now)).order_by(PendingDeletion.id).limit(limit).all()
+        ]
+        if not ids:
+            return []
+        db.query(PendingDeletion).filter(PendingDeletion.id.in_(ids), _claimable(now)).update(
+            {PendingDeletion.claimed_at: now, PendingDeletion.attempts: PendingDeletion.attempts + 1},
+            synchronize_session=False,
+        )
+        db.commit()
+        rows = db.query(PendingDeletion.id, PendingDeletion.url).filter(
+            PendingDeletion.id.in_(ids), PendingDeletion.claimed_at == now
+        ).all()
+        used = referenced_urls(db, [u for _, u in rows])
+        if used:
+            _finish(db, [i for i, u in rows if u in used])
+            rows = [(i, u) for i, u in rows if u not in used]
+        return rows
+    finally:
+        db.close()
+
+
+def _finish(db: Session, ids: List[int]) -> None:
+    if ids:
+        db.query(PendingDeletion).filter(PendingDeletion.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+
+
+def _done(ids: List[int]) -> None:
+    db = SessionLocal()
+    try:
+        _finish(db, ids)
+    finally:
+        db.close()
+
+
+def _failed(ids: List[int], error: str) -> None:
+    """Se queda reclamado: se reintenta cuando caduque el lease."""
+    db = SessionLocal()
+    try:
+        db.query(PendingDeletion).filter(PendingDeletion.id.in_(ids)).update(
+            {PendingDeletion.error: error[:500]}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def drain_once(limit: int = DELETER_BATCH) -> int:
+    """Borra un lote. Devuelve cuántos pendientes se han procesado."""
+    rows = await run_in_threadpool(_claim, limit)
+    if not rows:
+        return 0
+
+    groups: Dict[int, tuple] = {}  # id(backend) -> (backend, [(pending_id, clave)])
+    foreign: List[int] = []
+    for pending_id, url in rows:
+        backend, key = owner_of(url)
+        if backend is None:
+            foreign.append(pending_id)  # URL ajena (p.ej. backend ya retirado): nada que borrar
+            continue
+        groups.setdefault(id(backend), (backend, []))[1].append((pending_id, key))
+
+    done = list(foreign)
+    for backend, items in groups.values():
+        ids = [i for i, _ in items]
+        keys = list(dict.fromkeys(k for _, k in items))
+        try:
+            await backend.delete_many(keys)
+            await drop_variants(keys)
+            done.extend(ids)
+        except (StorageError, httpx.HTTPError, OSError) as e:
+            print(f"[storage] No se pudieron borrar {len(keys)} objetos de {backend.name}: {e}")
+            await run_in_threadpool(_failed, ids, f"{type(e).__name__}: {e}")
+    await run_in_threadpool(_done, done)
+    return len(rows)
+
+
+# ======================
+#   TAREA DE FONDO
+# ======================
+async def _run() -> None:
+    while True:
+        try:
+            # Mientras salgan lotes llenos se sigue sin esperar
+            while await drain_once() >= DELETER_BATCH:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[storage] Error en el borrador de ficheros: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_deleter() -> None:
+    """Arranca el borrador en el event loop actual (lifespan de la app)."""
+    global _task, _wakeup
+    if _task is not None:
+        return
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run(), name="storage-deleter")
+
+
+async def stop_deleter() -> None:
+    global _task, _wakeup
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _wakeup = None
@@ -0,0 +1,213 @@
+# app/ads/encoder.py
+#
+# Codificador adaptativo de la imagen principal (Pillow puro, sin efectos
+# secundarios: se ejecuta en los procesos del pool).
+#
+# 1) Formato según el contenido, no según el fichero subido:
+#      foto sin transparencia          -> IMAGE_PHOTO_FORMAT (JPEG por defecto)
+#      foto con transparencia          -> WEBP (con alfa, con pérdida)
+#      gráfico plano (pocos colores)   -> PNG sin pérdida (paleta si cabe en 256)
+#    Un PNG "plano" que aun así supera el presupuesto se trata como foto.
+# 2) Calidad buscada (búsqueda binaria sobre QUALITY_STEPS) en vez de fija:
+#      - la más baja que alcanza IMAGE_SSIM_TARGET (las imágenes fáciles
+#        pesan menos y las pequeñas no se comprimen de más);
+#      - y, si aun así supera IMAGE_BYTE_BUDGET, la más alta que cabe.
+#    El SSIM se calcula sobre la luminancia en bloques de 8x8 con operaciones
+#    de Pillow en C (sin numpy).
+#
+# Variables de entorno:
+#   IMAGE_OUTPUT_FORMAT = auto | keep   (por defecto: auto; keep = formato de la subida)
+#   IMAGE_PHOTO_FORMAT  = JPEG | WEBP   (por defecto: JPEG, el más compatible)
+#   IMAGE_BYTE_BUDGET   = bytes máximos de la imagen principal (por defecto: 400000; 0 = sin límite)
+#   IMAGE_SSIM_TARGET   = SSIM mínimo frente a la imagen saneada (por defecto: 0.98; 0 = calidad fija)
+import io
+import os
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from PIL import Image, ImageMath
+
+OUTPUT_FORMAT = (os.getenv("IMAGE_OUTPUT_FORMAT", "auto") or "auto").strip().lower()
+PHOTO_FORMAT = (os.getenv("IMAGE_PHOTO_FORMAT", "JPEG") or "JPEG").strip().upper()
+BYTE_BUDGET = int(os.getenv("IMAGE_BYTE_BUDGET", "400000") or 0)
+SSIM_TARGET = float(os.getenv("IMAGE_SSIM_TARGET", "0.98") or 0)
+
+# Calidades candidatas (de menor a mayor) y la fija cuando no hay objetivo de SSIM
+QUALITY_STEPS = (40, 50, 60, 65, 70, 75, 80, 82, 85, 90, 92)
+DEFAULT_QUALITY = {"JPEG": 85, "WEBP": 82}
+# Gráfico plano: como mucho tantos colores distintos en una miniatura sin mezclar
+FLAT_MAX_COLORS = 512
+FLAT_SAMPLE_SIDE = 256
+SSIM_BLOCK = 8
+
+
+@dataclass(frozen=True)
+class Encoded:
+    data: bytes
+    format: str
+    quality: Optional[int] = None  # None = sin pérdida
+    ssim: Optional[float] = None
+
+
+# ======================
+#   CONTENIDO
+# ======================
+def has_alpha(img: Image.Image) -> bool:
+    """True si hay algún píxel no opaco (no basta con que el modo tenga canal alfa)."""
+    if img.mode in ("RGBA", "LA", "PA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    return img.mode == "P" and "transparency" in img.info
+
+
+def is_flat(img: Image.Image) -> bool:
+    """Gráfico, captura o logotipo (pocos colores) frente a fotografía."""
+    if img.mode in ("I", "F") or img.mode.startswith("I;"):
+        # getcolors no cuenta enteros/flotantes (clean los normaliza antes)
+        return False
+    sample = img
+    if max(img.size) > FLAT_SAMPLE_SIDE:
+        # NEAREST: no inventa colores intermedios al reducir
+        sample = img.copy()
+        sample.thumbnail((FLAT_SAMPLE_SIDE, FLAT_SAMPLE_SIDE), Image.Resampling.NEAREST)
+    return sample.getcolors(FLAT_MAX_COLORS) is not None
+
+
+def choose_format(img: Image.Image, alpha: bool) -> str:
+    if is_flat(img):
+        return "PNG"
+    return "WEBP" if alpha or PHOTO_FORMAT == "WEBP" else "JPEG"
+
+
+# ======================
+#   SSIM
+# ======================
+def _mul(a: Image.Image, b: Image.Image) -> Image.Image:
+    return ImageMath.lambda_eval(lambda e: e["a"] * e["b"], a=a, b=b)
+
+
+def _mean(img: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    return img.resize(size, Image.Resampling.BOX)
+
+
+class SsimReference:
+    """Estadísticos de la imagen de referencia, calculados una sola vez por búsqueda."""
+
+    C1 = (0.01 * 255) ** 2
+    C2 = (0.03 * 255) ** 2
+
+    def __init__(self, img: Image.Image):
+        self.x = img.convert("L").convert("F")
+        w, h = self.x.size
+        self.size = (max(1, w // SSIM_BLOCK), max(1, h // SSIM_BLOCK))
+        self.mx = _mean(self.x, self.size)
+        self.mxx = _mean(_mul(self.x, self.x), self.size)
+
+    def compare(self, other: Image.Image) -> float:
+        y = other.convert("L").convert("F")
+        my = _mean(y, self.size)
+        myy = _mean(_mul(y, y), self.size)
+        mxy = _mean(_mul(self.x, y), self.size)
+        c1, c2 = self.C1, self.C2
+        ssim_map = ImageMath.lambda_eval(
+            lambda e: ((2 * e["mx"] * e["my"] + c1) * (2 * (e["mxy"] - e["mx"] * e["my"]) + c2))
+            / ((e["mx"] * e["mx"] + e["my"] * e["my"] + c1)
+               * (e["mxx"] - e["mx"] * e["mx"] + e["myy"] - e["my"] * e["my"] + c2)),
+            mx=self.mx, my=my, mxx=self.mxx, myy=myy, mxy=mxy,
+        )
+        # Media de todo el mapa (ImageStat no sirve para imágenes "F")
+        return ssim_map.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+
+
+# ======================
+#   CODIFICACIÓN
+# ======================
+def _save(img: Image.Image, fmt: str, quality: Optional[int] = None, fast: bool = False) -> bytes:
+    """`fast`: ajustes rápidos para la búsqueda (el resultado final siempre es igual o menor)."""
+    out = io.BytesIO()
+    extra = {}
+    if img.info.get("icc_profile"):
+        extra["icc_profile"] = img.info["icc_profile"]
+    if fmt == "JPEG":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(out, format="JPEG", quality=quality, optimize=not fast, progressive=not fast, **extra)
+    elif fmt == "WEBP":
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if has_alpha(img) else "RGB")
+        img.save(out, format="WEBP", quality=quality, method=4 if fast else 6, **extra)
+    else:
+        img.save(out, format="PNG", optimize=True, **extra)
+    return out.getvalue()
+
+
+def _png(img: Image.Image) -> bytes:
+    """PNG sin pérdida; con paleta si la imagen tiene como mucho 256 colores."""
+    if img.mode in ("RGB", "RGBA") and img.getcolors(256) is not None:
+        pal = img.quantize(256, method=Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT)
+        # Sólo si la paleta es exacta (la cuantización no debe perder nada)
+        if pal.convert(img.mode).tobytes() == img.tobytes():
+            pal.info = dict(img.info)
+            return _save(pal, "PNG")
+    return _save(img, "PNG")
+
+
+def _bsearch(lo: int, hi: int, ok: Callable[[int], bool]) -> int:
+    """Primer índice en [lo, hi] que cumple `ok` (monótono); hi + 1 si ninguno."""
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if ok(mid):
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    return lo
+
+
+def encode_lossy(img: Image.Image, fmt: str, budget: int = BYTE_BUDGET, ssim_target: float = SSIM_TARGET) -> Encoded:
+    """Búsqueda de calidad: la mínima que alcanza el SSIM objetivo, limitada por el presupuesto."""
+    cache = {}
+
+    def attempt(i: int) -> Tuple[bytes, Optional[float]]:
+        if i not in cache:
+            cache[i] = (_save(img, fmt, QUALITY_STEPS[i], fast=True), None)
+        return cache[i]
+
+    last = len(QUALITY_STEPS) - 1
+    if ssim_target > 0:
+        ref = SsimReference(img)
+
+        def good_enough(i: int) -> bool:
+            data, score = attempt(i)
+            if score is None:
+                with Image.open(io.BytesIO(data)) as decoded:
+                    score = ref.compare(decoded)
+                cache[i] = (data, score)
+            return score >= ssim_target
+
+        best = min(_bsearch(0, last, good_enough), last)
+    else:
+        best = QUALITY_STEPS.index(DEFAULT_QUALITY[fmt])
+
+    if budget > 0 and len(attempt(best)[0]) > budget:
+        # Mayor calidad (<= la elegida) que cabe en el presupuesto; si ni la mínima cabe, la mínima
+        first_too_big = _bsearch(0, best, lambda i: len(attempt(i)[0]) > budget)
+        best = max(first_too_big - 1, 0)
+
+    data = _save(img, fmt, QUALITY_STEPS[best])
+    return Encoded(data, fmt, QUALITY_STEPS[best], attempt(best)[1])
+
+
+def encode_adaptive(img: Image.Image, source_fmt: str, keep_format: bool = False) -> Encoded:
+    """Codifica la imagen ya saneada eligiendo formato (salvo `keep_format`) y calidad."""
+    alpha = has_alpha(img)
+    if keep_format or OUTPUT_FORMAT == "keep":
+        fmt = source_fmt
+    else:
+        fmt = choose_format(img, alpha)
+
+    if fmt == "PNG":
+        data = _png(img)
+        if keep_format or OUTPUT_FORMAT == "keep" or BYTE_BUDGET <= 0 or len(data) <= BYTE_BUDGET:
+            return Encoded(data, "PNG")
+        # Demasiados bytes para ser un gráfico: mejor con pérdida
+        fmt = "WEBP" if alpha or PHOTO_FORMAT == "WEBP" else "JPEG"
+    return encode_lossy(img, fmt)
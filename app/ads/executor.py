@@ -0,0 +1,239 @@
+# app/ads/executor.py
+#
+# Ejecutor dedicado para el procesado de imágenes (Pillow) fuera del event loop.
+# Por defecto es un pool de procesos: decode + LANCZOS + optimize=True no
+# bloquean ni compiten por el GIL con login/listados del mismo worker.
+#
+# Variables de entorno:
+#   IMAGE_EXECUTOR = process | thread   (por defecto: process)
+#   IMAGE_WORKERS  = nº de procesos/hilos (por defecto: min(4, nº CPUs))
+#   IMAGE_CONCURRENCY = imágenes en vuelo a la vez en todo el worker, sumando
+#                       todas las peticiones (por defecto: 2 x IMAGE_WORKERS)
+#   IMAGE_MEMORY_BUDGET_MB = memoria de píxeles decodificados en vuelo a la vez
+#                            en todo el worker (por defecto: 512)
+#   IMAGE_MEMORY_WAIT = segundos que una petición espera turno en el presupuesto
+#                       antes de responder 503 + Retry-After (por defecto: 10; 0 = no esperar)
+#
+# IMAGE_CONCURRENCY cuenta imágenes, pero una de 8000x8000 ocupa decodificada
+# lo que cien fotos de móvil: el presupuesto de memoria reserva, antes de
+# decodificar, ancho x alto x canales (leídos de la cabecera) y pone en cola lo
+# que no cabe. El uso actual se ve en /healthz y en /api/admin/images/memory.
+import asyncio
+import collections
+import math
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional, TypeVar
+
+from app.ads.images import ProcessedImage, process_image
+
+T = TypeVar("T")
+
+IMAGE_EXECUTOR = os.getenv("IMAGE_EXECUTOR", "process").strip().lower()
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0") or 0) or min(4, os.cpu_count() or 1)
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", "0") or 0) or IMAGE_WORKERS * 2
+MEMORY_BUDGET_BYTES = int(float(os.getenv("IMAGE_MEMORY_BUDGET_MB", "512") or 512) * 1024 * 1024)
+MEMORY_WAIT_SECONDS = float(os.getenv("IMAGE_MEMORY_WAIT", "10") or 0)
+
+_executor: Optional[Executor] = None
+_lock = threading.Lock()
+# Un semáforo por event loop (asyncio.Semaphore queda ligado al loop que lo usa)
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _build_executor() -> Executor:
+    if IMAGE_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="img")
+    # "spawn": no heredamos hilos/conexiones del servidor en los procesos hijos
+    return ProcessPoolExecutor(
+        max_workers=IMAGE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def get_executor() -> Executor:
+    """Devuelve el ejecutor compartido (se crea perezosamente en el primer uso)."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = _build_executor()
+    return _executor
+
+
+def global_limiter() -> asyncio.Semaphore:
+    """Tope global de imágenes en proceso en este worker (todas las peticiones)."""
+    loop = asyncio.get_running_loop()
+    sem = _limiters.get(loop)
+    if sem is None:
+        sem = _limiters[loop] = asyncio.Semaphore(IMAGE_CONCURRENCY)
+    return sem
+
+
+# ======================
+#   PRESUPUESTO DE MEMORIA
+# ======================
+class MemoryBudgetExceeded(Exception):
+    """No hubo sitio en el presupuesto a tiempo; `retry_after` en segundos."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Presupuesto de memoria de imágenes agotado (reintentar en {retry_after}s)")
+        self.retry_after = retry_after
+
+
+class PixelBudget:
+    """
+    Semáforo con peso (bytes de píxeles decodificados) para todo el proceso.
+    Los turnos se dan en orden de llegada: una imagen grande en cola no se
+    queda sin sitio porque las pequeñas la adelanten. Un coste mayor que el
+    presupuesto entero se recorta para que pueda pasar sola.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.used = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.granted = 0
+        self.rejected = 0
+        self.avg_hold = 0.0  # media móvil de lo que dura una reserva (s)
+        self._lock = threading.Lock()
+        # [coste, future, concedido]: el future es del event loop que espera
+        self._waiters: "collections.deque[list]" = collections.deque()
+
+    def _grant(self, cost: int) -> None:
+        self.used += cost
+        self.in_flight += 1
+        self.granted += 1
+        self.peak = max(self.peak, self.used)
+
+    def _wake(self) -> None:
+        while self._waiters and self.used + self._waiters[0][0] <= self.capacity:
+            waiter = self._waiters.popleft()
+            self._grant(waiter[0])
+            waiter[2] = True
+            fut = waiter[1]
+            fut.get_loop().call_soon_threadsafe(_resolve, fut)
+
+    def retry_after(self) -> int:
+        return max(1, min(60, math.ceil(self.avg_hold * (1 + len(self._waiters)))))
+
+    async def acquire(self, cost: int, timeout: Optional[float] = None) -> int:
+        """Reserva `cost` bytes (espera hasta `timeout` s; None = sin límite). Devuelve lo reservado."""
+        cost = max(1, min(int(cost), self.capacity))
+        with self._lock:
+            if not self._waiters and self.used + cost <= self.capacity:
+                self._grant(cost)
+                return cost
+            if timeout is not None and timeout <= 0:
+                self.rejected += 1
+                raise MemoryBudgetExceeded(self.retry_after())
+            waiter = [cost, asyncio.get_running_loop().create_future(), False]
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter[2]:
+                    if isinstance(e, asyncio.TimeoutError):
+                        return cost  # se concedió justo al caducar: nos lo quedamos
+                    self._release_locked(cost)
+                else:
+                    self._waiters.remove(waiter)
+                    self._wake()  # quizá los de detrás sí caben
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.rejected += 1
+                        raise MemoryBudgetExceeded(self.retry_after())
+            raise
+        return cost
+
+    def _release_locked(self, cost: int, held: Optional[float] = None) -> None:
+        self.used -= cost
+        self.in_flight -= 1
+        if held is not None:
+            self.avg_hold = held if not self.avg_hold else 0.8 * self.avg_hold + 0.2 * held
+        self._wake()
+
+    def release(self, cost: int, held: Optional[float] = None) -> None:
+        with self._lock:
+            self._release_locked(cost, held)
+
+    @asynccontextmanager
+    async def reserve(self, cost: int, timeout: Optional[float] = MEMORY_WAIT_SECONDS) -> AsyncIterator[None]:
+        held = await self.acquire(cost, timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(held, time.monotonic() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "budget_bytes": self.capacity,
+                "used_bytes": self.used,
+                "used_ratio": round(self.used / self.capacity, 3),
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters),
+                "waiting_bytes": sum(w[0] for w in self._waiters),
+                "peak_bytes": self.peak,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "avg_hold_seconds": round(self.avg_hold, 3),
+            }
+
+
+def _resolve(fut: "asyncio.Future") -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+_budget = PixelBudget(MEMORY_BUDGET_BYTES)
+
+
+def memory_budget() -> PixelBudget:
+    """Presupuesto de píxeles decodificados compartido por todo el proceso."""
+    return _budget
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Hook de cierre para el lifespan de la app."""
+    global _executor
+    with _lock:
+        ex, _executor = _executor, None
+    if ex is not None:
+        ex.shutdown(wait=wait, cancel_futures=True)
+
+
+async def run_image_job(fn: Callable[..., T], *args) -> T:
+    """
+    Ejecuta una función pura de imagen (módulo importable, argumentos
+    serializables) en el ejecutor compartido.
+    """
+    loop = asyncio.get_running_loop()
+    ex = get_executor()
+    try:
+        return await loop.run_in_executor(ex, fn, *args)
+    except BrokenProcessPool:
+        # Un proceso murió (p.ej. OOM): descartamos el pool para que el
+        # siguiente uso cree uno nuevo y propagamos el error.
+        global _executor
+        with _lock:
+            if _executor is ex:
+                _executor = None
+        ex.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+async def process_image_async(buf: bytes) -> ProcessedImage:
+    """
+    Procesa una subida en el ejecutor y devuelve bytes codificados + metadatos.
+    Lanza ImageError (imagen inválida) tal cual la lanza el pipeline.
+    """
+    return await run_image_job(process_image, buf)
@@ -0,0 +1,272 @@
+# app/ads/images.py
+#
+# Pipeline de imágenes de anuncios (Pillow puro, sin FastAPI ni DB).
+# Se importa tanto desde las rutas como desde los procesos del pool
+# (app/ads/executor.py), por eso no debe tener efectos secundarios.
+import base64
+import hashlib
+import io
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+
+from app.ads.encoder import BYTE_BUDGET, encode_adaptive
+from app.ads.renditions import Rendition, build_renditions
+
+# --- Reglas de imágenes ---
+ALLOWED_PIL_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+MAX_W = 8000
+MAX_H = 8000
+TARGET_MAX_SIDE = 2048
+
+# Metadatos que se conservan al re-codificar (el resto se descarta)
+ALLOWED_INFO_KEYS = ("icc_profile",)
+# Metadatos que obligan a re-codificar (pueden llevar GPS, cámara, etc.)
+PRIVATE_INFO_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "photoshop")
+# Formatos que pueden guardarse tal cual si ya cumplen las reglas
+PASSTHROUGH_FORMATS = {"JPEG", "WEBP"}
+# JPEG: si el lado mayor es >= TARGET_MAX_SIDE * este factor, se reduce en el
+# propio decodificador (DCT 1/2, 1/4, 1/8) antes del LANCZOS final
+JPEG_DRAFT_MIN_RATIO = 2.0
+# Modos con los que trabajan el redimensionado, los codificadores y las variantes
+SAFE_MODES = ("L", "LA", "RGB", "RGBA")
+# Placeholder (LQIP) que va en los listados: miniatura de este lado mayor en data URI
+LQIP_SIDE = 16
+LQIP_QUALITY = 40
+
+
+class ImageError(ValueError):
+    """Imagen rechazada. El mensaje se muestra tal cual al usuario (HTTP 400)."""
+
+
+@dataclass(frozen=True)
+class ProcessedImage:
+    data: bytes
+    format: str
+    width: int
+    height: int
+    passthrough: bool
+    renditions: Tuple[Rendition, ...] = ()
+    sha256: str = ""  # hash de `data` (clave del almacenamiento deduplicado)
+    phash: str = ""   # hash perceptual (dHash, hex) para detectar casi-duplicados
+    source_bytes: int = 0  # tamaño de la subida original (para medir el ahorro)
+    quality: Optional[int] = None  # calidad elegida por el codificador (None = sin pérdida o tal cual)
+    placeholder: str = ""  # LQIP: miniatura WebP de LQIP_SIDE px en data URI
+
+
+def open_validate(buf: bytes) -> Tuple[Image.Image, str]:
+    """Abre la imagen (solo cabecera) y valida formato y dimensiones."""
+    try:
+        bio = io.BytesIO(buf)
+        img = Image.open(bio)
+    except UnidentifiedImageError:
+        raise ImageError("El archivo no es una imagen válida.")
+    except Image.DecompressionBombError:
+        # Cabecera con dimensiones enormes (Pillow se niega a abrirla)
+        raise ImageError("Dimensiones de entrada demasiado grandes.")
+
+    fmt = (img.format or "").upper()
+    if fmt not in ALLOWED_PIL_FORMATS:
+        raise ImageError(f"Formato no permitido: {fmt or 'desconocido'} (solo JPG/PNG/WebP).")
+
+    w, h = img.size
+    if w > MAX_W or h > MAX_H:
+        raise ImageError(f"Dimensiones de entrada demasiado grandes ({w}x{h}).")
+    return img, fmt
+
+
+def decoded_bytes(buf: bytes) -> int:
+    """
+    Memoria de la imagen decodificada (ancho x alto x canales), leída de la
+    cabecera sin decodificar. Las paletas cuentan como RGBA (clean las
+    convierte). 0 si ni siquiera se puede leer la cabecera.
+    """
+    try:
+        with Image.open(io.BytesIO(buf)) as img:
+            w, h = img.size
+            channels = 4 if img.mode in ("P", "PA") else len(img.getbands())
+    except (UnidentifiedImageError, OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        return 0
+    return w * h * channels
+
+
+def decode(img: Image.Image) -> None:
+    # Fuerza la decodificación completa (detecta ficheros truncados/corruptos)
+    try:
+        img.load()
+    except (OSError, SyntaxError, ValueError):
+        raise ImageError("El archivo no es una imagen válida.")
+
+
+def is_passthrough(img: Image.Image, fmt: str, size: int = 0) -> bool:
+    """
+    True si el original ya cumple las reglas y puede guardarse tal cual
+    (sin re-codificar): JPEG/WebP, lado mayor <= TARGET_MAX_SIDE, sin EXIF/XMP,
+    un solo fotograma, modo de color apto para navegador y, si se pasa su
+    tamaño, dentro del presupuesto de bytes (app/ads/encoder.py).
+    """
+    if fmt not in PASSTHROUGH_FORMATS:
+        return False
+    if BYTE_BUDGET > 0 and size > BYTE_BUDGET:
+        return False
+    if max(img.size) > TARGET_MAX_SIDE:
+        return False
+    if getattr(img, "n_frames", 1) > 1:
+        return False
+    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        return False
+    if any(k in img.info for k in PRIVATE_INFO_KEYS):
+        return False
+    # JPEG: cualquier segmento APP1 (EXIF/XMP) descarta el pass-through
+    if any(marker == "APP1" for marker, _ in getattr(img, "applist", [])):
+        return False
+    return True
+
+
+def target_size(w: int, h: int) -> Tuple[int, int]:
+    """Tamaño final para una entrada de w x h (lado mayor <= TARGET_MAX_SIDE)."""
+    max_side = max(w, h)
+    if max_side <= TARGET_MAX_SIDE:
+        return w, h
+    scale = TARGET_MAX_SIDE / float(max_side)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def jpeg_draft(img: Image.Image, fmt: str) -> bool:
+    """
+    Pide al decodificador JPEG que reduzca por 1/2, 1/4 o 1/8 durante la
+    decodificación. Debe llamarse antes de load(). El decodificador nunca baja
+    del tamaño final, así que el LANCZOS posterior da el mismo tamaño exacto.
+    """
+    if fmt != "JPEG":
+        return False
+    W, H = img.size
+    if max(W, H) < TARGET_MAX_SIDE * JPEG_DRAFT_MIN_RATIO:
+        return False
+    img.draft(None, target_size(W, H))
+    return img.size != (W, H)
+
+
+def normalize_mode(img: Image.Image) -> Image.Image:
+    """
+    Lleva a L/LA/RGB/RGBA los modos que el resto del pipeline no admite
+    (LANCZOS, codificadores, getcolors): PNG de 16 bits (I;16, I), flotantes
+    (F), bitonales (1) y cualquier otro raro (CMYK, YCbCr, PA...).
+    """
+    mode = img.mode
+    if mode in SAFE_MODES:
+        return img
+    if mode.startswith("I") or mode == "F":
+        # 16 bits: escalar a 8 (convert("L") recortaría todo por encima de 255)
+        img = img.convert("I") if mode.startswith("I;16") else img
+        hi = img.getextrema()[1] or 0
+        if hi > 255:
+            img = img.point(lambda v: v * (255.0 / 65535 if hi <= 65535 else 255.0 / hi))
+        return img.convert("L")
+    if mode == "1":
+        return img.convert("L")
+    alpha = mode.endswith(("A", "a")) or "transparency" in img.info
+    return img.convert("RGBA" if alpha else "RGB")
+
+
+def clean(img: Image.Image, fmt: str, allow_draft: bool = True) -> Image.Image:
+    """
+    Normaliza modo, reduce a TARGET_MAX_SIDE y descarta metadatos.
+    Todo ocurre sobre el buffer decodificado (C), sin pasar píxeles a Python.
+    En JPEG muy grandes la primera reducción la hace el decodificador (draft).
+    """
+    new_size = target_size(*img.size)
+    if allow_draft:
+        jpeg_draft(img, fmt)
+    decode(img)
+    keep = {k: img.info[k] for k in ALLOWED_INFO_KEYS if k in img.info}
+
+    out = img
+    if fmt == "JPEG" and out.mode not in ("RGB", "L"):
+        out = out.convert("RGB")
+    elif fmt in ("PNG", "WEBP") and out.mode == "P":
+        out = out.convert("RGBA")
+    out = normalize_mode(out)
+
+    if out.size != new_size:
+        out = out.resize(new_size, Image.LANCZOS)
+
+    # Sólo sobreviven las claves permitidas (EXIF, XMP, comentarios... fuera)
+    out.info = keep
+    return out
+
+
+def open_validate_clean(buf: bytes) -> Tuple[Image.Image, str]:
+    img, fmt = open_validate(buf)
+    return clean(img, fmt), fmt
+
+
+def choose_ext(fmt: str) -> str:
+    fmt = fmt.upper()
+    if fmt == "JPEG":
+        return ".jpg"
+    if fmt == "PNG":
+        return ".png"
+    if fmt == "WEBP":
+        return ".webp"
+    return ".png"
+
+
+def dhash(img: Image.Image) -> str:
+    """
+    dHash: gris 9x8 y un bit por cada par de píxeles vecinos (¿el izquierdo
+    es más claro?). Robusto a recompresión, escalado y cambios de brillo.
+    """
+    small = img.convert("L")
+    if small.width > 512 or small.height > 512:
+        small.thumbnail((512, 512), Image.Resampling.BOX)
+    px = list(small.resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return f"{value:016x}"
+
+
+def lqip(img: Image.Image) -> str:
+    """
+    Placeholder para mostrar mientras carga la imagen: miniatura WebP de
+    LQIP_SIDE px como data URI (~150-300 bytes). Se pinta escalada con
+    `filter: blur()` en el mismo hueco que la imagen, sin petición extra.
+    """
+    thumb = img.copy()
+    thumb.thumbnail((LQIP_SIDE, LQIP_SIDE), Image.Resampling.BOX)
+    if thumb.mode not in ("RGB", "RGBA"):
+        alpha = thumb.mode in ("LA", "PA") or "transparency" in thumb.info
+        thumb = thumb.convert("RGBA" if alpha else "RGB")
+    out = io.BytesIO()
+    thumb.save(out, format="WEBP", quality=LQIP_QUALITY, method=6)
+    return "data:image/webp;base64," + base64.b64encode(out.getvalue()).decode("ascii")
+
+
+def process_image(buf: bytes, with_renditions: bool = True, keep_format: bool = False) -> ProcessedImage:
+    """
+    Valida y sanea una subida (bytes crudos -> bytes finales + metadatos).
+    Si el original ya cumple las reglas se devuelve sin re-codificar; si no,
+    el codificador adaptativo elige formato (salvo `keep_format`) y calidad.
+    Con with_renditions también genera las variantes responsive a partir
+    del mismo buffer decodificado. Es la función que ejecutan los procesos del pool.
+    """
+    img, fmt = open_validate(buf)
+    quality = None
+    if is_passthrough(img, fmt, len(buf)):
+        decode(img)
+        data, out, passthrough = buf, img, True
+    else:
+        out = clean(img, fmt)
+        encoded = encode_adaptive(out, fmt, keep_format)
+        data, fmt, quality, passthrough = encoded.data, encoded.format, encoded.quality, False
+    w, h = out.size
+    renditions = build_renditions(out, fmt) if with_renditions else ()
+    sha = hashlib.sha256(data).hexdigest()
+    return ProcessedImage(
+        data, fmt, w, h, passthrough, renditions, sha, dhash(out),
+        source_bytes=len(buf), quality=quality, placeholder=lqip(out),
+    )
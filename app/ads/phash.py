@@ -0,0 +1,231 @@
+# app/ads/phash.py
+#
+# Hash perceptual (dHash de 64 bits) de cada imagen y un índice en memoria
+# (BK-tree sobre la distancia de Hamming) para encontrar casi-duplicados:
+# la misma foto re-subida con recompresión, otro tamaño o un recorte leve.
+#
+# El hash se calcula en el pipeline (app/ads/images.py -> dhash, en el pool) y
+# se guarda en AdImage.phash (16 caracteres hex). El índice se construye
+# perezosamente desde la DB, se amplía al ingerir en este proceso y se
+# reconstruye cada PHASH_INDEX_TTL segundos (lo que suban otros procesos).
+# La reconstrucción periódica la hace un hilo en segundo plano, una sola a la
+# vez: las búsquedas siguen usando el árbol anterior hasta que se sustituye, y
+# las altas/bajas que lleguen mientras tanto se aplican también al nuevo.
+# Las bajas no hace falta avisarlas: cada búsqueda comprueba los candidatos
+# contra la DB y purga del índice los que ya no existen.
+#
+# Variables de entorno:
+#   PHASH_MAX_DISTANCE = bits distintos para considerar casi-duplicado (por defecto: 10 de 64)
+#   PHASH_INDEX_TTL    = segundos entre reconstrucciones completas (por defecto: 300)
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import AdImage
+
+PHASH_BITS = 64
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "10") or 10)
+PHASH_INDEX_TTL = float(os.getenv("PHASH_INDEX_TTL", "300") or 300)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    BK-tree para distancia de Hamming. Cada nodo es un hash distinto con el
+    conjunto de imágenes que lo tienen; las bajas vacían el conjunto y el nodo
+    queda como simple enrutador (se limpia en la siguiente reconstrucción).
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self):
+        self.root: Optional[list] = None  # [hash, {ids}, {distancia: hijo}]
+        self.size = 0
+
+    def add(self, h: int, item) -> None:
+        if self.root is None:
+            self.root = [h, {item}, {}]
+            self.size += 1
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                if item not in node[1]:
+                    node[1].add(item)
+                    self.size += 1
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, {item}, {}]
+                self.size += 1
+                return
+            node = child
+
+    def discard(self, h: int, item) -> None:
+        node = self.root
+        while node is not None:
+            d = hamming(h, node[0])
+            if d == 0:
+                if item in node[1]:
+                    node[1].discard(item)
+                    self.size -= 1
+                return
+            node = node[2].get(d)
+
+    def search(self, h: int, radius: int) -> List[Tuple[int, object]]:
+        """[(distancia, item)] con distancia <= radius (poda por desigualdad triangular)."""
+        out = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                out.extend((d, item) for item in node[1])
+            lo, hi = d - radius, d + radius
+            for k, child in node[2].items():
+                if lo <= k <= hi:
+                    stack.append(child)
+        return out
+
+
+class PhashIndex:
+    """Índice de hashes perceptuales de todas las imágenes: item = (image_id, ad_id)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()  # una sola reconstrucción a la vez
+        self._tree = BKTree()
+        self._hashes: Dict[int, Tuple[int, int]] = {}  # image_id -> (hash, ad_id)
+        self._built_at = 0.0
+        # Altas (image_id, hash, ad_id) y bajas (image_id, None, None) que
+        # llegan durante una reconstrucción; None = no hay ninguna en marcha
+        self._journal: Optional[List[Tuple[int, Optional[int], Optional[int]]]] = None
+
+    @staticmethod
+    def _apply(tree: BKTree, hashes: Dict[int, Tuple[int, int]], image_id: int,
+               h: Optional[int], ad_id: Optional[int]) -> None:
+        if h is not None:
+            tree.add(h, (image_id, ad_id))
+            hashes[image_id] = (h, ad_id)
+            return
+        entry = hashes.pop(image_id, None)
+        if entry is not None:
+            tree.discard(entry[0], (image_id, entry[1]))
+
+    def _rebuild(self, db: Session) -> None:
+        with self._lock:
+            self._journal = []
+        try:
+            tree, hashes = BKTree(), {}
+            rows = db.query(AdImage.id, AdImage.ad_id, AdImage.phash).filter(AdImage.phash.isnot(None))
+            for image_id, ad_id, ph in rows.yield_per(5000):
+                self._apply(tree, hashes, image_id, int(ph, 16), ad_id)
+            with self._lock:
+                for op in self._journal:
+                    self._apply(tree, hashes, *op)
+                self._tree, self._hashes = tree, hashes
+                self._built_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def _rebuild_in_background(self) -> None:
+        db = SessionLocal()
+        try:
+            self._rebuild(db)
+        except Exception as e:
+            # Se sigue con el árbol anterior; la próxima búsqueda lo reintenta
+            print(f"[phash] No se pudo reconstruir el índice: {type(e).__name__}: {e}")
+        finally:
+            db.close()
+            self._rebuild_lock.release()
+
+    def ensure_fresh(self, db: Session) -> None:
+        """
+        Sin construir: se construye aquí (quien llegue a la vez espera a esa
+        misma construcción). Caducado: se lanza la reconstrucción en segundo
+        plano, salvo que ya haya una en marcha, y se sigue con el árbol actual.
+        """
+        if not self._built_at:
+            with self._rebuild_lock:
+                if not self._built_at:
+                    self._rebuild(db)
+            return
+        if time.monotonic() - self._built_at > PHASH_INDEX_TTL and self._rebuild_lock.acquire(blocking=False):
+            threading.Thread(target=self._rebuild_in_background, name="phash-rebuild", daemon=True).start()
+
+    def add(self, image_id: int, ad_id: int, phash: Optional[str]) -> None:
+        if not phash:
+            return
+        h = int(phash, 16)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((image_id, h, ad_id))
+            if self._built_at:  # sin construir todavía: ya lo leerá de la DB
+                self._apply(self._tree, self._hashes, image_id, h, ad_id)
+
+    def add_images(self, images: Iterable[AdImage]) -> None:
+        for img in images:
+            self.add(img.id, img.ad_id, img.phash)
+
+    def discard(self, image_ids: Iterable[int]) -> None:
+        with self._lock:
+            for image_id in image_ids:
+                if self._journal is not None:
+                    self._journal.append((image_id, None, None))
+                self._apply(self._tree, self._hashes, image_id, None, None)
+
+    def search(self, phash: str, radius: int = PHASH_MAX_DISTANCE) -> List[Tuple[int, int, int]]:
+        """[(distancia, image_id, ad_id)] ordenado por distancia."""
+        with self._lock:
+            hits = self._tree.search(int(phash, 16), radius)
+        return sorted((d, image_id, ad_id) for d, (image_id, ad_id) in hits)
+
+    def __len__(self) -> int:
+        return self._tree.size
+
+
+phash_index = PhashIndex()
+
+
+def near_duplicate_hints(db: Session, ads, radius: int = PHASH_MAX_DISTANCE) -> Dict[int, List[dict]]:
+    """
+    Para cada anuncio, otros anuncios con alguna imagen casi idéntica:
+    {ad_id: [{"ad_id", "image_id", "of_image_id", "distance"}, ...]} (el mejor
+    candidato por anuncio, de menor a mayor distancia).
+    """
+    phash_index.ensure_fresh(db)
+    hits = []  # (ad_id, distancia, image_id, of_image_id)
+    for ad in ads:
+        for img in ad.images or []:
+            if not img.phash:
+                continue
+            for d, image_id, other_ad in phash_index.search(img.phash, radius):
+                if other_ad != ad.id:
+                    hits.append((ad.id, other_ad, d, image_id, img.id))
+
+    # Los candidatos borrados (en este u otro proceso) se descartan y se purgan
+    candidates: Set[int] = {h[3] for h in hits}
+    alive: Set[int] = set()
+    if candidates:
+        alive = {i for (i,) in db.query(AdImage.id).filter(AdImage.id.in_(candidates)).all()}
+        phash_index.discard(candidates - alive)
+
+    best: Dict[int, Dict[int, dict]] = {ad.id: {} for ad in ads}
+    for ad_id, other_ad, d, image_id, of_image_id in hits:
+        if image_id not in alive:
+            continue
+        current = best[ad_id].get(other_ad)
+        if current is None or d < current["distance"]:
+            best[ad_id][other_ad] = {
+                "ad_id": other_ad, "image_id": image_id, "of_image_id": of_image_id, "distance": d,
+            }
+    return {ad_id: sorted(b.values(), key=lambda h: h["distance"]) for ad_id, b in best.items()}
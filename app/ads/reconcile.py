@@ -0,0 +1,307 @@
+# app/ads/reconcile.py
+#
+# Reconciliador entre la DB y el almacenamiento de imágenes. Detecta:
+#   - huérfanos: objetos del almacenamiento que no referencia ninguna fila
+#     (subidas a medias, borrados que fallaron, el borrado legacy de
+#     /api/auth/admin/delete_image, temporales de escrituras atómicas...)
+#   - colgantes: filas cuya URL apunta a un objeto que ya no existe
+#
+# Ninguno de los dos lados se carga entero en memoria: las URLs salen de la DB
+# ordenadas (cursor en streaming) y el listado del backend también viene
+# ordenado por clave, así que basta un merge de dos iteradores ordenados.
+# Los huérfanos sólo se borran si son más viejos que el periodo de gracia
+# (una subida en curso escribe el fichero antes de hacer commit de la fila) y
+# se vuelven a comprobar contra la DB justo antes de borrarlos.
+#
+# Se usa desde scripts/reconcile_storage.py y como job periódico de la app.
+#
+# Variables de entorno (job periódico):
+#   STORAGE_RECONCILE_HOURS       = horas entre pasadas (por defecto: 0 = desactivado;
+#                                   activarlo en un solo proceso/servicio)
+#   STORAGE_RECONCILE_GRACE_HOURS = antigüedad mínima de un huérfano para borrarlo (por defecto: 24)
+#   STORAGE_RECONCILE_DELETE      = 1 | 0   (por defecto: 1; 0 = sólo informar)
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, collate, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import Ad, AdImage, AdImageRendition, ImageBlob
+from app.ads.blobs import referenced_urls
+from app.ads.resize import drop_variants
+from app.ads.storage import StorageBackend, StoredObject, build_backend
+from app.ads.worker import STATUS_FAILED, STATUS_READY
+
+RECONCILE_HOURS = float(os.getenv("STORAGE_RECONCILE_HOURS", "0") or 0)
+GRACE_HOURS = float(os.getenv("STORAGE_RECONCILE_GRACE_HOURS", "24") or 24)
+RECONCILE_DELETE = os.getenv("STORAGE_RECONCILE_DELETE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+DELETE_BATCH = 500
+# Máximo de elementos que se listan en el informe (los contadores son exactos)
+REPORT_LIMIT = 1000
+MISSING_ERROR = "El fichero no existe en el almacenamiento"
+COLD = "cold"
+
+_task: Optional["asyncio.Task"] = None
+
+
+@dataclass
+class ReconcileReport:
+    backend: str
+    started_at: str
+    grace_hours: float
+    delete: bool
+    db_keys: int = 0
+    stored_objects: int = 0
+    stored_bytes: int = 0
+    orphans: int = 0
+    orphan_bytes: int = 0
+    orphans_recent: int = 0     # huérfanos dentro del periodo de gracia (no se tocan)
+    orphans_deleted: int = 0
+    orphans_rescued: int = 0    # aparecieron en la DB al re-comprobar
+    dangling: int = 0
+    cold: int = 0               # sin fichero en caliente pero en el nivel frío (no es colgante)
+    marked_failed: int = 0
+    skipped_urls: int = 0       # URLs de otro backend (no se pueden comprobar aquí)
+    seconds: float = 0.0
+    orphan_keys: List[dict] = field(default_factory=list)
+    dangling_keys: List[dict] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+# ======================
+#   LADO DB
+# ======================
+def _url_rows(db: Session):
+    """
+    (url, tabla) de todas las filas con fichero, ordenado por URL en orden binario.
+    Las de anuncios y blobs en el nivel frío (app/ads/tiering.py) salen como
+    COLD: su fichero puede no estar en caliente y no es un colgante.
+    """
+    hot_ad = Ad.images_cold_at.is_(None)
+    parts = union_all(
+        select(
+            AdImage.url.label("url"),
+            case((hot_ad, literal("ad_images")), else_=literal(COLD)).label("src"),
+        ).join(Ad, Ad.id == AdImage.ad_id).where(AdImage.url != ""),
+        select(
+            AdImageRendition.url.label("url"),
+            case((hot_ad, literal("ad_image_renditions")), else_=literal(COLD)).label("src"),
+        ).join(AdImage, AdImage.id == AdImageRendition.image_id).join(Ad, Ad.id == AdImage.ad_id),
+        select(
+            ImageBlob.url.label("url"),
+            case((ImageBlob.cold.is_(True), literal(COLD)), else_=literal("image_blobs")).label("src"),
+        ),
+    ).subquery()
+    order = parts.c.url
+    # Mismo orden que las claves del backend (bytes/code points), no el de la locale
+    if db.get_bind().dialect.name == "postgresql":
+        order = collate(parts.c.url, "C")
+    stmt = select(parts.c.url, parts.c.src).order_by(order).execution_options(yield_per=5000)
+    return db.execute(stmt)
+
+
+def iter_db_keys(db: Session, backend: StorageBackend, report: ReconcileReport) -> Iterator[Tuple[str, str, List[str]]]:
+    """(clave, url, [tablas]) únicos y ordenados de las URLs de este backend."""
+    current: Optional[Tuple[str, str, List[str]]] = None
+    for url, src in _url_rows(db):
+        key = backend.key_for(url)
+        if key is None:
+            report.skipped_urls += 1
+            continue
+        if current is not None and current[0] == key:
+            if src not in current[2]:
+                current[2].append(src)
+            continue
+        if current is not None:
+            yield current
+        current = (key, url, [src])
+    if current is not None:
+        yield current
+
+
+def _hidden(key: str) -> bool:
+    """Ficheros ocultos (.gitkeep...) salvo los temporales de escrituras atómicas."""
+    name = key.rsplit("/", 1)[-1]
+    return name.startswith(".") and not name.endswith(".tmp")
+
+
+def _still_unreferenced(backend: StorageBackend, keys: List[str]) -> List[str]:
+    """Filtra las claves que alguna fila ha empezado a usar desde que se leyó la DB."""
+    urls = {backend.url(k): k for k in keys}
+    db = SessionLocal()
+    try:
+        used = referenced_urls(db, urls)
+    finally:
+        db.close()
+    return [k for u, k in urls.items() if u not in used]
+
+
+def _mark_missing(urls: List[str]) -> int:
+    """Imágenes listas cuyo fichero no existe -> failed (dejan de servirse como válidas)."""
+    if not urls:
+        return 0
+    db = SessionLocal()
+    try:
+        n = db.query(AdImage).filter(AdImage.url.in_(urls), AdImage.status == STATUS_READY).update(
+            {AdImage.status: STATUS_FAILED, AdImage.error: MISSING_ERROR},
+            synchronize_session=False,
+        )
+        db.commit()
+        return n
+    finally:
+        db.close()
+
+
+# ======================
+#   MERGE
+# ======================
+async def reconcile(
+    backend: Optional[StorageBackend] = None,
+    *,
+    delete: bool = False,
+    grace_hours: float = GRACE_HOURS,
+    mark_missing: bool = False,
+) -> ReconcileReport:
+    """
+    Una pasada completa. Lee la DB con una sesión síncrona en este mismo hilo:
+    pensado para su propio event loop (CLI o job en un hilo aparte).
+    """
+    backend = backend or build_backend()
+    started = time.monotonic()
+    report = ReconcileReport(
+        backend=backend.name,
+        started_at=datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        grace_hours=grace_hours,
+        delete=delete,
+    )
+    cutoff = time.time() - grace_hours * 3600
+    to_delete: List[str] = []
+    missing_urls: List[str] = []
+
+    async def flush_orphans() -> None:
+        if not to_delete:
+            return
+        keys = _still_unreferenced(backend, to_delete)
+        report.orphans_rescued += len(to_delete) - len(keys)
+        await backend.delete_many(keys)
+        await drop_variants(keys)
+        report.orphans_deleted += len(keys)
+        to_delete.clear()
+
+    async def orphan(obj: StoredObject) -> None:
+        report.orphans += 1
+        report.orphan_bytes += obj.size
+        recent = obj.mtime >= cutoff
+        if recent:
+            report.orphans_recent += 1
+        if len(report.orphan_keys) < REPORT_LIMIT:
+            report.orphan_keys.append({"key": obj.key, "bytes": obj.size, "recent": recent})
+        if delete and not recent:
+            to_delete.append(obj.key)
+            if len(to_delete) >= DELETE_BATCH:
+                await flush_orphans()
+
+    def dangling(key: str, url: str, tables: List[str]) -> None:
+        if all(t == COLD for t in tables):
+            report.cold += 1
+            return
+        report.dangling += 1
+        if len(report.dangling_keys) < REPORT_LIMIT:
+            report.dangling_keys.append({"key": key, "url": url, "tables": tables})
+        if mark_missing and "ad_images" in tables:
+            missing_urls.append(url)
+
+    db = SessionLocal()
+    try:
+        db_iter = iter_db_keys(db, backend, report)
+        db_item = next(db_iter, None)
+        async for obj in backend.list_keys():
+            if _hidden(obj.key):
+                continue
+            report.stored_objects += 1
+            report.stored_bytes += obj.size
+            while db_item is not None and db_item[0] < obj.key:
+                report.db_keys += 1
+                dangling(*db_item)
+                db_item = next(db_iter, None)
+            if db_item is not None and db_item[0] == obj.key:
+                report.db_keys += 1
+                db_item = next(db_iter, None)
+            else:
+                await orphan(obj)
+        while db_item is not None:
+            report.db_keys += 1
+            dangling(*db_item)
+            db_item = next(db_iter, None)
+    finally:
+        db.close()
+
+    await flush_orphans()
+    for i in range(0, len(missing_urls), DELETE_BATCH):
+        report.marked_failed += _mark_missing(missing_urls[i:i + DELETE_BATCH])
+    report.seconds = round(time.monotonic() - started, 3)
+    return report
+
+
+def run_blocking(**kwargs) -> ReconcileReport:
+    """Pasada completa con su propio event loop y su propio cliente del backend."""
+    backend = build_backend()
+
+    async def _main() -> ReconcileReport:
+        try:
+            return await reconcile(backend, **kwargs)
+        finally:
+            await backend.aclose()
+
+    return asyncio.run(_main())
+
+
+# ======================
+#   JOB PERIÓDICO
+# ======================
+def _log(report: ReconcileReport) -> None:
+    print(
+        f"[storage] Reconciliación ({report.backend}): {report.stored_objects} objetos, "
+        f"{report.orphans} huérfanos ({report.orphans_deleted} borrados, {report.orphans_recent} recientes), "
+        f"{report.dangling} URLs sin fichero, {report.seconds}s"
+    )
+
+
+async def _run() -> None:
+    while True:
+        await asyncio.sleep(RECONCILE_HOURS * 3600)
+        try:
+            report = await run_in_threadpool(run_blocking, delete=RECONCILE_DELETE, grace_hours=GRACE_HOURS)
+            _log(report)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[storage] Error en la reconciliación: {e}")
+
+
+def start_reconciler() -> None:
+    """Arranca el job periódico en el event loop actual (lifespan de la app)."""
+    global _task
+    if RECONCILE_HOURS <= 0 or _task is not None:
+        return
+    _task = asyncio.create_task(_run(), name="storage-reconciler")
+
+
+async def stop_reconciler() -> None:
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,139 @@
+# app/ads/renditions.py
+#
+# Variantes responsive (renditions) de cada imagen de anuncio.
+# La especificación está versionada: si cambian anchos/formatos/calidades,
+# sube RENDITION_SPEC_VERSION y ejecuta scripts/backfill_renditions.py.
+import io
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+try:
+    import pillow_avif  # noqa: F401  (plugin AVIF opcional para Pillow < 11.2)
+except ImportError:
+    pass
+
+Image.init()
+AVIF_ENABLED = "AVIF" in Image.SAVE
+
+RENDITION_SPEC_VERSION = 1
+RENDITION_WIDTHS = (160, 480, 1024, 2048)
+# Formatos modernos que se generan siempre (además del formato original)
+RENDITION_FORMATS = ("WEBP", "AVIF") if AVIF_ENABLED else ("WEBP",)
+
+FORMAT_MIME = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "AVIF": "image/avif",
+}
+FORMAT_EXT = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "AVIF": ".avif"}
+
+
+@dataclass(frozen=True)
+class Rendition:
+    width: int
+    height: int
+    format: str
+    data: bytes
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    out = io.BytesIO()
+    if fmt == "JPEG":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+    elif fmt == "PNG":
+        img.save(out, format="PNG", optimize=True)
+    elif fmt == "WEBP":
+        img.save(out, format="WEBP", quality=80, method=4)
+    elif fmt == "AVIF":
+        img.save(out, format="AVIF", quality=55, speed=8)
+    else:
+        raise ValueError(f"Formato de rendition no soportado: {fmt}")
+    return out.getvalue()
+
+
+def target_widths(width: int) -> List[int]:
+    """Anchos a generar para una imagen de `width` px (nunca se amplía)."""
+    return [w for w in RENDITION_WIDTHS if w < width] + [width]
+
+
+def build_renditions(img: Image.Image, fmt: str) -> Tuple[Rendition, ...]:
+    """
+    Genera todas las variantes de una imagen ya saneada (sin metadatos).
+    El formato original a tamaño completo no se incluye: es la imagen principal.
+    Se reduce de mayor a menor reutilizando el paso anterior.
+    """
+    W, H = img.size
+    out: List[Rendition] = []
+    current = img
+    for w in sorted(target_widths(W), reverse=True):
+        if w != current.width:
+            h = max(1, round(H * w / W))
+            current = current.resize((w, h), Image.LANCZOS)
+        formats = list(RENDITION_FORMATS)
+        if w != W:
+            formats.append(fmt)
+        for f in formats:
+            out.append(Rendition(w, current.height, f, _encode(current, f)))
+    return tuple(sorted(out, key=lambda r: (r.format, r.width)))
+
+
+def build_renditions_from_bytes(buf: bytes) -> Tuple[Rendition, ...]:
+    """Igual que build_renditions partiendo de la imagen principal ya guardada."""
+    # Import diferido: images importa este módulo
+    from app.ads.images import normalize_mode
+
+    img = Image.open(io.BytesIO(buf))
+    fmt = (img.format or "PNG").upper()
+    img.load()
+    img = normalize_mode(img)  # PNG de 16 bits guardados antes de normalizar
+    img.info = {}
+    return build_renditions(img, fmt)
+
+
+def render_variant(buf: bytes, width: int, fmt: str) -> Rendition:
+    """
+    Variante a demanda (endpoint /img, app/ads/resize.py) a partir de la
+    imagen guardada. Nunca se amplía: si `width` supera el original se
+    codifica a su ancho. En JPEG con alfa se aplana sobre blanco.
+    """
+    img = Image.open(io.BytesIO(buf))
+    if (img.format or "").upper() not in FORMAT_EXT:
+        raise ValueError(f"Formato de origen no soportado: {img.format}")
+    W, H = img.size
+    w = min(width, W)
+    h = max(1, round(H * w / W))
+    if img.format == "JPEG":
+        img.draft(None, (w, h))  # reducción en el propio decodificador (DCT)
+    img.load()
+
+    if img.mode not in ("RGB", "RGBA") and not (img.mode == "L" and fmt in ("JPEG", "PNG")):
+        alpha = img.mode in ("LA", "PA") or "transparency" in img.info
+        img = img.convert("RGBA" if alpha else "RGB")
+    if fmt == "JPEG" and img.mode == "RGBA":
+        flat = Image.new("RGB", img.size, (255, 255, 255))
+        flat.paste(img, mask=img.getchannel("A"))
+        img = flat
+    if img.size != (w, h):
+        img = img.resize((w, h), Image.LANCZOS)
+    img.info = {}
+    return Rendition(w, h, fmt, _encode(img, fmt))
+
+
+def srcset(image) -> Dict[str, str]:
+    """
+    Estructura srcset de un AdImage: {mime: "url 160w, url 480w, ..."}.
+    Lista para <picture><source type=mime srcSet=...>. La imagen principal
+    figura como rendition de su formato original a ancho completo.
+    """
+    by_mime: Dict[str, List[Tuple[int, str]]] = {}
+    for r in (getattr(image, "renditions", None) or []):
+        by_mime.setdefault(FORMAT_MIME.get(r.format, r.format), []).append((r.width, r.url))
+    return {
+        mime: ", ".join(f"{url} {w}w" for w, url in sorted(items))
+        for mime, items in by_mime.items()
+    }
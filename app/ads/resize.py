@@ -0,0 +1,321 @@
+# app/ads/resize.py
+#
+# Redimensionado a demanda: GET /img/{ancho}/{clave} devuelve la imagen
+# guardada `clave` (la clave del almacenamiento: <sha256>.jpg, ads/ad_3_1.png...)
+# reducida a `ancho` px y en el mejor formato que acepte el navegador
+# (Accept: image/avif > image/webp > formato original).
+#
+#   - Sólo anchos de IMAGE_RESIZE_WIDTHS: con anchos libres cualquiera podría
+#     llenar la caché pidiendo /img/1/, /img/2/... Nunca se amplía.
+#   - Cada variante se genera una vez (Pillow en el pool de app/ads/executor.py)
+#     y se guarda en una caché LRU en disco con tope de bytes: al pasarse se
+#     borran las menos usadas. Los aciertos actualizan el mtime (como mucho una
+#     vez por minuto) para que el orden sobreviva a reinicios.
+#   - Single-flight: si llegan a la vez varias peticiones de una variante que no
+#     está en caché, sólo una la genera y el resto espera su resultado (aunque
+#     la primera petición se cancele). Entre procesos la escritura es atómica
+#     (os.replace): en el peor caso cada proceso la genera una vez.
+#   - Vary: Accept, ETag fuerte y el mismo Cache-Control que /static/images
+#     (inmutable en nombres por contenido).
+#   - Al borrar un fichero del almacenamiento (app/ads/deleter.py,
+#     app/ads/reconcile.py) se borran también sus variantes (drop_variants).
+#
+# Cada proceso lleva su propio índice de la caché; se relee del disco cada
+# IMAGE_CACHE_RESCAN segundos para contar también lo que escriben los demás.
+#
+# Variables de entorno:
+#   IMAGE_RESIZE_WIDTHS   = anchos permitidos, separados por comas (por defecto: los de las renditions)
+#   IMAGE_CACHE_DIR       = carpeta de la caché (por defecto: ./var/img-cache)
+#   IMAGE_CACHE_MAX_BYTES = tope de la caché en bytes (por defecto: 1073741824 = 1 GiB)
+#   IMAGE_CACHE_RESCAN    = segundos entre relecturas del índice (por defecto: 300)
+import asyncio
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import anyio
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from PIL import Image
+from starlette.responses import Response
+
+from app.ads.executor import MemoryBudgetExceeded, global_limiter, memory_budget, run_image_job
+from app.ads.images import decoded_bytes
+from app.ads.renditions import AVIF_ENABLED, FORMAT_EXT, FORMAT_MIME, RENDITION_WIDTHS, render_variant
+from app.ads.serve import IMMUTABLE_CACHE, REVALIDATE_SECONDS, ImageFileResponse, etag_matches, is_immutable
+from app.ads.storage import PROJECT_ROOT, StorageError, read_key, shard_key
+
+RESIZE_WIDTHS = frozenset(
+    int(w) for w in (os.getenv("IMAGE_RESIZE_WIDTHS", "") or ",".join(map(str, RENDITION_WIDTHS))).split(",")
+    if w.strip()
+)
+CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR") or PROJECT_ROOT / "var" / "img-cache")
+CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1 << 30)) or 0)
+RESCAN_SECONDS = float(os.getenv("IMAGE_CACHE_RESCAN", "300") or 300)
+TOUCH_SECONDS = 60.0
+
+# Formato de respuesta si el navegador no acepta AVIF ni WebP (según la extensión)
+FALLBACK_FORMAT = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "JPEG", ".avif": "JPEG"}
+
+router = APIRouter(tags=["images"])
+
+
+# ======================
+#   NEGOCIACIÓN
+# ======================
+def accepts(accept: str, mime: str) -> bool:
+    """True si la cabecera Accept nombra `mime` con q > 0 (los comodines no cuentan)."""
+    for part in accept.split(","):
+        media, _, params = part.partition(";")
+        if media.strip().lower() != mime:
+            continue
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def negotiate(accept: str, fallback: str) -> str:
+    if AVIF_ENABLED and accepts(accept, "image/avif"):
+        return "AVIF"
+    if accepts(accept, "image/webp"):
+        return "WEBP"
+    return fallback
+
+
+# ======================
+#   CACHÉ EN DISCO (LRU)
+# ======================
+class VariantCache:
+    """
+    Índice LRU en memoria de la carpeta de caché: ruta -> [bytes, último toque],
+    de la menos a la más usada. Los métodos hacen E/S: llamar desde un hilo.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._total = 0
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _dir(self, key: str) -> Path:
+        digest = self._digest(key)
+        return self.root / digest[:2] / digest
+
+    def path_for(self, key: str, width: int, fmt: str) -> Path:
+        return self._dir(key) / f"{width}{FORMAT_EXT[fmt]}"
+
+    def _scan(self) -> None:
+        """Rehace el índice desde el disco (ordenado por mtime = último uso)."""
+        found = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith("."):
+                    continue  # temporales a medio escribir
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+        found.sort()
+        with self._lock:
+            self._entries = OrderedDict((path, [size, mtime]) for mtime, path, size in found)
+            self._total = sum(size for _, _, size in found)
+            self._scanned = time.monotonic()
+
+    def _ensure_scanned(self) -> None:
+        if not self._scanned or time.monotonic() - self._scanned > RESCAN_SECONDS:
+            self._scan()
+
+    def lookup(self, path: Path) -> Optional[os.stat_result]:
+        """stat de la variante si está en caché (y la marca como recién usada)."""
+        self._ensure_scanned()
+        key = str(path)
+        try:
+            st = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            with self._lock:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._total -= int(entry[0])
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # La escribió otro proceso
+                entry = self._entries[key] = [st.st_size, st.st_mtime]
+                self._total += st.st_size
+            self._entries.move_to_end(key)
+            touch = now - entry[1] > TOUCH_SECONDS
+            if touch:
+                entry[1] = now
+        if touch:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return st
+
+    def store(self, path: Path, data: bytes) -> None:
+        self._ensure_scanned()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        key = str(path)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= int(old[0])
+            self._entries[key] = [len(data), time.time()]
+            self._total += len(data)
+            victims = []
+            while self.max_bytes > 0 and self._total > self.max_bytes and len(self._entries) > 1:
+                victim, (size, _) = self._entries.popitem(last=False)
+                self._total -= int(size)
+                victims.append(victim)
+        for victim in victims:
+            try:
+                os.unlink(victim)
+                os.rmdir(os.path.dirname(victim))  # sólo si era la última variante de la imagen
+            except OSError:
+                pass
+
+    def drop(self, keys: Iterable[str]) -> None:
+        """Borra todas las variantes de esas claves del almacenamiento."""
+        for key in keys:
+            folder = self._dir(key)
+            prefix = str(folder) + os.sep
+            with self._lock:
+                for path in [p for p in self._entries if p.startswith(prefix)]:
+                    self._total -= int(self._entries.pop(path)[0])
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+_cache: Optional[VariantCache] = None
+_cache_lock = threading.Lock()
+# Variantes en generación en este proceso: ruta de caché -> tarea
+_inflight: Dict[str, "asyncio.Task"] = {}
+
+
+def get_cache() -> VariantCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VariantCache(CACHE_DIR, CACHE_MAX_BYTES)
+    return _cache
+
+
+async def drop_variants(keys: Iterable[str]) -> None:
+    """Invalida la caché de las claves que se acaban de borrar del almacenamiento."""
+    keys = list(keys)
+    # Con la ruta repartida (ab/cd/<hash>.ext) también la clave plana antigua
+    keys += [k.rsplit("/", 1)[1] for k in keys if "/" in k and shard_key(k.rsplit("/", 1)[1]) == k]
+    if keys:
+        await anyio.to_thread.run_sync(get_cache().drop, keys)
+
+
+# ======================
+#   GENERACIÓN
+# ======================
+async def _render(key: str, width: int, fmt: str, path: Path) -> bytes:
+    try:
+        src = await read_key(key)
+    except (StorageError, httpx.HTTPError) as e:
+        print(f"[images] No se pudo leer {key} para redimensionar: {e}")
+        raise HTTPException(502, "No se pudo leer la imagen original.")
+    if src is None:
+        raise HTTPException(404, "Imagen no encontrada.")
+    async with global_limiter():
+        try:
+            async with memory_budget().reserve(decoded_bytes(src)):
+                variant = await run_image_job(render_variant, src, width, fmt)
+        except MemoryBudgetExceeded as e:
+            raise HTTPException(503, "Servidor ocupado. Inténtalo en unos segundos.",
+                                headers={"Retry-After": str(e.retry_after)})
+        except BrokenProcessPool:
+            raise HTTPException(503, "El procesado de imágenes no está disponible. Inténtalo de nuevo.")
+        except (OSError, ValueError, Image.DecompressionBombError):
+            raise HTTPException(404, "Imagen no disponible.")
+    await anyio.to_thread.run_sync(get_cache().store, path, variant.data)
+    return variant.data
+
+
+def _forget(flight: str, task: "asyncio.Task") -> None:
+    _inflight.pop(flight, None)
+    if not task.cancelled():
+        task.exception()  # evita "exception was never retrieved" si nadie esperaba ya
+
+
+async def _single_flight(key: str, width: int, fmt: str, path: Path) -> bytes:
+    """Una sola generación por variante a la vez; el resto de peticiones la esperan."""
+    flight = str(path)
+    task = _inflight.get(flight)
+    if task is None:
+        task = asyncio.ensure_future(_render(key, width, fmt, path))
+        _inflight[flight] = task
+        task.add_done_callback(lambda t: _forget(flight, t))
+    # shield: si esta petición se cancela, la generación sigue para las demás
+    return await asyncio.shield(task)
+
+
+# ======================
+#   ENDPOINT
+# ======================
+@router.api_route("/img/{width}/{key:path}", methods=["GET", "HEAD"])
+async def resized_image(width: int, key: str, request: Request):
+    if width not in RESIZE_WIDTHS:
+        allowed = ", ".join(str(w) for w in sorted(RESIZE_WIDTHS))
+        raise HTTPException(400, f"Ancho no permitido (usa uno de: {allowed}).")
+    if not key or key.startswith("/") or ".." in key.split("/"):
+        raise HTTPException(404, "Imagen no encontrada.")
+    fallback = FALLBACK_FORMAT.get(os.path.splitext(key)[1].lower())
+    if fallback is None:
+        raise HTTPException(404, "Imagen no encontrada.")
+
+    fmt = negotiate(request.headers.get("accept", ""), fallback)
+    cache = get_cache()
+    path = cache.path_for(key, width, fmt)
+    headers = {
+        "etag": f'"{path.parent.name[:20]}-{width}-{fmt.lower()}"',
+        "cache-control": IMMUTABLE_CACHE if is_immutable(key) else f"public, max-age={REVALIDATE_SECONDS}",
+        "vary": "Accept",
+        "x-content-type-options": "nosniff",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, headers["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    stat_result = await anyio.to_thread.run_sync(cache.lookup, path)
+    if stat_result is not None:
+        headers["x-cache"] = "HIT"
+        return ImageFileResponse(path, stat_result=stat_result, headers=headers, media_type=FORMAT_MIME[fmt])
+
+    data = await _single_flight(key, width, fmt, path)
+    headers["x-cache"] = "MISS"
+    return Response(content=data, headers=headers, media_type=FORMAT_MIME[fmt])
@@ -0,0 +1,268 @@
+# app/ads/resumable.py
+#
+# Subidas reanudables de imágenes, para clientes con mala conexión: en vez de
+# mandar todas las fotos en un único multipart (que se pierde entero si la
+# conexión cae al 90 %), cada imagen se sube por trozos y se retoma donde se
+# quedó. Protocolo (rutas en app/ads/routes.py, bajo /api/ads/uploads):
+#
+#   POST   /uploads                      {filename, size, mime} -> upload_id
+#   PUT    /uploads/{id}?offset=N        trozo (cuerpo binario) a partir de N
+#   HEAD   /uploads/{id}                 offset actual (cabecera Upload-Offset)
+#   POST   /uploads/{id}/finalize        {sha256?} -> comprueba firma y hash
+#   DELETE /uploads/{id}                 cancela
+#
+# y al crear/editar el anuncio se pasan los ids en el campo upload_ids.
+#
+# Con un backend que admite URLs prefirmadas (S3 y compatibles, p.ej. MinIO en
+# local) el cliente puede saltarse la app al subir:
+#
+#   POST   /uploads/intent               {files: [{size, mime, filename}], ad_id?}
+#                                        -> una URL PUT prefirmada por imagen
+#   POST   /uploads/finalize             {upload_ids} -> trae cada objeto, lo comprueba
+#
+# El tamaño y el tipo declarados van firmados en la URL: el almacenamiento
+# rechaza cualquier otro. Al finalizar, la app copia el objeto (por bloques) al
+# mismo fichero local que una subida por trozos, lo verifica y lo borra del
+# bucket; desde ahí todo es igual. Con otros backends el intent devuelve como
+# destino el PUT por trozos de la propia app ("direct": false).
+#
+# Cada trozo se escribe directamente en un fichero por subida según llega
+# (memoria constante: como mucho WRITE_BLOCK en vuelo). Si la conexión cae a
+# mitad de un trozo, lo recibido se queda y el offset se guarda igual.
+# Un solo trozo a la vez por subida, también entre procesos: la petición
+# reclama el offset con un UPDATE condicional (lease en receiving_at) antes de
+# tocar el fichero y lo renueva en cada bloque; si lo pierde, deja de escribir.
+# Las subidas sin actividad en IMAGE_RESUMABLE_TTL_HOURS se borran (fila y
+# fichero) de forma perezosa al crear otras.
+#
+# Variables de entorno:
+#   IMAGE_RESUMABLE_DIR       = carpeta de los ficheros en curso (por defecto: ./var/resumable)
+#   IMAGE_RESUMABLE_TTL_HOURS = horas sin actividad antes de caducar (por defecto: 24)
+#   IMAGE_RESUMABLE_CHUNK     = tamaño de trozo recomendado al cliente, bytes (por defecto: 1 MiB)
+#   IMAGE_DIRECT_UPLOAD_SECONDS = validez de las URLs prefirmadas (por defecto: 900)
+#   IMAGE_RESUMABLE_CHUNK_LEASE = segundos sin recibir nada antes de que otra petición
+#                                 pueda quedarse el trozo en curso (por defecto: 300)
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.models import UploadSession
+from app.ads.storage import PROJECT_ROOT
+from app.ads.uploads import sniff_image_mime
+
+RESUMABLE_DIR = Path(os.getenv("IMAGE_RESUMABLE_DIR") or PROJECT_ROOT / "var" / "resumable")
+TTL_HOURS = float(os.getenv("IMAGE_RESUMABLE_TTL_HOURS", "24") or 24)
+CHUNK_BYTES = int(os.getenv("IMAGE_RESUMABLE_CHUNK", str(1024 * 1024)) or 1024 * 1024)
+DIRECT_UPLOAD_SECONDS = int(os.getenv("IMAGE_DIRECT_UPLOAD_SECONDS", "900") or 900)
+CHUNK_LEASE_SECONDS = float(os.getenv("IMAGE_RESUMABLE_CHUNK_LEASE", "300") or 300)
+
+STATUS_OPEN = "open"
+STATUS_COMPLETE = "complete"
+
+# Lo que se acumula en memoria antes de escribir a disco
+WRITE_BLOCK = 256 * 1024
+SWEEP_SECONDS = 600
+# Bytes de cabecera que necesita sniff_image_mime
+HEAD_BYTES = 12
+
+_last_sweep = 0.0
+
+
+def new_upload_id() -> str:
+    return uuid.uuid4().hex
+
+
+def path_for(upload_id: str) -> Path:
+    return RESUMABLE_DIR / f"{Path(upload_id).name}.part"
+
+
+def create_file(upload_id: str) -> None:
+    RESUMABLE_DIR.mkdir(parents=True, exist_ok=True)
+    path_for(upload_id).touch()
+
+
+def received_bytes(upload_id: str) -> int:
+    try:
+        return path_for(upload_id).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def discard_uploads(upload_ids: List[str]) -> None:
+    for upload_id in upload_ids:
+        try:
+            path_for(upload_id).unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+def expired(upload: UploadSession) -> bool:
+    return upload.updated_at < datetime.utcnow() - timedelta(hours=TTL_HOURS)
+
+
+# ======================
+#   LEASE DEL TROZO EN CURSO
+# ======================
+def claim_chunk(db: Session, upload_id: str, offset: int) -> Optional[datetime]:
+    """
+    Reclama la escritura a partir de `offset` con un UPDATE condicional (vale
+    entre procesos): sólo si la subida sigue abierta, va justo por `offset` y
+    nadie más está escribiendo. Devuelve el lease, o None si no se ha podido.
+    """
+    now = datetime.utcnow()
+    n = db.query(UploadSession).filter(
+        UploadSession.id == upload_id,
+        UploadSession.status == STATUS_OPEN,
+        UploadSession.offset == offset,
+        or_(
+            UploadSession.receiving_at.is_(None),
+            UploadSession.receiving_at < now - timedelta(seconds=CHUNK_LEASE_SECONDS),
+        ),
+    ).update({UploadSession.receiving_at: now}, synchronize_session=False)
+    db.commit()
+    return now if n else None
+
+
+def renew_chunk(db: Session, upload_id: str, lease: datetime) -> Optional[datetime]:
+    """Renueva el lease si sigue siendo nuestro. None = lo ha perdido."""
+    now = datetime.utcnow()
+    n = db.query(UploadSession).filter(
+        UploadSession.id == upload_id, UploadSession.receiving_at == lease,
+    ).update({UploadSession.receiving_at: now}, synchronize_session=False)
+    db.commit()
+    return now if n else None
+
+
+def release_chunk(db: Session, upload_id: str, lease: datetime, offset: int) -> bool:
+    """Guarda el nuevo offset y suelta el lease (sólo si sigue siendo nuestro)."""
+    n = db.query(UploadSession).filter(
+        UploadSession.id == upload_id, UploadSession.receiving_at == lease,
+    ).update({
+        UploadSession.offset: offset,
+        UploadSession.receiving_at: None,
+        UploadSession.updated_at: datetime.utcnow(),
+    }, synchronize_session=False)
+    db.commit()
+    return n == 1
+
+
+# ======================
+#   ESCRITURA DE TROZOS
+# ======================
+def _open_at(path: Path, offset: int):
+    """Abre el fichero para escribir en `offset` (descarta lo que hubiera detrás)."""
+    f = open(path, "r+b")
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+
+async def write_chunk(
+    upload_id: str, offset: int, size: int, chunks: AsyncIterator[bytes],
+    renew: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> int:
+    """
+    Escribe a partir de `offset` lo que va llegando por `chunks`, en bloques de
+    WRITE_BLOCK. Devuelve el nuevo offset. Si el cuerpo se corta (o supera el
+    tamaño declarado) lo válido recibido hasta entonces se queda en disco:
+    el llamante guarda el offset real con received_bytes().
+    `renew` se llama antes de escribir cada bloque (renovar el lease): si
+    devuelve False, otra petición se ha quedado el trozo y se deja de escribir.
+    """
+    f = await run_in_threadpool(_open_at, path_for(upload_id), offset)
+    pos = offset
+    buf = bytearray()
+    owned_until = time.monotonic() + CHUNK_LEASE_SECONDS
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if pos + len(buf) + len(chunk) > size:
+                raise HTTPException(413, "El trozo supera el tamaño declarado de la subida.")
+            buf += chunk
+            if offset == 0 and pos == 0 and len(buf) >= HEAD_BYTES:
+                if sniff_image_mime(bytes(buf[:HEAD_BYTES])) is None:
+                    buf.clear()
+                    raise HTTPException(400, "El archivo no es una imagen válida.")
+            if len(buf) >= WRITE_BLOCK:
+                if renew is not None:
+                    if not await renew():
+                        buf.clear()
+                        raise HTTPException(409, "Otra petición ha tomado el relevo de este trozo.")
+                    owned_until = time.monotonic() + CHUNK_LEASE_SECONDS
+                await run_in_threadpool(f.write, bytes(buf))
+                pos += len(buf)
+                buf.clear()
+    finally:
+        # Resto acotado (< WRITE_BLOCK): síncrono, para que se guarde aunque
+        # la petición se cancele; no si el lease ha podido caducar entretanto
+        if buf and time.monotonic() < owned_until:
+            f.write(buf)
+            pos += len(buf)
+        f.close()
+    return pos
+
+
+# ======================
+#   FINALIZAR
+# ======================
+def inspect_file(upload_id: str) -> Tuple[bytes, str]:
+    """(primeros bytes, sha256) del fichero completo, leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(path_for(upload_id), "rb") as f:
+        head = f.read(HEAD_BYTES)
+        digest.update(head)
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return head, digest.hexdigest()
+
+
+# ======================
+#   CADUCIDAD
+# ======================
+def sweep(db: Session) -> int:
+    """Borra las subidas caducadas y los ficheros sin fila. Devuelve cuántas."""
+    cutoff = datetime.utcnow() - timedelta(hours=TTL_HOURS)
+    stale = [i for (i,) in db.query(UploadSession.id).filter(UploadSession.updated_at < cutoff).all()]
+    if stale:
+        db.query(UploadSession).filter(UploadSession.id.in_(stale)).delete(synchronize_session=False)
+        db.commit()
+        discard_uploads(stale)
+
+    # Ficheros huérfanos (fila ya consumida por un anuncio y borrado fallido, etc.)
+    orphans = []
+    if RESUMABLE_DIR.is_dir():
+        old = time.time() - TTL_HOURS * 3600
+        with os.scandir(RESUMABLE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith(".part") and entry.stat().st_mtime < old:
+                    orphans.append(entry.name[:-len(".part")])
+    if orphans:
+        known = {i for (i,) in db.query(UploadSession.id).filter(UploadSession.id.in_(orphans)).all()}
+        orphans = [i for i in orphans if i not in known]
+        discard_uploads(orphans)
+    return len(stale) + len(orphans)
+
+
+def maybe_sweep(db: Session) -> None:
+    """sweep() como mucho cada SWEEP_SECONDS por proceso."""
+    global _last_sweep
+    if time.monotonic() - _last_sweep < SWEEP_SECONDS:
+        return
+    _last_sweep = time.monotonic()
+    try:
+        n = sweep(db)
+        if n:
+            print(f"[uploads] {n} subidas reanudables caducadas eliminadas")
+    except Exception as e:
+        db.rollback()
+        print(f"[uploads] Error limpiando subidas reanudables: {e}")
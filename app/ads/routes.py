@@ -1,47 +1,54 @@
 # app/ads/routes.py
-from pathlib import Path
+import asyncio
 import uuid
-import io
 import os
 import re
+from dataclasses import dataclass, field
 from typing import List, Optional, Tuple
 from datetime import datetime
 
 from fastapi import (
     APIRouter,
-    UploadFile,
-    File,
-    Form,
+    Request,
     Depends,
     HTTPException,
     Query,
     Body,
+    Response,
 )
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
 
 from app.database import SessionLocal
 from app import models
-from app.models import User, Ad, AdImage, AdModerationLog
+from app.models import User, Ad, AdImage, AdModerationLog, UploadSession
 from app.auth.dependencies import get_current_user  # 🔑 autenticación
 
-# Pillow
-from PIL import Image, UnidentifiedImageError
-
-# Storage opcional (Cloudinary) si hay credenciales
-USE_CLOUDINARY = bool(
-    os.getenv("CLOUDINARY_CLOUD_NAME")
-    and os.getenv("CLOUDINARY_API_KEY")
-    and os.getenv("CLOUDINARY_API_SECRET")
+# Pipeline de imágenes (Pillow) + ejecutor fuera del event loop
+from concurrent.futures.process import BrokenProcessPool
+from fastapi.concurrency import run_in_threadpool
+import httpx
+from app.ads.images import ImageError, ProcessedImage, choose_ext, decoded_bytes
+from app.ads.executor import (
+    MEMORY_WAIT_SECONDS, MemoryBudgetExceeded, global_limiter, memory_budget, process_image_async,
 )
-if USE_CLOUDINARY:
-    import cloudinary
-    import cloudinary.uploader
-    cloudinary.config(
-        cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-        api_key=os.getenv("CLOUDINARY_API_KEY"),
-        api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-        secure=True,
-    )
+from app.ads.renditions import FORMAT_EXT, FORMAT_MIME, RENDITION_SPEC_VERSION
+from app.ads.storage import StorageError, delete_urls, get_storage
+from app.ads.deleter import enqueue_deletions, notify as notify_deleter
+from app.ads.tiering import drop_bundle, rehydrate
+from app.ads.uploads import UploadLimits, iter_multipart, multipart_openapi, sniff_image_mime
+from app.ads.resumable import (
+    CHUNK_BYTES, DIRECT_UPLOAD_SECONDS, STATUS_COMPLETE, STATUS_OPEN, claim_chunk, create_file,
+    discard_uploads, expired as upload_expired, inspect_file, maybe_sweep, new_upload_id,
+    path_for as upload_path, received_bytes, release_chunk, renew_chunk, write_chunk,
+)
+from app.ads.worker import (
+    IMAGE_DEFERRED, MAX_ATTEMPTS, STATUS_FAILED, STATUS_QUEUED, STATUS_READY,
+    discard_staged, read_staged, stage_bytes, stage_file, notify as notify_image_worker,
+)
+from app.ads.phash import near_duplicate_hints, phash_index
+from app.ads.blobs import acquire, find_by_hash, find_by_raw_hash, image_from_blob, release_image, sha256_hex
+from app.ads.serializers import image_payload
 
 router = APIRouter(tags=["ads"])
 
@@ -53,22 +60,19 @@ def get_db():
     finally:
         db.close()
 
-# === Carpeta ./static/images ===
-PROJECT_ROOT = Path(__file__).resolve().parents[2]
-IMAGES_DIR   = PROJECT_ROOT / "static" / "images"
-IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-
 # --- Reglas de imágenes ---
 ALLOWED_EXT = {".jpg", ".jpeg", ".png", ".webp"}
 ALLOWED_MIME = {"image/jpeg", "image/png", "image/webp"}
-ALLOWED_PIL_FORMATS = {"JPEG", "PNG", "WEBP"}
 
 MAX_IMAGES = 9
 MAX_IMAGE_BYTES = 5 * 1024 * 1024  # 5 MB
-
-MAX_W = 8000
-MAX_H = 8000
-TARGET_MAX_SIDE = 2048
+# Subidas reanudables abiertas a la vez por usuario (app/ads/resumable.py)
+MAX_OPEN_UPLOADS = 2 * MAX_IMAGES
+# Cuerpo completo: todas las imágenes + margen para campos y cabeceras multipart
+MAX_BODY_BYTES = MAX_IMAGES * MAX_IMAGE_BYTES + 1024 * 1024
+# Imágenes de una misma petición procesándose a la vez (el tope global está
+# en app/ads/executor.py -> IMAGE_CONCURRENCY)
+IMAGE_REQUEST_CONCURRENCY = int(os.getenv("IMAGE_REQUEST_CONCURRENCY", "3") or 3)
 
 # --- Helpers de autorización/estado ---
 def ensure_not_blocked(user: User):
@@ -102,140 +106,799 @@ def sanitize_text(s: str, max_len: int = 5000) -> str:
     return s[:max_len]
 
 # --- Helpers de imagen (Pillow) ---
-def _read_limited(upload: UploadFile, limit_bytes: int = MAX_IMAGE_BYTES) -> bytes:
-    data = upload.file.read(limit_bytes + 1)
-    if not data:
-        raise HTTPException(400, "Archivo vacío.")
-    if len(data) > limit_bytes:
-        raise HTTPException(400, f"Imagen demasiado grande (máximo {limit_bytes // (1024*1024)} MB).")
-    return data
-
-def _open_validate_clean(buf: bytes) -> Tuple[Image.Image, str]:
+async def _process_bytes(buf: bytes, budget_wait: Optional[float] = MEMORY_WAIT_SECONDS) -> ProcessedImage:
+    """
+    Procesa una subida en el ejecutor de imágenes (fuera del event loop), con
+    su tamaño decodificado reservado en el presupuesto de memoria del proceso.
+    Si no hay sitio en `budget_wait` segundos (None = esperar lo que haga falta), 503.
+    """
+    try:
+        async with memory_budget().reserve(decoded_bytes(buf), budget_wait):
+            return await process_image_async(buf)
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(
+            503, "Hay demasiadas imágenes procesándose ahora mismo. Inténtalo en unos segundos.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ImageError as e:
+        raise HTTPException(400, str(e))
+    except BrokenProcessPool:
+        raise HTTPException(503, "El procesado de imágenes no está disponible. Inténtalo de nuevo.")
+
+async def _store_bytes(data: bytes, fmt: str, stem: Optional[str] = None, written: Optional[list] = None) -> str:
+    """
+    Guarda un fichero en el backend activo (app/ads/storage.py) y devuelve su URL.
+    Si se pasa `written`, anota las URLs creadas por esta llamada.
+    """
+    ext = FORMAT_EXT.get(fmt.upper()) or choose_ext(fmt)
+    storage = get_storage()
+    key = storage.object_key(f"{stem or uuid.uuid4().hex}{ext}")
+    try:
+        created = await storage.put(key, data, FORMAT_MIME.get(fmt.upper(), "application/octet-stream"))
+    except (StorageError, httpx.HTTPError) as e:
+        print(f"[storage] Error guardando {key} en {storage.name}: {e}")
+        raise HTTPException(503, "El almacenamiento de imágenes no está disponible. Inténtalo más tarde.")
+    url = storage.url(key)
+    if created and written is not None:
+        written.append(url)
+    return url
+
+async def _store_processed(
+    processed: ProcessedImage, ad_id: Optional[int], written: Optional[list] = None
+) -> models.AdImage:
+    """
+    Guarda la imagen principal y sus variantes (en paralelo); devuelve el AdImage
+    (sin añadir a la sesión). Nombres por contenido: <sha256>.<ext> y <sha256>_<ancho>.<ext>
+    """
+    stem = processed.sha256 or uuid.uuid4().hex
+    url, *r_urls = await asyncio.gather(
+        _store_bytes(processed.data, processed.format, stem, written),
+        *(_store_bytes(r.data, r.format, f"{stem}_{r.width}", written) for r in processed.renditions),
+    )
+    image = models.AdImage(
+        url=url, ad_id=ad_id, renditions_version=RENDITION_SPEC_VERSION, phash=processed.phash or None,
+        placeholder=processed.placeholder or None,
+        width=processed.width, height=processed.height, bytes=len(processed.data),
+        format=processed.format, sha256=processed.sha256 or None,
+    )
+    # La principal figura como variante de su formato original a ancho completo
+    image.renditions.append(models.AdImageRendition(
+        width=processed.width, height=processed.height, format=processed.format, url=url,
+    ))
+    for r, r_url in zip(processed.renditions, r_urls):
+        image.renditions.append(models.AdImageRendition(
+            width=r.width, height=r.height, format=r.format, url=r_url,
+        ))
+    return image
+
+@dataclass
+class _PendingImage:
+    """Subida en curso: reutiliza un blob ya conocido, se está procesando o va a la cola."""
+    raw_hash: str
+    blob: Optional[models.ImageBlob] = None
+    task: Optional["asyncio.Task"] = None
+    staged: Optional[str] = None  # procesado diferido: nombre en staging
+    # Fase de guardado (protegida de cancelaciones) y ficheros que ha creado
+    sha: Optional[str] = None
+    store: Optional["asyncio.Future"] = None
+    written: List[str] = field(default_factory=list)
+    # Resultado del codificador para el blob (bytes, source_bytes, format, quality)
+    stats: dict = field(default_factory=dict)
+
+async def _process_and_store(
+    pending: _PendingImage, buf: bytes, limiter: Optional[asyncio.Semaphore],
+    budget_wait: Optional[float] = MEMORY_WAIT_SECONDS,
+) -> Tuple[str, models.AdImage]:
+    """
+    Procesa y guarda los ficheros; devuelve (sha256, AdImage transitorio sin ad_id).
+    Limitado por el tope global del worker, si se pasa por el de la petición
+    y por el presupuesto de memoria (ver _process_bytes).
+    """
+    async with global_limiter():
+        if limiter is not None:
+            async with limiter:
+                processed = await _process_bytes(buf, budget_wait)
+        else:
+            processed = await _process_bytes(buf, budget_wait)
+    del buf
+    pending.sha = processed.sha256
+    pending.stats = {
+        "bytes": len(processed.data), "source_bytes": processed.source_bytes,
+        "format": processed.format, "quality": processed.quality,
+    }
+    # Si la petición se aborta a mitad de escritura, el guardado termina igual
+    # y _abort_pending sabe exactamente qué ficheros limpiar
+    pending.store = asyncio.ensure_future(_store_processed(processed, None, pending.written))
+    return processed.sha256, await asyncio.shield(pending.store)
+
+async def _start_ingest(
+    db: Session, buf: bytes, limiter: Optional[asyncio.Semaphore] = None, defer: bool = False,
+    budget_wait: Optional[float] = MEMORY_WAIT_SECONDS,
+) -> _PendingImage:
+    """
+    Arranca la ingesta de una imagen sin esperar a que termine, para que la
+    siguiente pueda seguir llegando mientras ésta se decodifica.
+    Si los bytes crudos ya se conocen (blob con referencias) no se procesa nada.
+    Con `defer`, sólo se guarda la subida en staging para el worker.
+    `budget_wait`: espera máxima por el presupuesto de memoria (None = sin límite).
+    """
+    raw_hash = await run_in_threadpool(sha256_hex, buf)
+    blob = _reusable_blob(db, raw_hash)
+    if blob is not None:
+        return _PendingImage(raw_hash, blob=blob)
+    if defer:
+        return _PendingImage(raw_hash, staged=await run_in_threadpool(stage_bytes, buf))
+    return _spawn_ingest(raw_hash, buf, limiter, budget_wait)
+
+async def _start_ingest_upload(
+    db: Session, upload: models.UploadSession, limiter: Optional[asyncio.Semaphore] = None, defer: bool = False
+) -> _PendingImage:
+    """
+    Como _start_ingest, para una subida reanudable ya finalizada: el hash se
+    calculó al finalizarla y, en diferido, el fichero pasa a staging sin
+    cargarlo en memoria. El fichero de la subida no se toca (se borra tras el commit).
+    """
+    blob = _reusable_blob(db, upload.sha256)
+    if blob is not None:
+        return _PendingImage(upload.sha256, blob=blob)
     try:
-        bio = io.BytesIO(buf)
-        img = Image.open(bio)
-    except UnidentifiedImageError:
-        raise HTTPException(400, "El archivo no es una imagen válida.")
-
-    fmt = (img.format or "").upper()
-    if fmt not in ALLOWED_PIL_FORMATS:
-        raise HTTPException(400, f"Formato no permitido: {fmt or 'desconocido'} (solo JPG/PNG/WebP).")
-
-    w, h = img.size
-    if w > MAX_W or h > MAX_H:
-        raise HTTPException(400, f"Dimensiones de entrada demasiado grandes ({w}x{h}).")
-
-    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
-        img = img.convert("RGB")
-    elif fmt in ("PNG", "WEBP") and img.mode == "P":
-        img = img.convert("RGBA")
-
-    clean = Image.new(img.mode, img.size)
-    clean.putdata(list(img.getdata()))
-
-    W, H = clean.size
-    max_side = max(W, H)
-    if max_side > TARGET_MAX_SIDE:
-        scale = TARGET_MAX_SIDE / float(max_side)
-        new_w = max(1, int(W * scale))
-        new_h = max(1, int(H * scale))
-        clean = clean.resize((new_w, new_h), Image.LANCZOS)
-
-    return clean, fmt
-
-def _choose_ext(fmt: str) -> str:
-    fmt = fmt.upper()
-    if fmt == "JPEG":
-        return ".jpg"
-    if fmt == "PNG":
-        return ".png"
-    if fmt == "WEBP":
-        return ".webp"
-    return ".png"
-
-def _save_image_disk(img: Image.Image, fmt: str) -> str:
-    ext = _choose_ext(fmt)
-    fname = f"{uuid.uuid4().hex}{ext}"
-    fpath = IMAGES_DIR / fname
-
-    fmt = fmt.upper()
-    if fmt == "JPEG":
-        img.save(fpath, format="JPEG", quality=85, optimize=True, progressive=True)
-    elif fmt == "PNG":
-        img.save(fpath, format="PNG", optimize=True)
-    elif fmt == "WEBP":
-        img.save(fpath, format="WEBP", quality=82, method=6)
+        if defer:
+            return _PendingImage(upload.sha256, staged=await run_in_threadpool(stage_file, upload_path(upload.id)))
+        buf = await run_in_threadpool(upload_path(upload.id).read_bytes)
+    except OSError:
+        raise HTTPException(410, f"La subida {upload.id} ya no está disponible. Vuelve a subir la imagen.")
+    return _spawn_ingest(upload.sha256, buf, limiter)
+
+def _reusable_blob(db: Session, raw_hash: str) -> Optional[models.ImageBlob]:
+    """Blob con los mismos bytes de subida y ficheros en caliente (no hace falta procesar)."""
+    blob = find_by_raw_hash(db, raw_hash)
+    # Un blob frío no tiene ficheros en caliente (app/ads/tiering.py): se reprocesa
+    if blob is not None and blob.refcount > 0 and not blob.cold:
+        return blob
+    return None
+
+def _spawn_ingest(
+    raw_hash: str, buf: bytes, limiter: Optional[asyncio.Semaphore],
+    budget_wait: Optional[float] = MEMORY_WAIT_SECONDS,
+) -> _PendingImage:
+    pending = _PendingImage(raw_hash)
+    pending.task = asyncio.create_task(_process_and_store(pending, buf, limiter, budget_wait))
+    return pending
+
+async def _finish_ingest(
+    db: Session, pending: _PendingImage, ad_id: int, target: Optional[models.AdImage] = None
+) -> models.AdImage:
+    """
+    Espera al procesado (si lo hay) y asocia la imagen al anuncio y a su blob:
+    - bytes procesados ya conocidos -> se reutiliza el blob (mismos nombres de fichero);
+    - si no, se crea el blob con refcount=1;
+    - subida diferida -> AdImage en cola (status='queued'), sin URL todavía.
+    Con `target` (worker) se completa esa fila en vez de crear otra.
+    Añade el AdImage a la sesión y hace flush (no commit).
+    """
+    if pending.staged is not None:
+        image = models.AdImage(url="", ad_id=ad_id, status=STATUS_QUEUED, staged_path=pending.staged)
+    elif pending.blob is not None:
+        image = image_from_blob(db, pending.blob, ad_id)
+        if image is None:
+            # El blob se ha soltado y borrado mientras tanto y los bytes ya no
+            # están en memoria: el cliente reintenta (el worker, al caducar el lease)
+            raise HTTPException(409, "Una imagen cambió durante la subida. Inténtalo de nuevo.")
+    else:
+        sha, image = await pending.task
+        blob = find_by_hash(db, sha)
+        reused = image_from_blob(db, blob, ad_id) if blob is not None else None
+        if reused is not None:
+            image = reused
+            blob.cold = False  # acabamos de volver a escribir sus ficheros
+        else:
+            image.ad_id = ad_id
+            if blob is not None and not acquire(db, blob):
+                # Otra transacción soltó su última referencia y borró la fila:
+                # se crea de nuevo (con una fila que use la URL, el borrador no la toca)
+                db.expunge(blob)
+                blob = None
+            if blob is None:
+                blob = models.ImageBlob(
+                    sha256=sha, raw_sha256=pending.raw_hash, url=image.url, refcount=1, **pending.stats
+                )
+                db.add(blob)
+            else:
+                # Blob sin imágenes que lo usen (huérfano): se reaprovecha
+                blob.url = image.url
+                for k, v in pending.stats.items():
+                    setattr(blob, k, v)
+            image.blob = blob
+
+    if target is not None:
+        _fill_image(target, image)
+        image = target
+    db.add(image)
+    # autoflush está desactivado: hacemos visibles blob/imagen para las
+    # siguientes subidas de la misma petición (misma foto dos veces)
+    db.flush()
+    return image
+
+def _fill_image(target: models.AdImage, src: models.AdImage) -> None:
+    """Copia URL, blob y variantes de un AdImage transitorio a una fila existente."""
+    target.url = src.url
+    if src.blob is not None:
+        target.blob = src.blob
     else:
-        img.save(fpath, format="PNG", optimize=True)
-    return f"/static/images/{fname}"
+        target.blob_id = src.blob_id
+    target.renditions_version = src.renditions_version
+    target.phash = src.phash
+    target.placeholder = src.placeholder
+    target.width, target.height = src.width, src.height
+    target.bytes, target.format, target.sha256 = src.bytes, src.format, src.sha256
+    target.renditions = [
+        models.AdImageRendition(width=r.width, height=r.height, format=r.format, url=r.url)
+        for r in src.renditions
+    ]
+
+async def _ingest_bytes(db: Session, buf: bytes, ad_id: int) -> models.AdImage:
+    """Ingesta completa (deduplicar, procesar, guardar y asociar) de una imagen."""
+    return await _finish_ingest(db, await _start_ingest(db, buf), ad_id)
+
+def _raise_failed(pending: List[_PendingImage]) -> None:
+    """Rechazo temprano: si una imagen ya falló, no seguimos leyendo el resto."""
+    for p in pending:
+        if p.task is not None and p.task.done() and not p.task.cancelled() and p.task.exception():
+            raise p.task.exception()
+
+async def _abort_pending(db: Session, pending: List[_PendingImage]) -> None:
+    """
+    Todo o nada: si la petición falla, cancela lo que quede por procesar, espera
+    a que terminen las escrituras en curso, deshace la transacción y borra los
+    ficheros que creó esta petición y que ningún blob confirmado usa.
+    """
+    tasks = [p.task for p in pending if p.task is not None]
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    stores = [p.store for p in pending if p.store is not None]
+    await asyncio.gather(*stores, return_exceptions=True)
+
+    db.rollback()
+    orphans: List[str] = []
+    for p in pending:
+        if not p.written:
+            continue
+        if p.sha and find_by_hash(db, p.sha) is not None:
+            continue  # otra petición ya confirmó el mismo contenido
+        orphans.extend(p.written)
+    await delete_urls(orphans)
+    await run_in_threadpool(discard_staged, [p.staged for p in pending if p.staged])
+
+async def process_staged_image(image_id: int) -> None:
+    """
+    Worker (app/ads/worker.py): procesa una imagen en cola y la deja 'ready'
+    o 'failed'. Los errores transitorios (pool caído, almacenamiento no
+    disponible) la dejan en cola para reintentarla cuando caduque el lease.
+    """
+    db = SessionLocal()
+    try:
+        image = db.query(models.AdImage).filter(models.AdImage.id == image_id).first()
+        if image is None or image.status != STATUS_QUEUED:
+            return
+        staged = image.staged_path
+        try:
+            buf = await run_in_threadpool(read_staged, staged)
+        except (OSError, TypeError):
+            _mark_image_failed(db, image_id, "La subida original ya no está disponible.")
+            return
+
+        for retry in (True, False):
+            pending: List[_PendingImage] = []
+            try:
+                # El worker no tiene a nadie esperando: hace cola en el presupuesto sin límite
+                pending.append(await _start_ingest(db, buf, budget_wait=None))
+                await _finish_ingest(db, pending[0], image.ad_id, target=image)
+                image.status = STATUS_READY
+                image.staged_path = None
+                image.error = None
+                image.claimed_at = None
+                db.commit()
+                phash_index.add(image.id, image.ad_id, image.phash)
+                break
+            except IntegrityError:
+                # Otra imagen con el mismo contenido creó el blob a la vez:
+                # al reintentar ya existe y se reutiliza
+                await _abort_pending(db, pending)
+                if not retry:
+                    raise
+                image = db.query(models.AdImage).filter(models.AdImage.id == image_id).first()
+                if image is None:
+                    return
+            except HTTPException as e:
+                await _abort_pending(db, pending)
+                attempts = db.query(models.AdImage.attempts).filter(models.AdImage.id == image_id).scalar()
+                permanent = e.status_code < 500 and e.status_code != 409
+                if permanent or (attempts or 0) >= MAX_ATTEMPTS:
+                    _mark_image_failed(db, image_id, str(e.detail), staged)
+                return
+            except Exception as e:
+                # Fallo inesperado (bug, imagen que Pillow no sabe tratar...):
+                # se reintenta hasta agotar los intentos y luego queda 'failed'
+                await _abort_pending(db, pending)
+                print(f"[images] Error procesando la imagen {image_id}: {type(e).__name__}: {e}")
+                attempts = db.query(models.AdImage.attempts).filter(models.AdImage.id == image_id).scalar()
+                if (attempts or 0) >= MAX_ATTEMPTS:
+                    _mark_image_failed(db, image_id, "No se ha podido procesar la imagen.", staged)
+                return
+            except BaseException:
+                await asyncio.shield(_abort_pending(db, pending))
+                raise
+        del buf
+        await run_in_threadpool(discard_staged, [staged])
+    finally:
+        db.close()
 
-def _save_image_cloudinary(buf: bytes) -> str:
-    res = cloudinary.uploader.upload(io.BytesIO(buf), folder="deotramano/ads")
-    return res["secure_url"]
+def _mark_image_failed(db: Session, image_id: int, error: str, staged: Optional[str] = None) -> None:
+    db.query(models.AdImage).filter(models.AdImage.id == image_id).update({
+        models.AdImage.status: STATUS_FAILED,
+        models.AdImage.error: error[:500],
+        models.AdImage.staged_path: None,
+        models.AdImage.claimed_at: None,
+    }, synchronize_session=False)
+    db.commit()
+    if staged:
+        discard_staged([staged])
 
-def _delete_storage(url: str):
-    if not url:
-        return
-    if USE_CLOUDINARY and "res.cloudinary.com" in url:
-        return
-    if url.startswith("/"):
-        fpath = PROJECT_ROOT / url.lstrip("/")
-        if fpath.is_file():
-            try:
-                fpath.unlink(missing_ok=True)
-            except Exception:
-                pass
+def _form_value(fields: dict, name: str) -> str:
+    if name not in fields:
+        raise HTTPException(422, f"Falta el campo '{name}'.")
+    return fields[name]
+
+def _form_int(fields: dict, name: str) -> int:
+    try:
+        return int(_form_value(fields, name))
+    except ValueError:
+        raise HTTPException(422, f"El campo '{name}' debe ser un entero.")
+
+def _form_upload_ids(fields: dict) -> List[str]:
+    """Campo upload_ids: ids de subidas reanudables separados por comas (sin repetidos)."""
+    raw = fields.get("upload_ids") or ""
+    return list(dict.fromkeys(u for u in re.split(r"[\s,]+", raw) if u))
+
+def _claim_uploads(db: Session, upload_ids: List[str], user: User) -> List[UploadSession]:
+    """
+    Subidas reanudables que se asocian al anuncio: del usuario y finalizadas.
+    Sus filas se borran en la transacción de la petición (DELETE condicional:
+    si dos peticiones usan la misma subida, sólo una la consigue).
+    """
+    uploads = []
+    for upload_id in upload_ids:
+        upload = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+        if upload is None or upload.user_id != user.id or upload_expired(upload):
+            raise HTTPException(404, f"Subida no encontrada: {upload_id}")
+        if upload.status != STATUS_COMPLETE:
+            raise HTTPException(409, f"La subida {upload_id} no está finalizada.")
+        n = db.query(UploadSession).filter(
+            UploadSession.id == upload_id, UploadSession.status == STATUS_COMPLETE
+        ).delete(synchronize_session=False)
+        if not n:
+            raise HTTPException(409, f"La subida {upload_id} ya se ha usado en otro anuncio.")
+        uploads.append(upload)
+    return uploads
 
 # ======================
-#   CREAR ANUNCIO
+#   SUBIDAS REANUDABLES
 # ======================
-@router.post("/create", status_code=201)
-async def create_ad(
-    title: str = Form(...),
-    description: str = Form(...),
-    user_id: int = Form(...),
-    images: List[UploadFile] = File(...),
+def _get_upload(db: Session, upload_id: str, user: User) -> UploadSession:
+    upload = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if upload is None or upload.user_id != user.id or upload_expired(upload):
+        raise HTTPException(404, "Subida no encontrada o caducada.")
+    return upload
+
+def _upload_payload(upload: UploadSession, response: Response) -> dict:
+    response.headers["Upload-Offset"] = str(upload.offset)
+    response.headers["Upload-Length"] = str(upload.size)
+    response.headers["Cache-Control"] = "no-store"
+    return {
+        "upload_id": upload.id, "offset": upload.offset, "size": upload.size,
+        "status": upload.status, "sha256": upload.sha256, "chunk_size": CHUNK_BYTES,
+    }
+
+def _upload_spec(item: dict) -> Tuple[Optional[str], str, int]:
+    """(filename, mime, size) declarados para una subida, con las reglas del multipart."""
+    mime = str(item.get("mime") or "").lower()
+    if mime not in ALLOWED_MIME:
+        raise HTTPException(400, f"Tipo de archivo no permitido: {mime or 'desconocido'}")
+    try:
+        size = int(item.get("size"))
+    except (TypeError, ValueError):
+        raise HTTPException(422, "El campo 'size' debe ser un entero.")
+    if size <= 0:
+        raise HTTPException(400, "Archivo vacío.")
+    if size > MAX_IMAGE_BYTES:
+        raise HTTPException(400, f"Imagen demasiado grande (máximo {MAX_IMAGE_BYTES // (1024*1024)} MB).")
+    return sanitize_text(str(item.get("filename") or ""), 255) or None, mime, size
+
+def _ensure_upload_quota(db: Session, user: User, n: int) -> None:
+    open_uploads = db.query(UploadSession).filter(UploadSession.user_id == user.id).count()
+    if open_uploads + n > MAX_OPEN_UPLOADS:
+        raise HTTPException(429, "Demasiadas subidas en curso. Termina o cancela alguna antes de seguir.")
+
+@router.post("/uploads", status_code=201)
+def create_upload(
+    response: Response,
+    payload: dict = Body(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    """
+    Abre una subida reanudable de una imagen: {filename, size, mime}.
+    Después: PUT /uploads/{id}?offset=N con cada trozo, HEAD/GET para saber
+    por dónde va y POST /uploads/{id}/finalize al terminar.
+    """
     ensure_not_blocked(current_user)
-    ensure_owner_or_admin(current_user, user_id)
-
-    if len(images) > MAX_IMAGES:
-        raise HTTPException(status_code=400, detail=f"Máximo {MAX_IMAGES} imágenes")
+    maybe_sweep(db)
+    filename, mime, size = _upload_spec(payload)
+    _ensure_upload_quota(db, current_user, 1)
 
-    ad = models.Ad(
-        title=sanitize_text(title, 200),
-        description=sanitize_text(description, 5000),
-        user_id=user_id,
-        status="pending",
+    upload = UploadSession(
+        id=new_upload_id(), user_id=current_user.id, filename=filename, mime=mime, size=size,
+        offset=0, status=STATUS_OPEN,
     )
-    db.add(ad)
+    create_file(upload.id)
+    db.add(upload)
     db.commit()
-    db.refresh(ad)
+    return _upload_payload(upload, response)
 
-    img_urls = []
-    for up in images:
-        if (up.content_type or "").lower() not in ALLOWED_MIME:
-            raise HTTPException(400, f"Tipo de archivo no permitido: {up.content_type}")
+@router.post("/uploads/intent", status_code=201)
+def create_upload_intent(
+    request: Request,
+    payload: dict = Body(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Subida directa al almacenamiento, sin pasar los bytes por la app:
+    {files: [{size, mime, filename}], ad_id?}. Valida número (con ad_id, contra
+    los huecos que le quedan al anuncio), tamaño y tipo, y devuelve por imagen
+    un upload_id y el PUT que debe hacer el cliente (URL prefirmada; tamaño y
+    tipo van firmados). Después: POST /uploads/finalize y crear/editar el
+    anuncio con upload_ids. Si el backend no admite URLs prefirmadas, el
+    destino es el PUT por trozos de la app ("direct": false).
+    """
+    ensure_not_blocked(current_user)
+    maybe_sweep(db)
+    files = payload.get("files")
+    if not isinstance(files, list) or not files:
+        raise HTTPException(422, "Falta el campo 'files'.")
+
+    too_many = f"Máximo {MAX_IMAGES} imágenes"
+    max_files = MAX_IMAGES
+    if payload.get("ad_id") is not None:
+        ad = db.query(models.Ad).filter(models.Ad.id == _form_int(payload, "ad_id")).first()
+        if not ad:
+            raise HTTPException(status_code=404, detail="Anuncio no encontrado")
+        ensure_owner_or_admin(current_user, ad.user_id)
+        ensure_ad_editable(ad)
+        max_files = max(0, MAX_IMAGES - db.query(models.AdImage).filter(models.AdImage.ad_id == ad.id).count())
+        too_many = f"No puedes tener más de {MAX_IMAGES} imágenes"
+    if len(files) > max_files:
+        raise HTTPException(400, too_many)
+    specs = [_upload_spec(f if isinstance(f, dict) else {}) for f in files]
+    _ensure_upload_quota(db, current_user, len(specs))
+
+    storage = get_storage()
+    direct = storage.supports_direct_upload
+    targets = []
+    for filename, mime, size in specs:
+        upload = UploadSession(
+            id=new_upload_id(), user_id=current_user.id, filename=filename, mime=mime, size=size,
+            offset=0, status=STATUS_OPEN,
+        )
+        if direct:
+            upload.storage_key = storage.incoming_key(upload.id)
+            url, headers = storage.presign_put(upload.storage_key, mime, size, DIRECT_UPLOAD_SECONDS)
+        else:
+            create_file(upload.id)
+            url = f"{request.url_for('put_upload_chunk', upload_id=upload.id)}?offset=0"
+            headers = {"Content-Type": "application/octet-stream"}
+        db.add(upload)
+        targets.append({"upload_id": upload.id, "method": "PUT", "url": url, "headers": headers, "size": size})
+    db.commit()
+    return {
+        "direct": direct,
+        "expires_in": DIRECT_UPLOAD_SECONDS if direct else None,
+        "uploads": targets,
+    }
 
-        buf = _read_limited(up, MAX_IMAGE_BYTES)
-        clean, fmt = _open_validate_clean(buf)
+@router.api_route("/uploads/{upload_id}", methods=["GET", "HEAD"])
+def get_upload(
+    upload_id: str,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Estado de la subida; el offset (también en Upload-Offset) es desde dónde seguir."""
+    ensure_not_blocked(current_user)
+    return _upload_payload(_get_upload(db, upload_id, current_user), response)
+
+@router.put("/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    offset: int = Query(..., ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Cuerpo binario: bytes de la imagen a partir de `offset`, que debe ser el
+    offset actual (si no, 409 con el correcto en Upload-Offset). El trozo se
+    escribe a disco según llega; si la conexión se corta, lo recibido cuenta.
+    """
+    ensure_not_blocked(current_user)
+    upload = _get_upload(db, upload_id, current_user)
+    if upload.status != STATUS_OPEN:
+        raise HTTPException(409, "La subida ya está finalizada.")
+    if upload.storage_key:
+        raise HTTPException(409, "Esta subida va directa al almacenamiento: usa su URL prefirmada.")
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and offset + int(declared) > upload.size:
+        raise HTTPException(413, "El trozo supera el tamaño declarado de la subida.")
+
+    # Un trozo a la vez, también entre procesos: UPDATE condicional sobre el offset
+    lease = await run_in_threadpool(claim_chunk, db, upload.id, offset)
+    if lease is None:
+        db.expire_all()
+        upload = _get_upload(db, upload_id, current_user)
+        if offset != upload.offset:
+            raise HTTPException(
+                409, f"Offset incorrecto: la subida va por el byte {upload.offset}.",
+                headers={"Upload-Offset": str(upload.offset)},
+            )
+        raise HTTPException(409, "Ya se está recibiendo un trozo de esta subida.")
+
+    async def renew() -> bool:
+        nonlocal lease
+        lease = await run_in_threadpool(renew_chunk, db, upload.id, lease)
+        return lease is not None
 
-        if USE_CLOUDINARY:
-            url = _save_image_cloudinary(buf)
-        else:
-            url = _save_image_disk(clean, fmt)
+    try:
+        await write_chunk(upload.id, offset, upload.size, request.stream(), renew)
+    except FileNotFoundError:
+        raise HTTPException(404, "Subida no encontrada o caducada.")
+    finally:
+        # También si el cliente se ha desconectado: lo escrito es el nuevo offset
+        if lease is not None:
+            release_chunk(db, upload.id, lease, min(received_bytes(upload.id), upload.size))
+    db.expire_all()
+    return _upload_payload(_get_upload(db, upload_id, current_user), response)
+
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    response: Response,
+    payload: Optional[dict] = Body(default=None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Cierra la subida cuando han llegado todos los bytes: comprueba la firma de
+    imagen y, si el cliente manda {"sha256": ...}, que coincida. Ya se puede
+    usar su id en upload_ids al crear/editar un anuncio.
+    """
+    ensure_not_blocked(current_user)
+    upload = _get_upload(db, upload_id, current_user)
+    fetched = await _fetch_direct(upload) if upload.storage_key and upload.status != STATUS_COMPLETE else None
+    await _finalize_upload(db, upload, str((payload or {}).get("sha256") or ""), fetched)
+    return _upload_payload(upload, response)
 
-        db.add(models.AdImage(url=url, ad_id=ad.id))
-        img_urls.append(url)
+@router.post("/uploads/finalize")
+async def finalize_uploads(
+    payload: dict = Body(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Finaliza varias subidas de una vez: {upload_ids: [...], sha256?: {id: hash}}.
+    Las directas se traen del almacenamiento en paralelo. Cada una se comprueba
+    por separado: las que fallan vuelven con su error y el resto quedan listas.
+    """
+    ensure_not_blocked(current_user)
+    upload_ids = payload.get("upload_ids")
+    if not isinstance(upload_ids, list) or not upload_ids:
+        raise HTTPException(422, "Falta el campo 'upload_ids'.")
+    if len(upload_ids) > MAX_OPEN_UPLOADS:
+        raise HTTPException(400, f"Máximo {MAX_OPEN_UPLOADS} subidas por petición.")
+    hashes = payload.get("sha256") if isinstance(payload.get("sha256"), dict) else {}
+    uploads = [_get_upload(db, str(u), current_user) for u in dict.fromkeys(upload_ids)]
+
+    fetched = await asyncio.gather(*(
+        _fetch_direct(u) if u.storage_key and u.status != STATUS_COMPLETE else _none()
+        for u in uploads
+    ), return_exceptions=True)
+    results = []
+    for upload, got in zip(uploads, fetched):
+        upload_id = upload.id
+        try:
+            if isinstance(got, BaseException):
+                raise got
+            await _finalize_upload(db, upload, str(hashes.get(upload_id) or ""), got)
+            results.append({"upload_id": upload_id, "status": upload.status, "sha256": upload.sha256})
+        except HTTPException as e:
+            results.append({"upload_id": upload_id, "status": "failed", "error": e.detail})
+    return {"uploads": results}
+
+async def _none() -> None:
+    return None
+
+async def _fetch_direct(upload: UploadSession) -> Optional[int]:
+    """
+    Subida directa: copia (por bloques) el objeto entrante al fichero local de
+    la subida. Devuelve su tamaño, o None si el cliente aún no lo ha subido.
+    """
+    storage = get_storage()
+    await run_in_threadpool(create_file, upload.id)
+    try:
+        return await storage.download(upload.storage_key, upload_path(upload.id), upload.size)
+    except (StorageError, httpx.HTTPError) as e:
+        print(f"[storage] Error trayendo la subida directa {upload.id} de {storage.name}: {e}")
+        raise HTTPException(503, "El almacenamiento de imágenes no está disponible. Inténtalo más tarde.")
+
+async def _drop_direct(object_key: Optional[str]) -> None:
+    """Borra el objeto entrante (best-effort: la regla de ciclo de vida del bucket hace de red)."""
+    if not object_key:
+        return
+    try:
+        await get_storage().delete_object(object_key)
+    except (StorageError, httpx.HTTPError) as e:
+        print(f"[storage] No se pudo borrar la subida directa {object_key}: {e}")
 
+async def _discard_upload(db: Session, upload: UploadSession) -> None:
+    remote = upload.storage_key
+    db.delete(upload)
+    db.commit()
+    await run_in_threadpool(discard_uploads, [upload.id])
+    await _drop_direct(remote)
+
+async def _finalize_upload(
+    db: Session, upload: UploadSession, expected: str = "", fetched: Optional[int] = None
+) -> None:
+    """
+    Comprueba una subida con todos sus bytes (firma de imagen y, si el cliente
+    lo manda, SHA-256) y la deja 'complete' para usarla en upload_ids (commit).
+    En las directas, `fetched` es el tamaño traído del almacenamiento.
+    Si no es válida se descarta entera.
+    """
+    if upload.status == STATUS_COMPLETE:
+        return
+    remote = upload.storage_key
+    if remote:
+        if fetched is None:
+            raise HTTPException(409, "La imagen aún no ha llegado al almacenamiento. Súbela con la URL del intent.")
+        if fetched != upload.size:
+            await _discard_upload(db, upload)
+            raise HTTPException(400, "El tamaño de la imagen no coincide con el declarado.")
+        upload.offset = fetched
+    if upload.offset != upload.size:
+        raise HTTPException(
+            409, f"La subida está incompleta ({upload.offset} de {upload.size} bytes).",
+            headers={"Upload-Offset": str(upload.offset)},
+        )
+    try:
+        head, digest = await run_in_threadpool(inspect_file, upload.id)
+    except FileNotFoundError:
+        raise HTTPException(404, "Subida no encontrada o caducada.")
+
+    mime = sniff_image_mime(head)
+    if mime is None or (expected and expected.lower() != digest):
+        await _discard_upload(db, upload)
+        if mime is None:
+            raise HTTPException(400, "El archivo no es una imagen válida.")
+        raise HTTPException(422, "La imagen ha llegado dañada (SHA-256 distinto). Vuelve a subirla.")
+
+    upload.status = STATUS_COMPLETE
+    upload.sha256 = digest
+    upload.mime = mime
+    upload.storage_key = None  # ya está en el fichero local
+    upload.updated_at = datetime.utcnow()
     db.commit()
+    await _drop_direct(remote)
+
+@router.delete("/uploads/{upload_id}")
+async def cancel_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    ensure_not_blocked(current_user)
+    await _discard_upload(db, _get_upload(db, upload_id, current_user))
+    return {"msg": "Subida cancelada"}
+
+# ======================
+#   CREAR ANUNCIO
+# ======================
+@router.post(
+    "/create",
+    status_code=201,
+    openapi_extra=multipart_openapi(
+        {"title": "string", "description": "string", "user_id": "integer", "upload_ids": "string"},
+        "images",
+        required=("title", "description", "user_id"),
+    ),
+)
+async def create_ad(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    multipart/form-data: title, description, user_id + images (1..MAX_IMAGES).
+    El cuerpo se lee en streaming: cada imagen se empieza a procesar en cuanto
+    termina de llegar, mientras la siguiente aún se está recibiendo.
+    upload_ids (separados por comas): subidas reanudables ya finalizadas, que
+    cuentan como imágenes (ver /uploads).
+    """
+    ensure_not_blocked(current_user)
+
+    limits = UploadLimits(
+        max_files=MAX_IMAGES,
+        max_file_bytes=MAX_IMAGE_BYTES,
+        allowed_mime=ALLOWED_MIME,
+        file_fields=("images",),
+        max_body_bytes=MAX_BODY_BYTES,
+    )
+    fields = {}
+    pending: List[_PendingImage] = []
+    limiter = asyncio.Semaphore(IMAGE_REQUEST_CONCURRENCY)
+    try:
+        async for part in iter_multipart(request, limits):
+            if not part.is_file:
+                fields[part.name] = part.text
+                continue
+            if not pending and "user_id" in fields:
+                # Normalmente los campos llegan antes que los archivos:
+                # autorizamos antes de seguir leyendo imágenes
+                ensure_owner_or_admin(current_user, _form_int(fields, "user_id"))
+            _raise_failed(pending)
+            buf = bytes(part.data)
+            part.data.clear()
+            pending.append(await _start_ingest(db, buf, limiter, defer=IMAGE_DEFERRED))
+
+        user_id = _form_int(fields, "user_id")
+        ensure_owner_or_admin(current_user, user_id)
+        upload_ids = _form_upload_ids(fields)
+        if len(pending) + len(upload_ids) > MAX_IMAGES:
+            raise HTTPException(400, f"Máximo {MAX_IMAGES} imágenes")
+        for upload in _claim_uploads(db, upload_ids, current_user):
+            pending.append(await _start_ingest_upload(db, upload, limiter, defer=IMAGE_DEFERRED))
+        if not pending:
+            raise HTTPException(422, "Falta el campo 'images'.")
+
+        ad = models.Ad(
+            title=sanitize_text(_form_value(fields, "title"), 200),
+            description=sanitize_text(_form_value(fields, "description"), 5000),
+            user_id=user_id,
+            status="pending",
+        )
+        db.add(ad)
+        db.flush()
+
+        rows = [await _finish_ingest(db, p, ad.id) for p in pending]
+        images = [image_payload(im) for im in rows]
+    except BaseException:
+        await asyncio.shield(_abort_pending(db, pending))
+        raise
+
+    db.commit()
+    phash_index.add_images(rows)
+    if upload_ids:
+        await run_in_threadpool(discard_uploads, upload_ids)
+    if any(p.staged for p in pending):
+        notify_image_worker()
     return {
         "msg": "Anuncio creado exitosamente (pendiente de revisión)",
         "notice": "Tu anuncio se ha enviado para revisión. Normalmente se publica en unos minutos si todo es correcto.",
         "ad_id": ad.id,
-        "image_urls": img_urls,
+        "image_urls": [i["url"] for i in images if i["url"]],
+        "images": images,
         "status": ad.status,
         "editable": ad.status in ("active", "pending"),
     }
@@ -252,10 +915,15 @@ def get_ads_by_user(
     ensure_not_blocked(current_user)
     ensure_owner_or_admin(current_user, user_id)
 
-    ads = db.query(models.Ad).filter(models.Ad.user_id == user_id).all()
+    ads = (
+        db.query(models.Ad)
+        .options(selectinload(models.Ad.images).selectinload(models.AdImage.renditions))
+        .filter(models.Ad.user_id == user_id)
+        .all()
+    )
     result = []
     for ad in ads:
-        images = [{"id": img.id, "url": img.url} for img in ad.images]
+        images = [image_payload(img) for img in ad.images]
         s = (ad.status or "active").lower()
         result.append({
             "id": ad.id,
@@ -266,6 +934,7 @@ def get_ads_by_user(
             "editable": s in ("active", "pending"),
             "reject_reason": ad.reject_reason,
             "reviewed_at": ad.reviewed_at.isoformat() if ad.reviewed_at else None,
+            "images_cold": ad.images_cold_at is not None,
         })
     return result
 
@@ -291,10 +960,13 @@ def delete_ad(
 
     # 1) Elimina imágenes (DB + fichero)
     imgs = db.query(models.AdImage).filter(models.AdImage.ad_id == ad.id).all()
+    orphan_urls: List[str] = []
     for img in imgs:
-        _delete_storage(img.url)
+        orphan_urls += release_image(db, img)
         db.delete(img)
+    enqueue_deletions(db, orphan_urls)  # se borran en segundo plano (app/ads/deleter.py)
     db.commit()
+    notify_deleter()
 
     # 2) Elimina el anuncio
     db.delete(ad)
@@ -321,10 +993,13 @@ def delete_ad_plain(
 
     # 1) Elimina imágenes (DB + fichero)
     imgs = db.query(models.AdImage).filter(models.AdImage.ad_id == ad.id).all()
+    orphan_urls: List[str] = []
     for img in imgs:
-        _delete_storage(img.url)
+        orphan_urls += release_image(db, img)
         db.delete(img)
+    enqueue_deletions(db, orphan_urls)  # se borran en segundo plano (app/ads/deleter.py)
     db.commit()
+    notify_deleter()
 
     # 2) Elimina el anuncio
     db.delete(ad)
@@ -334,15 +1009,24 @@ def delete_ad_plain(
 # ======================
 #   EDITAR ANUNCIO
 # ======================
-@router.put("/edit/{ad_id}")
+@router.put(
+    "/edit/{ad_id}",
+    openapi_extra=multipart_openapi(
+        {"title": "string", "description": "string", "upload_ids": "string"},
+        "new_images",
+        required=("title", "description"),
+    ),
+)
 async def edit_ad(
     ad_id: int,
-    title: str = Form(...),
-    description: str = Form(...),
-    new_images: Optional[List[UploadFile]] = File(None),
+    request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    """
+    multipart/form-data: title, description + new_images opcionales (streaming)
+    y/o upload_ids de subidas reanudables finalizadas.
+    """
     ensure_not_blocked(current_user)
 
     ad = db.query(models.Ad).filter(models.Ad.id == ad_id).first()
@@ -352,29 +1036,48 @@ async def edit_ad(
     ensure_owner_or_admin(current_user, ad.user_id)
     ensure_ad_editable(ad)
 
-    ad.title = sanitize_text(title, 200)
-    ad.description = sanitize_text(description, 5000)
-
-    if new_images:
-        total_existing = db.query(models.AdImage).filter(models.AdImage.ad_id == ad_id).count()
-        if total_existing + len(new_images) > MAX_IMAGES:
-            raise HTTPException(status_code=400, detail=f"No puedes tener más de {MAX_IMAGES} imágenes")
-
-        for up in new_images:
-            if (up.content_type or "").lower() not in ALLOWED_MIME:
-                raise HTTPException(400, f"Tipo de archivo no permitido: {up.content_type}")
-
-            buf = _read_limited(up, MAX_IMAGE_BYTES)
-            clean, fmt = _open_validate_clean(buf)
-
-            if USE_CLOUDINARY:
-                url = _save_image_cloudinary(buf)
-            else:
-                url = _save_image_disk(clean, fmt)
-
-            db.add(models.AdImage(url=url, ad_id=ad.id))
+    total_existing = db.query(models.AdImage).filter(models.AdImage.ad_id == ad_id).count()
+    limits = UploadLimits(
+        max_files=max(0, MAX_IMAGES - total_existing),
+        max_file_bytes=MAX_IMAGE_BYTES,
+        allowed_mime=ALLOWED_MIME,
+        file_fields=("new_images",),
+        max_body_bytes=MAX_BODY_BYTES,
+        too_many_detail=f"No puedes tener más de {MAX_IMAGES} imágenes",
+    )
+    fields = {}
+    pending: List[_PendingImage] = []
+    limiter = asyncio.Semaphore(IMAGE_REQUEST_CONCURRENCY)
+    try:
+        async for part in iter_multipart(request, limits):
+            if not part.is_file:
+                fields[part.name] = part.text
+                continue
+            _raise_failed(pending)
+            buf = bytes(part.data)
+            part.data.clear()
+            pending.append(await _start_ingest(db, buf, limiter, defer=IMAGE_DEFERRED))
+
+        upload_ids = _form_upload_ids(fields)
+        if len(pending) + len(upload_ids) > limits.max_files:
+            raise HTTPException(400, limits.too_many_detail)
+        for upload in _claim_uploads(db, upload_ids, current_user):
+            pending.append(await _start_ingest_upload(db, upload, limiter, defer=IMAGE_DEFERRED))
+
+        ad.title = sanitize_text(_form_value(fields, "title"), 200)
+        ad.description = sanitize_text(_form_value(fields, "description"), 5000)
+
+        rows = [await _finish_ingest(db, p, ad.id) for p in pending]
+    except BaseException:
+        await asyncio.shield(_abort_pending(db, pending))
+        raise
 
     db.commit()
+    phash_index.add_images(rows)
+    if upload_ids:
+        await run_in_threadpool(discard_uploads, upload_ids)
+    if any(p.staged for p in pending):
+        notify_image_worker()
     return {
         "msg": "Anuncio actualizado",
         "status": ad.status,
@@ -403,9 +1106,11 @@ def delete_image(
     ensure_owner_or_admin(current_user, ad.user_id)
     ensure_ad_editable(ad)
 
-    _delete_storage(img.url)
+    orphan_urls = release_image(db, img)
     db.delete(img)
+    enqueue_deletions(db, orphan_urls)  # se borran en segundo plano (app/ads/deleter.py)
     db.commit()
+    notify_deleter()
     return {"msg": "Imagen eliminada"}
 
 # ======================
@@ -427,10 +1132,13 @@ def delete_all_images(
     ensure_ad_editable(ad)
 
     images = db.query(models.AdImage).filter(models.AdImage.ad_id == ad_id).all()
+    orphan_urls: List[str] = []
     for img in images:
-        _delete_storage(img.url)
+        orphan_urls += release_image(db, img)
         db.delete(img)
+    enqueue_deletions(db, orphan_urls)  # se borran en segundo plano (app/ads/deleter.py)
     db.commit()
+    notify_deleter()
     return {"msg": "Todas las imágenes eliminadas"}
 
 # =================================================
@@ -455,8 +1163,10 @@ def moderation_queue(
         .order_by(Ad.created_at.desc())
         .offset(offset)
         .limit(limit)
+        .options(selectinload(Ad.images).selectinload(AdImage.renditions))
         .all()
     )
+    hints = near_duplicate_hints(db, q)
     result = []
     for a in q:
         result.append({
@@ -467,8 +1177,11 @@ def moderation_queue(
             "status": a.status,
             "created_at": a.created_at.isoformat() if a.created_at else None,
             "reviewed_at": a.reviewed_at.isoformat() if a.reviewed_at else None,
+            "images_cold": a.images_cold_at is not None,
             "reject_reason": a.reject_reason,
-            "images": [{"id": im.id, "url": im.url} for im in a.images],
+            "images": [image_payload(im) for im in a.images],
+            # Otros anuncios con fotos casi idénticas (re-publicaciones, spam)
+            "near_duplicates": hints.get(a.id, []),
         })
     return {"items": result, "count": len(result), "status": status, "offset": offset, "limit": limit}
 
@@ -540,21 +1253,34 @@ def moderation_archive(
     return {"message": "Anuncio archivado", "ad_id": ad.id, "status": ad.status}
 
 @router.post("/moderation/{ad_id}/restore")
-def moderation_restore(
+async def moderation_restore(
     ad_id: int,
     db: Session = Depends(get_db),
     me: User = Depends(get_current_user),
 ):
     ensure_admin(me)
-    ad = db.query(Ad).filter(Ad.id == ad_id).first()
+    # async por la rehidratación: el trabajo síncrono (DB, disco) va a hilos
+    ad = await run_in_threadpool(lambda: db.query(Ad).filter(Ad.id == ad_id).first())
     if not ad:
         raise HTTPException(404, "Anuncio no encontrado")
 
-    ad.status = "pending"
-    ad.reviewed_by_id = me.id
-    ad.reviewed_at = datetime.utcnow()
-    db.add(ad)
-    db.commit()
-    _log_moderation(db, ad_id, me.id, "restored", None)
-
-    return {"message": "Anuncio movido a pendiente", "ad_id": ad.id, "status": ad.status}
+    # Imágenes en el nivel frío: vuelven al almacenamiento antes de reabrir el anuncio
+    was_cold = ad.images_cold_at is not None
+    try:
+        images = await rehydrate(db, ad)
+    except (StorageError, httpx.HTTPError) as e:
+        print(f"[storage] No se pudieron rehidratar las imágenes del anuncio {ad_id}: {e}")
+        raise HTTPException(503, "El almacenamiento de imágenes no está disponible. Inténtalo más tarde.")
+
+    def _reopen() -> dict:
+        ad.status = "pending"
+        ad.reviewed_by_id = me.id
+        ad.reviewed_at = datetime.utcnow()
+        db.add(ad)
+        db.commit()
+        if was_cold:
+            drop_bundle(ad.id)
+        _log_moderation(db, ad_id, me.id, "restored", None)
+        return {"message": "Anuncio movido a pendiente", "ad_id": ad.id, "status": ad.status, "images": images}
+
+    return await run_in_threadpool(_reopen)
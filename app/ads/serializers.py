@@ -0,0 +1,16 @@
+# app/ads/serializers.py
+#
+# Representación JSON compartida de las imágenes de anuncio: la usan tanto
+# los endpoints de anuncios (app/ads/routes.py) como los del panel de
+# administración (app/admin/routes.py), para que no se desincronicen.
+from app.models import AdImage
+from app.ads.renditions import srcset
+
+
+def image_payload(im: AdImage) -> dict:
+    # url = None mientras la imagen está en cola (status 'queued') o si falló
+    return {
+        "id": im.id, "url": im.url or None, "srcset": srcset(im), "placeholder": im.placeholder,
+        "width": im.width, "height": im.height, "bytes": im.bytes, "format": im.format,
+        "status": im.status, "error": im.error,
+    }
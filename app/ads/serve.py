@@ -0,0 +1,133 @@
+# app/ads/serve.py
+#
+# Servido de /static/images (backend de disco). Sustituye al mount genérico
+# de StaticFiles para esa carpeta:
+#   - Cache-Control: immutable en nombres por contenido (<sha256>[_<ancho>].ext)
+#     y en los UUID antiguos: nunca cambian, el navegador no revalida.
+#     El resto (p.ej. ads/ad_23_1.png) se revalida cada IMAGE_REVALIDATE_SECONDS.
+#   - ETag fuerte (el propio hash del nombre o tamaño+mtime en ns) e
+#     If-None-Match -> 304 (con prioridad sobre If-Modified-Since, RFC 9110).
+#   - Range / If-Range (FileResponse de Starlette: 206, multipart, 416).
+#   - URLs planas antiguas (<sha256>.jpg) que ya se movieron a su carpeta
+#     (ab/cd/<sha256>.jpg, ver scripts/shard_images.py) siguen sirviéndose.
+#   - Envío sin copia: la extensión ASGI http.response.zerocopysend o
+#     http.response.pathsend si el servidor la ofrece; o, detrás de nginx,
+#     X-Accel-Redirect (IMAGE_ACCEL_REDIRECT) para que lo sirva con sendfile.
+#
+# Variables de entorno:
+#   IMAGE_ACCEL_REDIRECT     = prefijo de la location interna de nginx (p.ej. /_images/);
+#                              vacío = sirve la app
+#   IMAGE_REVALIDATE_SECONDS = max-age de los nombres que no son inmutables (por defecto: 3600)
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from app.ads.storage import shard_key
+
+ACCEL_REDIRECT = os.getenv("IMAGE_ACCEL_REDIRECT", "").strip()
+REVALIDATE_SECONDS = int(os.getenv("IMAGE_REVALIDATE_SECONDS", "3600") or 3600)
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# <sha256>, <sha256>_<ancho> o <uuid4 hex> (nombres que nunca se reutilizan)
+IMMUTABLE_NAME = re.compile(r"^[0-9a-f]{32,64}(_\d+)?$")
+
+
+def is_immutable(name: str) -> bool:
+    return bool(IMMUTABLE_NAME.match(os.path.splitext(os.path.basename(name))[0]))
+
+
+def strong_etag(name: str, stat_result: os.stat_result) -> str:
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if is_immutable(name):
+        return f'"{stem}"'  # igual en todas las réplicas
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110 13.1.2), con soporte de '*'."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+class ImageFileResponse(FileResponse):
+    """FileResponse que usa el envío sin copia del servidor ASGI cuando lo hay."""
+
+    _extensions: Dict[str, dict] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._extensions = scope.get("extensions") or {}
+        await super().__call__(scope, receive, send)
+
+    async def _handle_simple(self, send: Send, send_header_only: bool) -> None:
+        if send_header_only or not (
+            "http.response.pathsend" in self._extensions or "http.response.zerocopysend" in self._extensions
+        ):
+            return await super()._handle_simple(send, send_header_only)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if "http.response.pathsend" in self._extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+        with open(self.path, "rb") as f:
+            await send({"type": "http.response.zerocopysend", "file": f})
+
+    async def _handle_single_range(
+        self, send: Send, start: int, end: int, file_size: int, send_header_only: bool
+    ) -> None:
+        if send_header_only or "http.response.zerocopysend" not in self._extensions:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        with open(self.path, "rb") as f:
+            await send({"type": "http.response.zerocopysend", "file": f, "offset": start, "count": end - start})
+
+
+class ImageFiles(StaticFiles):
+    """StaticFiles para la carpeta de imágenes con caché inmutable y ETag fuerte."""
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None and "/" not in path and shard_key(path) != path:
+            # URL plana de un fichero ya repartido en ab/cd/
+            return super().lookup_path(shard_key(path))
+        return full_path, stat_result
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        name = str(full_path)
+        headers = {
+            "etag": strong_etag(name, stat_result),
+            "cache-control": IMMUTABLE_CACHE if is_immutable(name) else f"public, max-age={REVALIDATE_SECONDS}",
+            "x-content-type-options": "nosniff",
+        }
+        request_headers = Headers(scope=scope)
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if etag_matches(if_none_match, headers["etag"]):
+                return Response(status_code=304, headers=headers)
+        elif self.is_not_modified(FileResponse(full_path, stat_result=stat_result).headers, request_headers):
+            # Sin If-None-Match: If-Modified-Since contra Last-Modified
+            return Response(status_code=304, headers=headers)
+
+        if ACCEL_REDIRECT:
+            rel = os.path.relpath(name, self.directory).replace(os.sep, "/")
+            response = FileResponse(full_path, stat_result=stat_result, headers=headers)
+            # nginx sirve el fichero (sendfile, rangos); la app sólo pone cabeceras
+            return Response(status_code=status_code, headers={
+                **headers,
+                "content-type": response.media_type or "application/octet-stream",
+                "x-accel-redirect": ACCEL_REDIRECT.rstrip("/") + "/" + rel,
+            })
+        return ImageFileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
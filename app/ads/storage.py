@@ -0,0 +1,799 @@
+# app/ads/storage.py
+#
+# Capa de almacenamiento de ficheros de imagen con backends intercambiables:
+#   - disk:       ./static/images (servido por el mount /static)
+#   - s3:         cualquier API compatible con S3 (AWS, MinIO, R2...), firmada
+#                 con SigV4 a mano: no hace falta boto3
+#   - cloudinary: API REST de subida/borrado
+# Los backends remotos usan un único httpx.AsyncClient con pool de conexiones
+# (keep-alive) por backend; se cierra en el lifespan de la app (close_storage).
+#
+# Variables de entorno:
+#   STORAGE_BACKEND = disk | s3 | cloudinary  (por defecto: cloudinary si hay
+#                     credenciales, s3 si hay S3_BUCKET, si no disk)
+#   S3_BUCKET, S3_ENDPOINT, S3_REGION, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY,
+#   S3_PREFIX, S3_PUBLIC_URL  (las credenciales necesitan s3:ListBucket: sin él S3
+#                     responde 403 en vez de 404 a lo que no existe, y 403 se trata como error)
+#   S3_INCOMING_PREFIX = prefijo de las subidas directas del cliente (por defecto: incoming/;
+#                        fuera de S3_PREFIX: conviene una regla de ciclo de vida que lo
+#                        caduque en 1 día y CORS que permita PUT desde la web)
+#   CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET, CLOUDINARY_FOLDER
+#   IMAGE_DISK_LAYOUT = sharded | flat  (por defecto: sharded; sólo afecta al disco)
+#
+# Las claves son nombres de fichero por contenido (<sha256>[_<ancho>].<ext>);
+# cada backend sabe convertir clave -> URL pública y URL -> clave.
+# En disco los ficheros nuevos van repartidos en dos niveles por el propio
+# hash (ab/cd/<sha256>.webp) para que ningún directorio crezca sin límite;
+# scripts/shard_images.py mueve los antiguos y las URLs planas siguen
+# resolviendo (lecturas y /static/images) mientras dura la transición.
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import anyio
+import anyio.from_thread
+import httpx
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+IMAGES_DIR = PROJECT_ROOT / "static" / "images"
+IMAGES_URL_PREFIX = "/static/images/"
+
+DISK_LAYOUT = (os.getenv("IMAGE_DISK_LAYOUT", "sharded") or "sharded").strip().lower()
+# Nombres que se reparten: <sha256>, <sha256>_<ancho> o <uuid4 hex>, con extensión
+SHARDABLE_NAME = re.compile(r"^[0-9a-f]{32,64}(_\d+)?\.[A-Za-z0-9]+$")
+
+HTTP_TIMEOUT = float(os.getenv("STORAGE_HTTP_TIMEOUT", "30") or 30)
+HTTP_MAX_CONNECTIONS = int(os.getenv("STORAGE_HTTP_MAX_CONNECTIONS", "20") or 20)
+
+
+class StorageError(RuntimeError):
+    pass
+
+
+def shard_key(name: str) -> str:
+    """<hash>.ext -> ab/cd/<hash>.ext; otros nombres (o ya con carpeta) no cambian."""
+    if "/" in name or not SHARDABLE_NAME.match(name):
+        return name
+    return f"{name[:2]}/{name[2:4]}/{name}"
+
+
+class StoredObject(NamedTuple):
+    key: str
+    mtime: float  # epoch (s)
+    size: int
+
+
+class StorageBackend:
+    """Interfaz común. `put` devuelve True si creó el objeto, False si ya existía."""
+
+    name = "base"
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def key_for(self, url: str) -> Optional[str]:
+        """Clave del objeto si la URL es de este backend (None si no lo es)."""
+        raise NotImplementedError
+
+    def object_key(self, name: str) -> str:
+        """Clave con la que se guarda un fichero nuevo llamado `name`."""
+        return name
+
+    async def put(self, key: str, data: bytes, content_type: str) -> bool:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Bytes del objeto, o None si no existe."""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def delete_many(self, keys: List[str]) -> None:
+        for key in keys:
+            await self.delete(key)
+
+    def list_keys(self) -> AsyncIterator[StoredObject]:
+        """Todos los objetos, en orden lexicográfico de clave (para el reconciliador)."""
+        raise NotImplementedError(f"El backend {self.name} no permite listar objetos")
+
+    # --- Subidas directas del cliente (URL prefirmada), sin pasar por la app ---
+    # Trabajan con claves absolutas del bucket (fuera de las imágenes publicadas).
+    supports_direct_upload = False
+
+    def incoming_key(self, upload_id: str) -> str:
+        raise NotImplementedError(f"El backend {self.name} no admite subidas directas")
+
+    def presign_put(self, object_key: str, content_type: str, size: int, expires: int) -> Tuple[str, Dict[str, str]]:
+        """(URL, cabeceras que debe mandar el cliente) para subir `size` bytes con PUT."""
+        raise NotImplementedError(f"El backend {self.name} no admite subidas directas")
+
+    async def download(self, object_key: str, dest: Path, max_bytes: int) -> Optional[int]:
+        """
+        Copia un objeto subido directamente a un fichero local, por bloques.
+        Devuelve su tamaño (None si no existe); deja de leer al pasar de `max_bytes`.
+        """
+        raise NotImplementedError(f"El backend {self.name} no admite subidas directas")
+
+    async def delete_object(self, object_key: str) -> None:
+        raise NotImplementedError(f"El backend {self.name} no admite subidas directas")
+
+    async def aclose(self) -> None:
+        pass
+
+
+class _HttpBackend(StorageBackend):
+    """Backend remoto con un cliente HTTP compartido (pool de conexiones)."""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                ),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+# ======================
+#   DISCO LOCAL
+# ======================
+class DiskStorage(StorageBackend):
+    name = "disk"
+
+    def __init__(self, root: Path = IMAGES_DIR, url_prefix: str = IMAGES_URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def url(self, key: str) -> str:
+        return f"{self.url_prefix}{key}"
+
+    def key_for(self, url: str) -> Optional[str]:
+        if not url or not url.startswith(self.url_prefix):
+            return None
+        key = url[len(self.url_prefix):]
+        # Nunca salir de la carpeta de imágenes
+        if not key or ".." in key.split("/") or key.startswith("/"):
+            return None
+        return key
+
+    def object_key(self, name: str) -> str:
+        return shard_key(name) if DISK_LAYOUT == "sharded" else name
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def _read(self, key: str) -> Optional[bytes]:
+        if not key or ".." in key.split("/") or key.startswith("/"):
+            return None
+        # Una clave plana antigua puede haberse movido ya a su carpeta (shard_images.py)
+        for candidate in dict.fromkeys((key, shard_key(key))):
+            try:
+                return self.path(candidate).read_bytes()
+            except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+                continue
+        return None
+
+    def _write(self, key: str, data: bytes) -> bool:
+        fpath = self.path(key)
+        # Nombres por contenido: si ya existe es idéntico y no se reescribe
+        if fpath.exists():
+            return False
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fpath.with_name(f".{fpath.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, fpath)
+        return True
+
+    def _unlink(self, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                self.path(key).unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    async def put(self, key: str, data: bytes, content_type: str) -> bool:
+        return await anyio.to_thread.run_sync(self._write, key, data)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await anyio.to_thread.run_sync(self._read, key)
+
+    async def delete(self, key: str) -> None:
+        await anyio.to_thread.run_sync(self._unlink, [key])
+
+    async def delete_many(self, keys: List[str]) -> None:
+        if keys:
+            await anyio.to_thread.run_sync(self._unlink, list(keys))
+
+    @staticmethod
+    def _list_dir(path: str) -> List[tuple]:
+        """(clave de orden, nombre, es_dir, mtime, tamaño) de un directorio, ordenado."""
+        out = []
+        with os.scandir(path) as it:
+            for entry in it:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir:
+                    out.append((entry.name + "/", entry.name, True, 0.0, 0))
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    out.append((entry.name, entry.name, False, st.st_mtime, st.st_size))
+        out.sort()
+        return out
+
+    async def list_keys(self) -> AsyncIterator[StoredObject]:
+        # Recorrido en profundidad ordenando cada directorio por "nombre/" para
+        # que las claves salgan en orden lexicográfico global ("ab.png" < "ab/cd...")
+        # sin cargar más de un directorio a la vez
+        stack = [("", iter(await anyio.to_thread.run_sync(self._list_dir, str(self.root))))]
+        while stack:
+            prefix, entries = stack[-1]
+            item = next(entries, None)
+            if item is None:
+                stack.pop()
+                continue
+            _, name, is_dir, mtime, size = item
+            if is_dir:
+                listing = await anyio.to_thread.run_sync(self._list_dir, str(self.root / prefix / name))
+                stack.append((f"{prefix}{name}/", iter(listing)))
+            else:
+                yield StoredObject(prefix + name, mtime, size)
+
+
+# ======================
+#   S3 COMPATIBLE
+# ======================
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+
+def _sign(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+def _signature(secret_key: str, datestamp: str, region: str, service: str, string_to_sign: str) -> str:
+    k = _sign(("AWS4" + secret_key).encode("utf-8"), datestamp)
+    k = _sign(k, region)
+    k = _sign(k, service)
+    k = _sign(k, "aws4_request")
+    return hmac.new(k, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _canonical_query(pairs: List[Tuple[str, str]]) -> str:
+    encoded = [(quote(k, safe="-_.~"), quote(v, safe="-_.~")) for k, v in pairs]
+    return "&".join(f"{k}={v}" for k, v in sorted(encoded))
+
+
+def _query_pairs(query: str) -> List[Tuple[str, str]]:
+    pairs = []
+    for item in query.split("&") if query else []:
+        k, _, v = item.partition("=")
+        pairs.append((k, v))
+    return pairs
+
+
+def sigv4_headers(
+    method: str,
+    url: str,
+    headers: Dict[str, str],
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    service: str = "s3",
+    now: Optional[datetime] = None,
+) -> Dict[str, str]:
+    """
+    Cabeceras firmadas (AWS Signature Version 4) para una petición.
+    `url` ya debe ir con el path codificado; la query se normaliza aquí.
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    datestamp = now.strftime("%Y%m%d")
+    parts = urlsplit(url)
+    canonical_query = _canonical_query(_query_pairs(parts.query))
+
+    signed = {k.lower(): str(v).strip() for k, v in headers.items()}
+    signed["host"] = parts.netloc
+    signed["x-amz-date"] = amz_date
+    signed["x-amz-content-sha256"] = payload_hash
+    names = sorted(signed)
+    canonical_headers = "".join(f"{n}:{signed[n]}\n" for n in names)
+    signed_headers = ";".join(names)
+
+    canonical_request = "\n".join([
+        method, parts.path or "/", canonical_query, canonical_headers, signed_headers, payload_hash,
+    ])
+    scope = f"{datestamp}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope,
+        hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    ])
+    signature = _signature(secret_key, datestamp, region, service, string_to_sign)
+
+    out = {n: signed[n] for n in names if n != "host"}
+    out["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return out
+
+
+def sigv4_presign(
+    method: str,
+    url: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    expires: int,
+    headers: Optional[Dict[str, str]] = None,
+    service: str = "s3",
+    now: Optional[datetime] = None,
+) -> str:
+    """
+    URL prefirmada (Signature Version 4 en la query), válida `expires` segundos.
+    Las cabeceras de `headers` quedan firmadas: quien use la URL tiene que
+    mandarlas con ese mismo valor (p.ej. content-length fija el tamaño).
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    datestamp = now.strftime("%Y%m%d")
+    parts = urlsplit(url)
+    scope = f"{datestamp}/{region}/{service}/aws4_request"
+
+    signed = {k.lower(): str(v).strip() for k, v in (headers or {}).items()}
+    signed["host"] = parts.netloc
+    names = sorted(signed)
+    canonical_headers = "".join(f"{n}:{signed[n]}\n" for n in names)
+    signed_headers = ";".join(names)
+
+    query = _query_pairs(parts.query) + [
+        ("X-Amz-Algorithm", "AWS4-HMAC-SHA256"),
+        ("X-Amz-Credential", f"{access_key}/{scope}"),
+        ("X-Amz-Date", amz_date),
+        ("X-Amz-Expires", str(int(expires))),
+        ("X-Amz-SignedHeaders", signed_headers),
+    ]
+    canonical_query = _canonical_query(query)
+    canonical_request = "\n".join([
+        method, parts.path or "/", canonical_query, canonical_headers, signed_headers, UNSIGNED_PAYLOAD,
+    ])
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope,
+        hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    ])
+    signature = _signature(secret_key, datestamp, region, service, string_to_sign)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}?{canonical_query}&X-Amz-Signature={signature}"
+
+
+class S3Storage(_HttpBackend):
+    """
+    Bucket S3 (o compatible: MinIO, R2...) con direccionamiento por path
+    (<endpoint>/<bucket>/<clave>), que es el que aceptan todos.
+    """
+
+    name = "s3"
+    DELETE_BATCH = 1000  # máximo de DeleteObjects
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint: str,
+        region: str,
+        access_key: str,
+        secret_key: str,
+        prefix: str = "images/",
+        public_url: Optional[str] = None,
+        incoming_prefix: str = "incoming/",
+    ):
+        super().__init__()
+        self.bucket = bucket
+        self.endpoint = endpoint.rstrip("/")
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix
+        self.public_url = (public_url or f"{self.endpoint}/{bucket}").rstrip("/")
+        self.incoming_prefix = incoming_prefix
+        self.supports_direct_upload = bool(bucket and access_key and secret_key)
+
+    @classmethod
+    def from_env(cls) -> "S3Storage":
+        region = os.getenv("S3_REGION") or os.getenv("AWS_REGION") or "us-east-1"
+        return cls(
+            bucket=os.getenv("S3_BUCKET") or os.getenv("AWS_S3_BUCKET", ""),
+            endpoint=os.getenv("S3_ENDPOINT") or f"https://s3.{region}.amazonaws.com",
+            region=region,
+            access_key=os.getenv("S3_ACCESS_KEY_ID") or os.getenv("AWS_ACCESS_KEY_ID", ""),
+            secret_key=os.getenv("S3_SECRET_ACCESS_KEY") or os.getenv("AWS_SECRET_ACCESS_KEY", ""),
+            prefix=os.getenv("S3_PREFIX", "images/"),
+            public_url=os.getenv("S3_PUBLIC_URL") or None,
+            incoming_prefix=os.getenv("S3_INCOMING_PREFIX", "incoming/"),
+        )
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{self.prefix}{key}"
+
+    def key_for(self, url: str) -> Optional[str]:
+        base = f"{self.public_url}/{self.prefix}"
+        if url and url.startswith(base):
+            return url[len(base):] or None
+        return None
+
+    def _object_url(self, key: str) -> str:
+        return self._raw_url(self.prefix + key)
+
+    def _raw_url(self, object_key: str) -> str:
+        return f"{self.endpoint}/{self.bucket}/{quote(object_key, safe='/-_.~')}"
+
+    async def _request(self, method: str, url: str, body: bytes = b"", headers: Optional[dict] = None):
+        headers = dict(headers or {})
+        payload_hash = hashlib.sha256(body).hexdigest()
+        signed = sigv4_headers(
+            method, url, headers, payload_hash, self.access_key, self.secret_key, self.region,
+        )
+        return await self.client.request(method, url, content=body, headers=signed)
+
+    async def put(self, key: str, data: bytes, content_type: str) -> bool:
+        # Escritura condicional: si la clave (por contenido) ya existe, 412
+        resp = await self._request("PUT", self._object_url(key), data, {
+            "content-type": content_type,
+            "cache-control": "public, max-age=31536000, immutable",
+            "if-none-match": "*",
+        })
+        if resp.status_code == 412:
+            return False
+        if resp.status_code >= 300:
+            raise StorageError(f"S3 PUT {key}: {resp.status_code} {resp.text[:200]}")
+        return True
+
+    async def get(self, key: str) -> Optional[bytes]:
+        resp = await self._request("GET", self._object_url(key))
+        if resp.status_code == 404:
+            return None
+        if resp.status_code >= 300:
+            raise StorageError(f"S3 GET {key}: {resp.status_code} {resp.text[:200]}")
+        return resp.content
+
+    async def delete(self, key: str) -> None:
+        resp = await self._request("DELETE", self._object_url(key))
+        if resp.status_code >= 300 and resp.status_code != 404:
+            raise StorageError(f"S3 DELETE {key}: {resp.status_code} {resp.text[:200]}")
+
+    # --- Subidas directas ---
+    def incoming_key(self, upload_id: str) -> str:
+        return f"{self.incoming_prefix}{upload_id}"
+
+    def presign_put(self, object_key: str, content_type: str, size: int, expires: int) -> Tuple[str, Dict[str, str]]:
+        # content-type y content-length firmados: S3 rechaza (403) otro tipo u otro tamaño
+        url = sigv4_presign(
+            "PUT", self._raw_url(object_key), self.access_key, self.secret_key, self.region, expires,
+            headers={"content-type": content_type, "content-length": str(size)},
+        )
+        return url, {"Content-Type": content_type}
+
+    async def download(self, object_key: str, dest: Path, max_bytes: int) -> Optional[int]:
+        url = self._raw_url(object_key)
+        signed = sigv4_headers(
+            "GET", url, {}, hashlib.sha256(b"").hexdigest(), self.access_key, self.secret_key, self.region,
+        )
+        async with self.client.stream("GET", url, headers=signed) as resp:
+            # 404: el cliente aún no lo ha subido; 403 (credenciales, política) es un error
+            if resp.status_code == 404:
+                return None
+            if resp.status_code >= 300:
+                await resp.aread()
+                raise StorageError(f"S3 GET {object_key}: {resp.status_code} {resp.text[:200]}")
+            size = 0
+            with open(dest, "wb") as f:
+                async for chunk in resp.aiter_bytes(256 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        break
+                    await anyio.to_thread.run_sync(f.write, chunk)
+            return size
+
+    async def delete_object(self, object_key: str) -> None:
+        resp = await self._request("DELETE", self._raw_url(object_key))
+        if resp.status_code >= 300 and resp.status_code != 404:
+            raise StorageError(f"S3 DELETE {object_key}: {resp.status_code} {resp.text[:200]}")
+
+    async def list_keys(self) -> AsyncIterator[StoredObject]:
+        # ListObjectsV2 devuelve las claves en orden binario (UTF-8), paginadas
+        token = None
+        ns = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+        while True:
+            query = f"list-type=2&max-keys=1000&prefix={quote(self.prefix, safe='')}"
+            if token:
+                query += f"&continuation-token={quote(token, safe='')}"
+            resp = await self._request("GET", f"{self.endpoint}/{self.bucket}?{query}")
+            if resp.status_code >= 300:
+                raise StorageError(f"S3 ListObjectsV2: {resp.status_code} {resp.text[:200]}")
+            root = ElementTree.fromstring(resp.content)
+            for item in root.iter(f"{ns}Contents"):
+                key = item.findtext(f"{ns}Key", "")[len(self.prefix):]
+                modified = item.findtext(f"{ns}LastModified", "")
+                mtime = datetime.fromisoformat(modified.replace("Z", "+00:00")).timestamp() if modified else 0.0
+                yield StoredObject(key, mtime, int(item.findtext(f"{ns}Size", "0")))
+            if root.findtext(f"{ns}IsTruncated") != "true":
+                return
+            token = root.findtext(f"{ns}NextContinuationToken")
+
+    async def delete_many(self, keys: List[str]) -> None:
+        keys = list(keys)
+        for i in range(0, len(keys), self.DELETE_BATCH):
+            chunk = keys[i:i + self.DELETE_BATCH]
+            objects = "".join(f"<Object><Key>{escape(self.prefix + k)}</Key></Object>" for k in chunk)
+            body = f'<Delete><Quiet>true</Quiet>{objects}</Delete>'.encode("utf-8")
+            md5 = base64.b64encode(hashlib.md5(body).digest()).decode("ascii")
+            resp = await self._request("POST", f"{self.endpoint}/{self.bucket}?delete=", body, {
+                "content-type": "application/xml",
+                "content-md5": md5,
+            })
+            if resp.status_code >= 300:
+                raise StorageError(f"S3 DeleteObjects: {resp.status_code} {resp.text[:200]}")
+            if b"<Error>" in resp.content:
+                raise StorageError(f"S3 DeleteObjects con errores: {resp.text[:200]}")
+
+
+# ======================
+#   CLOUDINARY
+# ======================
+class CloudinaryStorage(_HttpBackend):
+    """API REST de Cloudinary: subida firmada, destroy y borrado en bloque (Admin API)."""
+
+    name = "cloudinary"
+    DELETE_BATCH = 100  # máximo de public_ids por llamada de la Admin API
+    _VERSION_RE = re.compile(r"^v\d+/")
+
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str, folder: str = "deotramano/ads"):
+        super().__init__()
+        self.cloud_name = cloud_name
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.folder = folder.strip("/")
+        self.api = f"https://api.cloudinary.com/v1_1/{cloud_name}"
+        self.delivery = f"https://res.cloudinary.com/{cloud_name}/image/upload/"
+
+    @classmethod
+    def from_env(cls) -> "CloudinaryStorage":
+        return cls(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME", ""),
+            api_key=os.getenv("CLOUDINARY_API_KEY", ""),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET", ""),
+            folder=os.getenv("CLOUDINARY_FOLDER", "deotramano/ads"),
+        )
+
+    def _public_id(self, key: str) -> str:
+        stem = key.rsplit(".", 1)[0]
+        return f"{self.folder}/{stem}" if self.folder else stem
+
+    def url(self, key: str) -> str:
+        ext = key.rsplit(".", 1)[-1] if "." in key else ""
+        return f"{self.delivery}{self._public_id(key)}" + (f".{ext}" if ext else "")
+
+    def key_for(self, url: str) -> Optional[str]:
+        """Devuelve el public_id (con extensión) de una URL de entrega, con o sin versión."""
+        if not url or not url.startswith(self.delivery):
+            return None
+        path = self._VERSION_RE.sub("", url[len(self.delivery):])
+        return path or None
+
+    def _signed(self, params: Dict[str, str]) -> Dict[str, str]:
+        params = {k: v for k, v in params.items() if v not in (None, "")}
+        to_sign = "&".join(f"{k}={params[k]}" for k in sorted(params))
+        params["signature"] = hashlib.sha1((to_sign + self.api_secret).encode("utf-8")).hexdigest()
+        params["api_key"] = self.api_key
+        return params
+
+    async def put(self, key: str, data: bytes, content_type: str) -> bool:
+        params = self._signed({
+            "public_id": self._public_id(key),
+            "overwrite": "false",
+            "timestamp": str(int(time.time())),
+        })
+        resp = await self.client.post(
+            f"{self.api}/image/upload", data=params, files={"file": (key, data, content_type)},
+        )
+        if resp.status_code >= 300:
+            raise StorageError(f"Cloudinary upload {key}: {resp.status_code} {resp.text[:200]}")
+        return not resp.json().get("existing", False)
+
+    def _id_from_key(self, key: str) -> str:
+        # Las claves de key_for() ya llevan la carpeta; las de put() no
+        stem = key.rsplit(".", 1)[0]
+        if self.folder and not stem.startswith(self.folder + "/"):
+            return self._public_id(key)
+        return stem
+
+    async def get(self, key: str) -> Optional[bytes]:
+        ext = key.rsplit(".", 1)[-1] if "." in key else ""
+        resp = await self.client.get(f"{self.delivery}{self._id_from_key(key)}" + (f".{ext}" if ext else ""))
+        if resp.status_code == 404:
+            return None
+        if resp.status_code >= 300:
+            raise StorageError(f"Cloudinary GET {key}: {resp.status_code} {resp.text[:200]}")
+        return resp.content
+
+    async def delete(self, key: str) -> None:
+        params = self._signed({
+            "public_id": self._id_from_key(key),
+            "invalidate": "true",
+            "timestamp": str(int(time.time())),
+        })
+        resp = await self.client.post(f"{self.api}/image/destroy", data=params)
+        if resp.status_code >= 300:
+            raise StorageError(f"Cloudinary destroy {key}: {resp.status_code} {resp.text[:200]}")
+
+    async def delete_many(self, keys: List[str]) -> None:
+        ids = [self._id_from_key(k) for k in keys]
+        for i in range(0, len(ids), self.DELETE_BATCH):
+            resp = await self.client.request(
+                "DELETE",
+                f"{self.api}/resources/image/upload",
+                params=[("public_ids[]", pid) for pid in ids[i:i + self.DELETE_BATCH]],
+                auth=(self.api_key, self.api_secret),
+            )
+            if resp.status_code >= 300:
+                raise StorageError(f"Cloudinary delete_resources: {resp.status_code} {resp.text[:200]}")
+
+
+# ======================
+#   SELECCIÓN DE BACKEND
+# ======================
+_backend: Optional[StorageBackend] = None
+_disk: Optional[DiskStorage] = None
+_lock = threading.Lock()
+
+
+def configured_backend_name() -> str:
+    name = os.getenv("STORAGE_BACKEND", "").strip().lower()
+    if name:
+        return name
+    if os.getenv("CLOUDINARY_CLOUD_NAME") and os.getenv("CLOUDINARY_API_KEY") and os.getenv("CLOUDINARY_API_SECRET"):
+        return "cloudinary"
+    if os.getenv("S3_BUCKET") or os.getenv("AWS_S3_BUCKET"):
+        return "s3"
+    return "disk"
+
+
+def build_backend() -> StorageBackend:
+    """Instancia nueva del backend configurado (para jobs con su propio event loop)."""
+    name = configured_backend_name()
+    if name == "disk":
+        return disk_storage()
+    if name == "s3":
+        return S3Storage.from_env()
+    if name == "cloudinary":
+        return CloudinaryStorage.from_env()
+    raise StorageError(f"STORAGE_BACKEND desconocido: {name}")
+
+
+def disk_storage() -> DiskStorage:
+    """Disco local: siempre disponible (URLs antiguas /static/images/...)."""
+    global _disk
+    if _disk is None:
+        with _lock:
+            if _disk is None:
+                _disk = DiskStorage()
+    return _disk
+
+
+def get_storage() -> StorageBackend:
+    """Backend activo para escrituras nuevas (se crea perezosamente)."""
+    global _backend
+    if _backend is None:
+        backend = build_backend()
+        with _lock:
+            if _backend is None:
+                _backend = backend
+    return _backend
+
+
+async def close_storage() -> None:
+    """Hook de cierre para el lifespan: cierra los pools HTTP."""
+    global _backend
+    with _lock:
+        backend, _backend = _backend, None
+    if backend is not None:
+        await backend.aclose()
+
+
+def _backends() -> List[StorageBackend]:
+    active = get_storage()
+    disk = disk_storage()
+    return [active] if active is disk else [active, disk]
+
+
+def owner_of(url: str):
+    """(backend, clave) que corresponde a una URL, o (None, None) si es ajena."""
+    for backend in _backends():
+        key = backend.key_for(url)
+        if key is not None:
+            return backend, key
+    return None, None
+
+
+async def read_key(key: str) -> Optional[bytes]:
+    """
+    Bytes de una clave en el backend activo o, si no está, en el disco local
+    (imágenes antiguas). Si un backend falla pero otro la tiene, vale esa; si
+    no la tiene ninguno, se propaga el error (no es lo mismo que "no existe").
+    """
+    error: Optional[Exception] = None
+    for backend in _backends():
+        try:
+            data = await backend.get(key)
+        except StorageError as e:
+            error = e
+            continue
+        if data is not None:
+            return data
+    if error is not None:
+        raise error
+    return None
+
+
+async def delete_urls(urls: Iterable[str]) -> None:
+    """
+    Borra objetos por URL, agrupados por backend y en bloque (best-effort:
+    los errores se registran y no interrumpen la petición que borra).
+    """
+    groups: Dict[int, tuple] = {}
+    for url in dict.fromkeys(u for u in urls if u):
+        backend, key = owner_of(url)
+        if backend is None:
+            continue
+        groups.setdefault(id(backend), (backend, []))[1].append(key)
+    for backend, keys in groups.values():
+        try:
+            if len(keys) == 1:
+                await backend.delete(keys[0])
+            else:
+                await backend.delete_many(keys)
+        except (StorageError, httpx.HTTPError, OSError) as e:
+            print(f"[storage] No se pudieron borrar {len(keys)} objetos de {backend.name}: {e}")
+
+
+def delete_urls_blocking(urls: Iterable[str]) -> None:
+    """
+    Igual que delete_urls, para código síncrono: endpoints `def` (hilo del
+    threadpool de AnyIO -> se ejecuta en el event loop de la app) o scripts.
+    """
+    urls = [u for u in urls if u]
+    if not urls:
+        return
+    try:
+        anyio.from_thread.run(delete_urls, urls)
+    except RuntimeError:
+        # Fuera de un worker de AnyIO (scripts/cron): loop propio
+        asyncio.run(_delete_and_close(urls))
+
+
+async def _delete_and_close(urls: List[str]) -> None:
+    try:
+        await delete_urls(urls)
+    finally:
+        await close_storage()
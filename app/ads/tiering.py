@@ -0,0 +1,332 @@
+# app/ads/tiering.py
+#
+# Nivel frío para las imágenes de anuncios archivados o rechazados.
+#
+# Un anuncio que lleva IMAGE_COLD_AFTER_DAYS en 'archived' o 'rejected' se
+# "enfría": todos sus ficheros (principal + variantes) se empaquetan en un
+# único tar.gz por anuncio en IMAGE_COLD_DIR (otro disco, más lento/barato, o
+# un montaje de red) y se borran del almacenamiento caliente los que ya no
+# usa ningún anuncio caliente (con blobs por contenido un fichero puede ser
+# de varios anuncios: el paquete lleva copia, pero el caliente se queda
+# mientras alguno lo use). Ad.images_cold_at marca los anuncios enfriados y
+# ImageBlob.cold los blobs sin ficheros calientes (la deduplicación por hash
+# de la subida no los reutiliza a ciegas; si se vuelven a subir, se
+# reprocesan y los ficheros vuelven a escribirse).
+#
+# moderation_restore rehidrata el anuncio (rehydrate) antes de devolverlo a
+# 'pending': vuelve a escribir cada fichero en su backend y borra el paquete.
+# Cada pasada del job borra además los paquetes de anuncios que ya no existen.
+#
+# Variables de entorno:
+#   IMAGE_COLD_DIR        = carpeta de los paquetes (por defecto: ./var/cold)
+#   IMAGE_COLD_AFTER_DAYS = días en archived/rejected antes de enfriar (por defecto: 30)
+#   IMAGE_TIERING_HOURS   = horas entre pasadas del job (por defecto: 0 = desactivado;
+#                           activarlo en un solo proceso/servicio)
+#   IMAGE_TIERING_BATCH   = anuncios por pasada (por defecto: 200)
+import asyncio
+import io
+import json
+import os
+import tarfile
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+
+from app.database import SessionLocal
+from app.models import Ad, AdImage, AdImageRendition, ImageBlob
+from app.ads.renditions import FORMAT_MIME
+from app.ads.resize import drop_variants
+from app.ads.storage import PROJECT_ROOT, StorageError, owner_of
+from app.ads.worker import STATUS_READY
+
+COLD_DIR = Path(os.getenv("IMAGE_COLD_DIR") or PROJECT_ROOT / "var" / "cold")
+COLD_AFTER_DAYS = float(os.getenv("IMAGE_COLD_AFTER_DAYS", "30") or 30)
+TIERING_HOURS = float(os.getenv("IMAGE_TIERING_HOURS", "0") or 0)
+TIERING_BATCH = int(os.getenv("IMAGE_TIERING_BATCH", "200") or 200)
+
+COLD_STATUSES = ("archived", "rejected")
+MANIFEST = "manifest.json"
+MIME_BY_EXT = {".jpg": FORMAT_MIME["JPEG"], ".png": FORMAT_MIME["PNG"], ".webp": FORMAT_MIME["WEBP"],
+               ".avif": FORMAT_MIME["AVIF"]}
+
+_task: Optional["asyncio.Task"] = None
+
+
+def bundle_path(ad_id: int) -> Path:
+    return COLD_DIR / f"ad_{ad_id}.tar.gz"
+
+
+def _ext(url: str) -> str:
+    return os.path.splitext(url.split("?")[0])[1].lower()
+
+
+# ======================
+#   PAQUETES
+# ======================
+def _write_bundle(path: Path, items: List[Tuple[str, bytes]]) -> int:
+    """tar.gz con los ficheros y un manifest (miembro -> URL). Escritura atómica."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    manifest = []
+    with tarfile.open(tmp, "w:gz", compresslevel=6) as tar:
+        for i, (url, data) in enumerate(items):
+            name = f"{i:04d}{_ext(url)}"
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            manifest.append({"name": name, "url": url})
+        raw = json.dumps(manifest).encode("utf-8")
+        info = tarfile.TarInfo(MANIFEST)
+        info.size = len(raw)
+        tar.addfile(info, io.BytesIO(raw))
+    os.replace(tmp, path)
+    return path.stat().st_size
+
+
+def _read_bundle(path: Path) -> List[Tuple[str, bytes]]:
+    with tarfile.open(path, "r:gz") as tar:
+        manifest = json.load(tar.extractfile(MANIFEST))
+        return [(m["url"], tar.extractfile(m["name"]).read()) for m in manifest]
+
+
+def drop_bundle(ad_id: int) -> None:
+    bundle_path(ad_id).unlink(missing_ok=True)
+
+
+# ======================
+#   DB
+# ======================
+def candidates(db: Session, limit: int = TIERING_BATCH, days: Optional[float] = None) -> List[int]:
+    """Anuncios archivados/rechazados hace más de `days` con las imágenes aún en caliente."""
+    since = datetime.utcnow() - timedelta(days=COLD_AFTER_DAYS if days is None else days)
+    changed = func.coalesce(Ad.reviewed_at, Ad.updated_at, Ad.created_at)
+    rows = (
+        db.query(Ad.id)
+        .filter(Ad.status.in_(COLD_STATUSES), Ad.images_cold_at.is_(None), changed <= since)
+        .order_by(Ad.id)
+        .limit(limit)
+        .all()
+    )
+    return [i for (i,) in rows]
+
+
+def _ad_urls(ad_id: int) -> List[str]:
+    db = SessionLocal()
+    try:
+        images = (
+            db.query(AdImage)
+            .options(selectinload(AdImage.renditions))
+            .filter(AdImage.ad_id == ad_id, AdImage.status == STATUS_READY)
+            .all()
+        )
+        return list(dict.fromkeys(u for img in images for u in img.all_urls))
+    finally:
+        db.close()
+
+
+def _mark_cold(ad_id: int) -> bool:
+    """Conditional UPDATE: falla si entretanto se restauró o ya lo enfrió otro proceso."""
+    db = SessionLocal()
+    try:
+        n = db.query(Ad).filter(
+            Ad.id == ad_id, Ad.status.in_(COLD_STATUSES), Ad.images_cold_at.is_(None)
+        ).update({Ad.images_cold_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        return n == 1
+    finally:
+        db.close()
+
+
+def _release_hot(urls: List[str]) -> List[str]:
+    """
+    URLs que ya no usa ningún anuncio caliente (se pueden borrar del
+    almacenamiento caliente); sus blobs quedan marcados como fríos.
+    """
+    db = SessionLocal()
+    try:
+        hot = Ad.images_cold_at.is_(None)
+        used = {u for (u,) in db.query(AdImage.url).join(Ad, Ad.id == AdImage.ad_id)
+                .filter(hot, AdImage.url.in_(urls)).all()}
+        used.update(u for (u,) in db.query(AdImageRendition.url)
+                    .join(AdImage, AdImage.id == AdImageRendition.image_id)
+                    .join(Ad, Ad.id == AdImage.ad_id)
+                    .filter(hot, AdImageRendition.url.in_(urls)).all())
+        free = [u for u in urls if u not in used]
+        if free:
+            db.query(ImageBlob).filter(ImageBlob.url.in_(free)).update(
+                {ImageBlob.cold: True}, synchronize_session=False
+            )
+            db.commit()
+        return free
+    finally:
+        db.close()
+
+
+def _mark_hot(db: Session, urls: List[str]) -> None:
+    """Blobs de vuelta en caliente (en la sesión de quien llama, sin commit)."""
+    db.query(ImageBlob).filter(ImageBlob.url.in_(urls)).update(
+        {ImageBlob.cold: False}, synchronize_session=False
+    )
+
+
+# ======================
+#   ENFRIAR / REHIDRATAR
+# ======================
+async def _read(url: str) -> Optional[bytes]:
+    backend, key = owner_of(url)
+    if backend is None:
+        return None
+    return await backend.get(key)
+
+
+async def _delete_hot(urls: List[str]) -> None:
+    groups: Dict[int, tuple] = {}
+    for url in urls:
+        backend, key = owner_of(url)
+        if backend is not None:
+            groups.setdefault(id(backend), (backend, []))[1].append(key)
+    for backend, keys in groups.values():
+        await backend.delete_many(keys)
+        await drop_variants(keys)
+
+
+async def freeze_ad(ad_id: int) -> dict:
+    """Empaqueta las imágenes de un anuncio en el nivel frío y libera el caliente."""
+    urls = await run_in_threadpool(_ad_urls, ad_id)
+    datas = await asyncio.gather(*(_read(u) for u in urls))
+    items = [(u, d) for u, d in zip(urls, datas) if d is not None]
+    path = bundle_path(ad_id)
+    size = await anyio.to_thread.run_sync(_write_bundle, path, items) if items else 0
+    if not await run_in_threadpool(_mark_cold, ad_id):
+        await anyio.to_thread.run_sync(drop_bundle, ad_id)
+        return {"ad_id": ad_id, "skipped": True}
+    free = set(await run_in_threadpool(_release_hot, [u for u, _ in items]))
+    await _delete_hot(list(free))
+    return {
+        "ad_id": ad_id,
+        "files": len(items),
+        "missing": len(urls) - len(items),
+        "hot_bytes_freed": sum(len(d) for u, d in items if u in free),
+        "bundle_bytes": size,
+    }
+
+
+async def rehydrate(db: Session, ad: Ad) -> dict:
+    """
+    Devuelve al almacenamiento caliente los ficheros de un anuncio enfriado.
+    Deja los cambios en la sesión sin commit: quien llama hace commit y
+    después drop_bundle(ad.id). Lanza StorageError/httpx.HTTPError si el
+    backend falla (el anuncio sigue frío y se puede reintentar).
+    La DB y el disco se tocan en hilos: no bloquea el event loop.
+    """
+    if ad.images_cold_at is None:
+        return {"restored": 0, "missing": 0}
+    path = bundle_path(ad.id)
+    if not await anyio.to_thread.run_sync(path.exists):
+        print(f"[storage] No existe el paquete frío del anuncio {ad.id}: {path}")
+        items = []
+    else:
+        items = await anyio.to_thread.run_sync(_read_bundle, path)
+    urls = await run_in_threadpool(_ad_urls, ad.id)
+    restored = 0
+    for url, data in items:
+        backend, key = owner_of(url)
+        if backend is None:
+            continue
+        await backend.put(key, data, MIME_BY_EXT.get(_ext(url), "application/octet-stream"))
+        restored += 1
+    if items:
+        await run_in_threadpool(_mark_hot, db, [u for u, _ in items])
+    ad.images_cold_at = None
+    return {"restored": restored, "missing": len(set(urls) - {u for u, _ in items})}
+
+
+# ======================
+#   JOB
+# ======================
+def _stale_bundles() -> List[int]:
+    """Paquetes cuyo anuncio ya no existe o ya no está frío."""
+    if not COLD_DIR.is_dir():
+        return []
+    ids = []
+    for entry in os.scandir(COLD_DIR):
+        name = entry.name
+        if name.startswith("ad_") and name.endswith(".tar.gz") and name[3:-7].isdigit():
+            ids.append(int(name[3:-7]))
+    if not ids:
+        return []
+    db = SessionLocal()
+    try:
+        cold = {i for (i,) in db.query(Ad.id).filter(Ad.id.in_(ids), Ad.images_cold_at.isnot(None)).all()}
+    finally:
+        db.close()
+    return [i for i in ids if i not in cold]
+
+
+async def run_once(limit: int = TIERING_BATCH, days: Optional[float] = None) -> dict:
+    """Una pasada: enfría hasta `limit` anuncios y borra los paquetes sobrantes."""
+    def _candidates() -> List[int]:
+        db = SessionLocal()
+        try:
+            return candidates(db, limit, days)
+        finally:
+            db.close()
+
+    report = {"ads": 0, "files": 0, "hot_bytes_freed": 0, "bundle_bytes": 0, "errors": 0, "stale_bundles": 0}
+    for ad_id in await run_in_threadpool(_candidates):
+        try:
+            r = await freeze_ad(ad_id)
+        except (StorageError, httpx.HTTPError, OSError) as e:
+            report["errors"] += 1
+            print(f"[storage] No se pudo enfriar el anuncio {ad_id}: {e}")
+            continue
+        if r.get("skipped"):
+            continue
+        report["ads"] += 1
+        for k in ("files", "hot_bytes_freed", "bundle_bytes"):
+            report[k] += r[k]
+    for ad_id in await run_in_threadpool(_stale_bundles):
+        await anyio.to_thread.run_sync(drop_bundle, ad_id)
+        report["stale_bundles"] += 1
+    return report
+
+
+async def _run() -> None:
+    while True:
+        await asyncio.sleep(TIERING_HOURS * 3600)
+        try:
+            r = await run_once()
+            print(
+                f"[storage] Nivel frío: {r['ads']} anuncios, {r['files']} ficheros, "
+                f"{r['hot_bytes_freed']} bytes liberados en caliente, {r['errors']} errores"
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[storage] Error en el job de nivel frío: {e}")
+
+
+def start_tiering() -> None:
+    """Arranca el job periódico en el event loop actual (lifespan de la app)."""
+    global _task
+    if TIERING_HOURS <= 0 or _task is not None:
+        return
+    _task = asyncio.create_task(_run(), name="image-tiering")
+
+
+async def stop_tiering() -> None:
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,212 @@
+# app/ads/uploads.py
+#
+# Lectura en streaming de multipart/form-data para las subidas de anuncios.
+# A diferencia de UploadFile/File(...), no espera a que Starlette haya volcado
+# todo el cuerpo: cada parte se entrega en cuanto termina de llegar, y se
+# rechaza en cuanto se sabe que no es válida (Content-Length, tamaño de la
+# parte, tipo MIME o firma binaria), sin leer el resto de la petición.
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Firmas (magic bytes) de los formatos admitidos
+_MAGIC_BYTES_NEEDED = 12
+
+
+def sniff_image_mime(head: bytes) -> Optional[str]:
+    """MIME según la firma binaria de los primeros bytes (None si no es admitida)."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+@dataclass
+class Part:
+    name: str
+    filename: Optional[str] = None
+    content_type: str = ""
+    data: bytearray = field(default_factory=bytearray)
+
+    @property
+    def is_file(self) -> bool:
+        return self.filename is not None
+
+    @property
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+@dataclass
+class UploadLimits:
+    max_files: int
+    max_file_bytes: int
+    allowed_mime: set
+    file_fields: tuple = ("images",)
+    max_field_bytes: int = 64 * 1024
+    max_body_bytes: Optional[int] = None
+    too_many_detail: Optional[str] = None
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(400, f"Imagen demasiado grande (máximo {limit // (1024*1024)} MB).")
+
+
+class _Collector:
+    """Callbacks del parser: valida cada parte mientras llega y apila las terminadas."""
+
+    def __init__(self, limits: UploadLimits):
+        self.limits = limits
+        self.done: List[Part] = []
+        self.files = 0
+        self._part: Optional[Part] = None
+        self._headers: Dict[bytes, bytes] = {}
+        self._hname = b""
+        self._hvalue = b""
+        self._sniffed = False
+
+    # --- cabeceras de la parte ---
+    def on_part_begin(self):
+        self._headers = {}
+        self._part = None
+        self._sniffed = False
+
+    def on_header_field(self, data, start, end):
+        self._hname += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._hvalue += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._hname.strip().lower()] = self._hvalue.strip()
+        self._hname = b""
+        self._hvalue = b""
+
+    def on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = params.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = params.get(b"filename")
+        ctype = self._headers.get(b"content-type", b"").decode("latin-1").lower()
+        part = Part(name=name, content_type=ctype)
+
+        if filename is not None:
+            part.filename = filename.decode("utf-8", errors="replace")
+            if name not in self.limits.file_fields:
+                raise HTTPException(400, f"Campo de archivo inesperado: {name}")
+            self.files += 1
+            if self.files > self.limits.max_files:
+                raise HTTPException(400, self.limits.too_many_detail or f"Máximo {self.limits.max_files} imágenes")
+            if ctype not in self.limits.allowed_mime:
+                raise HTTPException(400, f"Tipo de archivo no permitido: {ctype or 'desconocido'}")
+        self._part = part
+
+    # --- cuerpo de la parte ---
+    def on_part_data(self, data, start, end):
+        part = self._part
+        part.data += data[start:end]
+        if part.is_file:
+            if len(part.data) > self.limits.max_file_bytes:
+                raise _too_large(self.limits.max_file_bytes)
+            if not self._sniffed and len(part.data) >= _MAGIC_BYTES_NEEDED:
+                self._check_magic(part)
+        elif len(part.data) > self.limits.max_field_bytes:
+            raise HTTPException(413, f"Campo demasiado grande: {part.name}")
+
+    def on_part_end(self):
+        part = self._part
+        if part is None:
+            return
+        if part.is_file:
+            if not part.data:
+                raise HTTPException(400, "Archivo vacío.")
+            if not self._sniffed:
+                self._check_magic(part)
+        self.done.append(part)
+        self._part = None
+
+    def _check_magic(self, part: Part):
+        self._sniffed = True
+        if sniff_image_mime(bytes(part.data[:_MAGIC_BYTES_NEEDED])) is None:
+            raise HTTPException(400, "El archivo no es una imagen válida.")
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+
+async def iter_multipart(request: Request, limits: UploadLimits) -> AsyncIterator[Part]:
+    """
+    Itera las partes de un multipart/form-data según van llegando.
+    Lanza HTTPException (400/413) en cuanto algo no cumple `limits`;
+    el resto del cuerpo no se llega a leer.
+    """
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    max_body = limits.max_body_bytes
+    declared = request.headers.get("content-length")
+    if max_body is not None and declared and declared.isdigit() and int(declared) > max_body:
+        raise HTTPException(413, "La petición es demasiado grande.")
+
+    if ctype == b"application/x-www-form-urlencoded":
+        # Sin archivos (p.ej. editar sólo el texto): cuerpo pequeño y acotado
+        async for part in _iter_urlencoded(request, limits):
+            yield part
+        return
+
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise HTTPException(400, "Se esperaba multipart/form-data.")
+
+    collector = _Collector(limits)
+    parser = MultipartParser(boundary, collector.callbacks())
+    received = 0
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        received += len(chunk)
+        if max_body is not None and received > max_body:
+            raise HTTPException(413, "La petición es demasiado grande.")
+        parser.write(chunk)
+        while collector.done:
+            yield collector.done.pop(0)
+    parser.finalize()
+    while collector.done:
+        yield collector.done.pop(0)
+
+
+async def _iter_urlencoded(request: Request, limits: UploadLimits) -> AsyncIterator[Part]:
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limits.max_field_bytes * 4:
+            raise HTTPException(413, "La petición es demasiado grande.")
+    for name, value in parse_qsl(body.decode("latin-1"), keep_blank_values=True):
+        yield Part(name=name, data=bytearray(value.encode("utf-8")))
+
+
+# Esquema para /docs: el cuerpo ya no se declara con Form()/File()
+def multipart_openapi(fields: Dict[str, str], file_field: str, required: tuple = ()) -> dict:
+    props = {name: {"type": typ} for name, typ in fields.items()}
+    props[file_field] = {"type": "array", "items": {"type": "string", "format": "binary"}}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "properties": props, "required": list(required)},
+                }
+            },
+        }
+    }
@@ -0,0 +1,213 @@
+# app/ads/worker.py
+#
+# Procesado diferido de imágenes. La subida sólo valida lo barato (tamaño,
+# MIME, firma binaria), deja los bytes originales en un área de staging y
+# crea el AdImage con status='queued'; la respuesta sale sin esperar a Pillow.
+# Este worker (una tarea asyncio por proceso de la app) recoge las imágenes
+# en cola y las valida/redimensiona/codifica/guarda con el pipeline de siempre:
+#   queued -> ready   (url, blob y variantes rellenos)
+#          -> failed  (imagen inválida o demasiados intentos; ver AdImage.error)
+#
+# Varios procesos (gunicorn) pueden compartir la cola: cada imagen se reclama
+# con un UPDATE condicional y un lease (claimed_at); si el proceso muere, el
+# lease caduca y otro la reintenta.
+#
+# Variables de entorno:
+#   IMAGE_DEFERRED      = 1 | 0   (por defecto: 1 = diferido: la API devuelve las imágenes
+#                                  con status 'queued' y url null hasta que el worker termina;
+#                                  el frontend las muestra como "Procesando…" y refresca.
+#                                  0 = procesar dentro de la petición, como antes)
+#   IMAGE_STAGING_DIR   = carpeta de staging (por defecto: ./var/staging)
+#   IMAGE_WORKER_POLL   = segundos entre sondeos de la cola (por defecto: 5)
+#   IMAGE_WORKER_LEASE  = segundos antes de reintentar una imagen reclamada (por defecto: 120)
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_
+
+from app.database import SessionLocal
+from app.models import AdImage
+from app.ads.executor import IMAGE_CONCURRENCY
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+IMAGE_DEFERRED = os.getenv("IMAGE_DEFERRED", "1").strip().lower() not in ("0", "false", "no", "off")
+STAGING_DIR = Path(os.getenv("IMAGE_STAGING_DIR") or PROJECT_ROOT / "var" / "staging")
+POLL_SECONDS = float(os.getenv("IMAGE_WORKER_POLL", "5") or 5)
+LEASE_SECONDS = float(os.getenv("IMAGE_WORKER_LEASE", "120") or 120)
+MAX_ATTEMPTS = 5
+# Ficheros de staging sin fila (p.ej. anuncio borrado con la imagen en cola)
+STAGING_SWEEP_SECONDS = 600
+
+STATUS_QUEUED = "queued"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+_task: Optional["asyncio.Task"] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+# ======================
+#   STAGING
+# ======================
+def stage_bytes(buf: bytes) -> str:
+    """Guarda la subida original (escritura atómica) y devuelve su nombre en staging."""
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.upload"
+    tmp = STAGING_DIR / f".{name}.tmp"
+    tmp.write_bytes(buf)
+    os.replace(tmp, STAGING_DIR / name)
+    return name
+
+
+def stage_file(path: Path) -> str:
+    """
+    Como stage_bytes, pero desde un fichero ya en disco (subida reanudable) y
+    sin cargarlo en memoria: enlace duro si es el mismo disco, copia si no.
+    El original se queda donde estaba.
+    """
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.upload"
+    tmp = STAGING_DIR / f".{name}.tmp"
+    try:
+        os.link(path, tmp)
+    except OSError:
+        shutil.copyfile(path, tmp)
+    os.replace(tmp, STAGING_DIR / name)
+    return name
+
+
+def read_staged(name: str) -> bytes:
+    return (STAGING_DIR / Path(name).name).read_bytes()
+
+
+def discard_staged(names: List[str]) -> None:
+    for name in names:
+        if not name:
+            continue
+        try:
+            (STAGING_DIR / Path(name).name).unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+def _sweep_staging() -> int:
+    """Borra ficheros de staging que ya no referencia ninguna imagen en cola."""
+    if not STAGING_DIR.is_dir():
+        return 0
+    cutoff = time.time() - max(LEASE_SECONDS, STAGING_SWEEP_SECONDS)
+    old = []
+    with os.scandir(STAGING_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                old.append(entry.name)
+    if not old:
+        return 0
+    db = SessionLocal()
+    try:
+        used = {
+            n for (n,) in db.query(AdImage.staged_path).filter(AdImage.staged_path.in_(old)).all()
+        }
+    finally:
+        db.close()
+    orphans = [n for n in old if n not in used]
+    discard_staged(orphans)
+    return len(orphans)
+
+
+# ======================
+#   COLA
+# ======================
+def _claim(limit: int) -> List[int]:
+    """Reclama hasta `limit` imágenes en cola (UPDATE condicional: a prueba de varios procesos)."""
+    now = datetime.utcnow()
+    expired = now - timedelta(seconds=LEASE_SECONDS)
+    free = (AdImage.status == STATUS_QUEUED) & or_(AdImage.claimed_at.is_(None), AdImage.claimed_at < expired)
+    claimable = free & (AdImage.attempts < MAX_ATTEMPTS)
+    db = SessionLocal()
+    try:
+        # Intentos agotados sin llegar a marcarla (el proceso murió procesándola):
+        # 'failed'; el barrido de staging borra luego su original
+        db.query(AdImage).filter(free, AdImage.attempts >= MAX_ATTEMPTS).update({
+            AdImage.status: STATUS_FAILED,
+            AdImage.error: "No se ha podido procesar la imagen.",
+            AdImage.staged_path: None,
+            AdImage.claimed_at: None,
+        }, synchronize_session=False)
+        candidates = [
+            i for (i,) in db.query(AdImage.id).filter(claimable).order_by(AdImage.id).limit(limit).all()
+        ]
+        claimed = []
+        for image_id in candidates:
+            n = db.query(AdImage).filter(AdImage.id == image_id, claimable).update(
+                {AdImage.claimed_at: now, AdImage.attempts: AdImage.attempts + 1},
+                synchronize_session=False,
+            )
+            if n:
+                claimed.append(image_id)
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def notify() -> None:
+    """Despierta al worker de este proceso (hay imágenes nuevas en cola)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _run() -> None:
+    # Import diferido: las rutas importan este módulo
+    from app.ads.routes import process_staged_image
+
+    last_sweep = 0.0
+    while True:
+        try:
+            ids = await run_in_threadpool(_claim, IMAGE_CONCURRENCY)
+            if ids:
+                await asyncio.gather(*(process_staged_image(i) for i in ids))
+                continue
+            if time.monotonic() - last_sweep > STAGING_SWEEP_SECONDS:
+                last_sweep = time.monotonic()
+                await run_in_threadpool(_sweep_staging)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[images] Error en el worker de imágenes: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_worker() -> None:
+    """
+    Arranca el worker en el event loop actual (lifespan de la app). También
+    sin IMAGE_DEFERRED: así se vacía lo que quedara en cola de cuando estaba activo.
+    """
+    global _task, _wakeup
+    if _task is not None:
+        return
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run(), name="image-worker")
+
+
+async def stop_worker() -> None:
+    global _task, _wakeup
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _wakeup = None
@@ -1,5 +1,6 @@
 # app/main.py
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import List, Dict, Any
 
@@ -36,11 +37,20 @@ try:
 except ImportError:
     from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware  # type: ignore
 
-from app.database import Base, engine
+from app.database import engine
+from app.migrations import AUTO_MIGRATE, migrate
 from app.auth.routes import router as auth_router
 from app.ads.routes import router as ads_router
 from app.admin.routes import router as admin_router
 from app.contact.routes import router as contact_router
+from app.ads.executor import memory_budget, shutdown_executor
+from app.ads.worker import start_worker, stop_worker
+from app.ads.reconcile import start_reconciler, stop_reconciler
+from app.ads.deleter import start_deleter, stop_deleter
+from app.ads.tiering import start_tiering, stop_tiering
+from app.ads.storage import IMAGES_DIR, close_storage, get_storage
+from app.ads.serve import ImageFiles
+from app.ads.resize import router as img_router
 
 # =========================================================
 #  Config y seguridad
@@ -101,14 +111,32 @@ CSP_VALUE = _build_csp()
 # =========================================================
 #  App y DB
 # =========================================================
-# 👇 Importa los modelos ANTES de create_all para que se registren las tablas
-from app import models as _models  # noqa: F401
-
-# Crea tablas si no existen (usa la DB que marque DATABASE_URL)
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Esquema versionado (app/migrations.py): al arrancar, no al importar, y
+    # antes de que las tareas de fondo toquen la DB que marque DATABASE_URL
+    if AUTO_MIGRATE:
+        migrate(engine)
+    # Worker de procesado diferido de imágenes (ver app/ads/worker.py)
+    start_worker()
+    # Reconciliación periódica DB <-> almacenamiento (ver app/ads/reconcile.py)
+    start_reconciler()
+    # Borrado de ficheros por lotes fuera de las peticiones (ver app/ads/deleter.py)
+    start_deleter()
+    # Nivel frío de imágenes de anuncios archivados/rechazados (ver app/ads/tiering.py)
+    start_tiering()
+    yield
+    await stop_tiering()
+    await stop_deleter()
+    await stop_reconciler()
+    await stop_worker()
+    # Cierre limpio del pool de procesado de imágenes y de los clientes HTTP
+    shutdown_executor()
+    await close_storage()
 
 app = FastAPI(
     title="DeOtraMano API",
+    lifespan=lifespan,
     docs_url="/docs" if ENV == "dev" else None,
     redoc_url="/redoc" if ENV == "dev" else None,
     openapi_url="/openapi.json" if ENV == "dev" else None,
@@ -164,6 +192,11 @@ async def security_headers(request: Request, call_next):
 # ---------- Static ----------
 STATIC_DIR = PROJECT_ROOT / "static"
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
+# Imágenes: caché inmutable, ETag fuerte, rangos y envío sin copia (app/ads/serve.py).
+# Debe ir antes del mount genérico de /static.
+app.mount("/static/images", ImageFiles(directory=str(IMAGES_DIR), check_dir=False), name="images")
+# Variantes redimensionadas a demanda: /img/{ancho}/{clave} (ver app/ads/resize.py)
+app.include_router(img_router)
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 # ---------- Routers (API) ----------
@@ -180,18 +213,12 @@ def health():
 @app.get("/healthz", include_in_schema=False)
 def healthz():
     smtp_ok = all([os.getenv("SMTP_HOST"), os.getenv("SMTP_FROM"), os.getenv("SMTP_USER"), os.getenv("SMTP_PASS")])
-    storage = "disk"
-    if os.getenv("CLOUDINARY_CLOUD_NAME") and os.getenv("CLOUDINARY_API_KEY") and os.getenv("CLOUDINARY_API_SECRET"):
-        storage = "cloudinary"
-    elif os.getenv("AWS_S3_BUCKET"):
-        storage = "s3"
-    elif os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"):
-        storage = "supabase"
     return {
         "ok": True,
         "env": os.getenv("ENV", "dev"),
         "smtp_configured": smtp_ok,
-        "storage": storage
+        "storage": get_storage().name,
+        "image_memory": memory_budget().stats(),
     }
 
 # ---------- SPA (Vite build) ----------
@@ -209,6 +236,7 @@ async def custom_404_handler(request: Request, exc):
         and not p.startswith("/docs")
         and not p.startswith("/openapi.json")
         and not p.startswith("/static")
+        and not p.startswith("/img/")
     ):
         return FileResponse(frontend_dist / "index.html")
     return await http_exception_handler(request, exc)
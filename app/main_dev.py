@@ -1,5 +1,6 @@
 # app/main_dev.py
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -11,16 +12,38 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.exception_handlers import http_exception_handler
 
-from app.database import Base, engine
+from app.database import engine
+from app.migrations import AUTO_MIGRATE, migrate
 from app.auth.routes import router as auth_router
 from app.ads.routes import router as ads_router
 from app.admin.routes import router as admin_router
+from app.ads.executor import shutdown_executor
+from app.ads.worker import start_worker, stop_worker
+from app.ads.reconcile import start_reconciler, stop_reconciler
+from app.ads.deleter import start_deleter, stop_deleter
+from app.ads.tiering import start_tiering, stop_tiering
+from app.ads.storage import IMAGES_DIR, close_storage
+from app.ads.serve import ImageFiles
+from app.ads.resize import router as img_router
 
-# Crear tablas si no existen (solo desarrollo)
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        migrate(engine)  # esquema versionado, antes de las tareas de fondo (app/migrations.py)
+    start_worker()  # procesado diferido de imágenes (app/ads/worker.py)
+    start_deleter()  # borrado de ficheros por lotes (app/ads/deleter.py)
+    start_reconciler()  # limpieza periódica de huérfanos (app/ads/reconcile.py)
+    start_tiering()  # nivel frío de anuncios archivados/rechazados (app/ads/tiering.py)
+    yield
+    await stop_tiering()
+    await stop_reconciler()
+    await stop_deleter()
+    await stop_worker()
+    shutdown_executor()  # cierra el pool de procesado de imágenes
+    await close_storage()  # y los clientes HTTP del almacenamiento
 
 # ESTA es la variable que uvicorn busca 👇
-app = FastAPI(title="DeOtraMano API (Dev)")
+app = FastAPI(title="DeOtraMano API (Dev)", lifespan=lifespan)
 
 # === CORS ===
 ALLOWED_ORIGINS = [
@@ -39,6 +62,11 @@ app.add_middleware(
 PROJECT_ROOT = Path(__file__).resolve().parents[1]   # .../deotramano_fastapi
 STATIC_DIR = PROJECT_ROOT / "static"
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
+# Imágenes: caché inmutable, ETag fuerte, rangos y envío sin copia (app/ads/serve.py).
+# Debe ir antes del mount genérico de /static.
+app.mount("/static/images", ImageFiles(directory=str(IMAGES_DIR), check_dir=False), name="images")
+# Variantes redimensionadas a demanda: /img/{ancho}/{clave} (ver app/ads/resize.py)
+app.include_router(img_router)
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 # === Routers ===
@@ -61,6 +89,7 @@ async def custom_404_handler(request: Request, exc):
         and not p.startswith("/docs")
         and not p.startswith("/openapi.json")
         and not p.startswith("/static")
+        and not p.startswith("/img/")
     ):
         return FileResponse(frontend_dist / "index.html")
     return await http_exception_handler(request, exc)
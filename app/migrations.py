@@ -0,0 +1,240 @@
+# app/migrations.py
+#
+# Migraciones versionadas del esquema (SQLite y Postgres). Sustituye al
+# Base.metadata.create_all que hacían las apps al importarse: create_all sólo
+# crea las tablas que faltan, nunca añade columnas ni índices a las que ya
+# existen, así que las DBs antiguas se quedaban sin lo añadido después.
+#
+# Cada migración tiene un número creciente y una función (conn) -> None; las
+# aplicadas se apuntan en la tabla schema_migrations. Los pasos usan helpers
+# idempotentes (_create_tables, _add_columns, _create_indexes, _drop_index) que miran
+# el esquema real antes de tocarlo, así la misma lista sirve para:
+#   - una DB nueva (la 1 crea todo con el modelo actual; el resto no hace nada)
+#   - una DB creada por los create_all de antes (sin ninguna versión apuntada)
+# Las columnas se añaden con la definición del modelo (tipo, NOT NULL y
+# server_default), sin FK: SQLite no puede añadirlas con ALTER TABLE.
+#
+# Cada migración va en su propia transacción. En Postgres (DDL transaccional)
+# se toma además un advisory lock: si varios workers de gunicorn arrancan a la
+# vez, sólo uno migra y el resto espera y la encuentra aplicada.
+#
+# Para añadir una: función nueva al final de MIGRATIONS con el número
+# siguiente, en el mismo cambio que toca el modelo. Nunca cambiar una que ya
+# se haya desplegado.
+#
+# Desde consola: python scripts/migrate.py [--status]
+# Comprobar que las consultas calientes usan sus índices: python scripts/check_indexes.py
+#
+# Variables de entorno:
+#   DB_AUTO_MIGRATE = 1 | 0   (por defecto: 1; 0 = las apps no migran al arrancar,
+#                              p.ej. si el despliegue ya lanza scripts/migrate.py)
+# Las apps migran en el arranque del lifespan, nunca al importarse: importar
+# app.main (tests, scripts, herramientas) no crea ni toca ninguna DB.
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Sequence
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from app.database import Base
+from app import models as _models  # noqa: F401  (registra las tablas en Base.metadata)
+
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Clave del advisory lock de Postgres (cualquier entero fijo)
+PG_LOCK_KEY = 7_245_011_725
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+# ======================
+#   HELPERS (idempotentes)
+# ======================
+def _columns(conn: Connection, table: str) -> set:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def _indexes(conn: Connection, table: str) -> set:
+    return {i["name"] for i in inspect(conn).get_indexes(table)}
+
+
+def _create_tables(conn: Connection, names: Sequence[str]) -> None:
+    """Crea (con sus índices) las tablas del modelo que falten."""
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables[n] for n in names])
+
+
+def _add_columns(conn: Connection, table: str, names: Sequence[str]) -> None:
+    """Añade las columnas del modelo que falten en la tabla."""
+    existing = _columns(conn, table)
+    ddl = conn.dialect.ddl_compiler(conn.dialect, None)
+    quoted = conn.dialect.identifier_preparer.quote(table)
+    for name in names:
+        if name in existing:
+            continue
+        spec = ddl.get_column_specification(Base.metadata.tables[table].c[name])
+        conn.execute(text(f"ALTER TABLE {quoted} ADD COLUMN {spec}"))
+
+
+def _create_indexes(conn: Connection, table: str, names: Sequence[str]) -> None:
+    """Crea los índices del modelo (por nombre) que falten."""
+    existing = _indexes(conn, table)
+    wanted = {i.name: i for i in Base.metadata.tables[table].indexes}
+    for name in names:
+        if name not in existing:
+            wanted[name].create(conn)
+
+
+def _drop_index(conn: Connection, table: str, name: str) -> None:
+    if name in _indexes(conn, table):
+        conn.execute(text(f"DROP INDEX {conn.dialect.identifier_preparer.quote(name)}"))
+
+
+# ======================
+#   MIGRACIONES
+# ======================
+def _m1_initial(conn: Connection) -> None:
+    # Tablas que falten (todas en una DB nueva), con sus índices
+    Base.metadata.create_all(conn)
+
+
+def _m2_renditions(conn: Connection) -> None:
+    _create_tables(conn, ("ad_image_renditions",))
+    _add_columns(conn, "ad_images", ("renditions_version",))
+
+
+def _m3_blobs(conn: Connection) -> None:
+    _create_tables(conn, ("image_blobs",))
+    _add_columns(conn, "ad_images", ("blob_id",))
+    _create_indexes(conn, "ad_images", ("ix_ad_images_blob_id",))
+
+
+def _m4_deferred(conn: Connection) -> None:
+    _add_columns(conn, "ad_images", ("status", "staged_path", "error", "attempts", "claimed_at"))
+    _create_indexes(conn, "ad_images", ("ix_ad_images_status",))
+
+
+def _m5_phash(conn: Connection) -> None:
+    _add_columns(conn, "ad_images", ("phash",))
+
+
+def _m6_pending_deletions(conn: Connection) -> None:
+    _create_tables(conn, ("pending_deletions",))
+
+
+def _m7_encoder(conn: Connection) -> None:
+    _add_columns(conn, "image_blobs", ("bytes", "source_bytes", "format", "quality"))
+
+
+def _m8_placeholder(conn: Connection) -> None:
+    _add_columns(conn, "ad_images", ("placeholder",))
+
+
+def _m9_image_metadata(conn: Connection) -> None:
+    _add_columns(conn, "ad_images", ("width", "height", "bytes", "format", "sha256", "created_at"))
+    _create_indexes(conn, "ad_images", ("ix_ad_images_sha256",))
+
+
+def _m10_cold_tier(conn: Connection) -> None:
+    _add_columns(conn, "ads", ("images_cold_at",))
+    _add_columns(conn, "image_blobs", ("cold",))
+
+
+def _m11_upload_sessions(conn: Connection) -> None:
+    _create_tables(conn, ("upload_sessions",))
+
+
+def _m12_direct_uploads(conn: Connection) -> None:
+    _add_columns(conn, "upload_sessions", ("storage_key",))
+
+
+def _m13_hot_indexes(conn: Connection) -> None:
+    # Listados y borrados filtran por ad_id; url nunca se busca por igualdad
+    _create_indexes(conn, "ad_images", ("ix_ad_images_ad_id",))
+    _drop_index(conn, "ad_images", "ix_ad_images_url")
+    # Cola de moderación y anuncios de un usuario
+    _create_indexes(conn, "ads", ("ix_ads_status_created_at", "ix_ads_user_id_id"))
+
+
+def _m14_chunk_lease(conn: Connection) -> None:
+    _add_columns(conn, "upload_sessions", ("receiving_at",))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "esquema inicial", _m1_initial),
+    Migration(2, "variantes responsive", _m2_renditions),
+    Migration(3, "almacenamiento deduplicado", _m3_blobs),
+    Migration(4, "procesado diferido", _m4_deferred),
+    Migration(5, "hash perceptual", _m5_phash),
+    Migration(6, "borrado diferido", _m6_pending_deletions),
+    Migration(7, "codificador adaptativo", _m7_encoder),
+    Migration(8, "placeholders LQIP", _m8_placeholder),
+    Migration(9, "metadatos de imagen", _m9_image_metadata),
+    Migration(10, "nivel frío", _m10_cold_tier),
+    Migration(11, "subidas reanudables", _m11_upload_sessions),
+    Migration(12, "subidas directas al almacenamiento", _m12_direct_uploads),
+    Migration(13, "índices de las consultas calientes", _m13_hot_indexes),
+    Migration(14, "lease de escritura de trozos", _m14_chunk_lease),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# ======================
+#   EJECUCIÓN
+# ======================
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table(schema_migrations.name):
+        return 0
+    return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def pending(engine: Engine) -> List[Migration]:
+    with engine.connect() as conn:
+        version = current_version(conn)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def _lock(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PG_LOCK_KEY})
+
+
+def migrate(engine: Engine) -> List[int]:
+    """Aplica las migraciones pendientes, en orden. Devuelve las versiones aplicadas."""
+    applied = []
+    for m in MIGRATIONS:
+        try:
+            with engine.begin() as conn:
+                _lock(conn)
+                schema_migrations.create(conn, checkfirst=True)
+                if m.version <= current_version(conn):
+                    continue
+                m.apply(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=m.version, name=m.name, applied_at=datetime.utcnow(),
+                ))
+        except IntegrityError:
+            # SQLite: otro proceso la ha apuntado a la vez (los pasos son idempotentes)
+            with engine.connect() as conn:
+                if current_version(conn) < m.version:
+                    raise
+            continue
+        applied.append(m.version)
+        print(f"[db] Migración {m.version} aplicada: {m.name}")
+    return applied
@@ -2,7 +2,7 @@
 from datetime import datetime
 
 from sqlalchemy import (
-    Column, Integer, String, Boolean, ForeignKey, DateTime, Text
+    Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Index, false
 )
 from sqlalchemy.orm import relationship
 
@@ -50,6 +50,12 @@ class User(Base):
 
 class Ad(Base):
     __tablename__ = "ads"
+    __table_args__ = (
+        # Cola de moderación: WHERE status = ? ORDER BY created_at DESC
+        Index("ix_ads_status_created_at", "status", "created_at"),
+        # Anuncios de un usuario: WHERE user_id = ? ORDER BY id DESC
+        Index("ix_ads_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True, nullable=False)
@@ -68,6 +74,8 @@ class Ad(Base):
     reviewed_at = Column(DateTime, nullable=True)
     reviewed_by_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     reject_reason = Column(Text, nullable=True)
+    # Imágenes movidas al nivel frío (anuncio archivado/rechazado, ver app/ads/tiering.py)
+    images_cold_at = Column(DateTime, nullable=True)
 
     # ---- Relaciones ----
     user = relationship(
@@ -93,10 +101,141 @@ class AdImage(Base):
     __tablename__ = "ad_images"
 
     id = Column(Integer, primary_key=True, index=True)
-    url = Column(String, index=True, nullable=False)
-    ad_id = Column(Integer, ForeignKey("ads.id"), nullable=False)
+    url = Column(String, nullable=False)
+    ad_id = Column(Integer, ForeignKey("ads.id"), nullable=False, index=True)
+
+    # Blob deduplicado al que apunta (NULL en imágenes anteriores a la dedup)
+    blob_id = Column(Integer, ForeignKey("image_blobs.id", ondelete="SET NULL"), nullable=True, index=True)
+
+    # Versión de la especificación de variantes con la que se generaron
+    # (ver app/ads/renditions.py). NULL = sin variantes.
+    renditions_version = Column(Integer, nullable=True)
+
+    # Hash perceptual (dHash, 16 hex) para detectar casi-duplicados (app/ads/phash.py)
+    phash = Column(String(16), nullable=True)
+
+    # Placeholder LQIP (data URI de una miniatura de 16 px) que va en los listados
+    placeholder = Column(Text, nullable=True)
+
+    # Metadatos de la imagen principal guardada (se rellenan al ingerir; las
+    # filas antiguas con scripts/backfill_image_metadata.py). NULL en cola.
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    bytes = Column(Integer, nullable=True)
+    format = Column(String(8), nullable=True)  # 'JPEG' | 'PNG' | 'WEBP'
+    sha256 = Column(String(64), nullable=True, index=True)  # hash de los bytes guardados
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+
+    # Procesado diferido (ver app/ads/worker.py): 'queued' -> 'ready' | 'failed'.
+    # Mientras está en cola url = "" y la subida original espera en staging.
+    status = Column(String(16), nullable=False, default="ready", server_default="ready", index=True)
+    staged_path = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    claimed_at = Column(DateTime, nullable=True)  # lease del worker que la procesa
 
     ad = relationship("Ad", back_populates="images")
+    blob = relationship("ImageBlob")
+
+    renditions = relationship(
+        "AdImageRendition",
+        back_populates="image",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="AdImageRendition.width",
+    )
+
+    @property
+    def all_urls(self):
+        """URL principal + URLs de sus variantes (sin duplicados)."""
+        urls = [self.url] if self.url else []
+        for r in (self.renditions or []):
+            if r.url not in urls:
+                urls.append(r.url)
+        return urls
+
+
+class ImageBlob(Base):
+    """
+    Fichero de imagen procesado, direccionado por contenido (SHA-256 de los
+    bytes guardados). Lo comparten todos los AdImage con la misma imagen;
+    sus ficheros se borran cuando refcount llega a 0.
+    """
+    __tablename__ = "image_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), unique=True, index=True, nullable=False)
+    # Hash de la subida original: si se repite, no hace falta ni procesarla
+    raw_sha256 = Column(String(64), index=True, nullable=True)
+    url = Column(String, nullable=False)
+    refcount = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Resultado del codificador (app/ads/encoder.py): bytes guardados frente a
+    # los de la subida original, para medir el ahorro. NULL en blobs anteriores.
+    bytes = Column(Integer, nullable=True)
+    source_bytes = Column(Integer, nullable=True)
+    format = Column(String(8), nullable=True)
+    quality = Column(Integer, nullable=True)  # NULL = sin pérdida o guardada tal cual
+    # Sin ficheros en el almacenamiento caliente: sólo los usan anuncios en el
+    # nivel frío (app/ads/tiering.py)
+    cold = Column(Boolean, default=False, nullable=False, server_default=false())
+
+
+class AdImageRendition(Base):
+    """Variante responsive (ancho + formato) de una imagen de anuncio."""
+    __tablename__ = "ad_image_renditions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("ad_images.id", ondelete="CASCADE"), nullable=False, index=True)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    format = Column(String, nullable=False)  # 'WEBP' | 'AVIF' | 'JPEG' | 'PNG'
+    url = Column(String, nullable=False)
+
+    image = relationship("AdImage", back_populates="renditions")
+
+
+class PendingDeletion(Base):
+    """
+    Fichero del almacenamiento pendiente de borrar. Se inserta en la misma
+    transacción que borra las filas que lo usaban y lo vacía en segundo plano
+    el borrador por lotes (app/ads/deleter.py).
+    """
+    __tablename__ = "pending_deletions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    url = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    claimed_at = Column(DateTime, nullable=True)  # lease del proceso que lo está borrando
+    error = Column(String, nullable=True)
+
+
+class UploadSession(Base):
+    """
+    Subida reanudable de una imagen (app/ads/resumable.py): el cliente la envía
+    por trozos y, una vez completa, la asocia a un anuncio con su id. La fila
+    se borra en la misma transacción que crea el AdImage.
+    """
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex, lo conoce sólo el cliente
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    filename = Column(String(255), nullable=True)
+    mime = Column(String(32), nullable=False)
+    size = Column(Integer, nullable=False)  # tamaño total declarado al crearla
+    offset = Column(Integer, nullable=False, default=0, server_default="0")  # bytes recibidos
+    status = Column(String(16), nullable=False, default="open", server_default="open")  # 'open' | 'complete'
+    sha256 = Column(String(64), nullable=True)  # de los bytes completos, al finalizar
+    # Subida directa al almacenamiento con URL prefirmada: clave del objeto
+    # entrante. NULL = por trozos a la app (o ya traída al finalizar).
+    storage_key = Column(String, nullable=True)
+    # Lease de la petición que está escribiendo un trozo (a prueba de varios
+    # procesos; ver resumable.claim_chunk). NULL = nadie escribiendo.
+    receiving_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
 
 class PasswordHistory(Base):
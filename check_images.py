@@ -1,23 +1,62 @@
 #!/usr/bin/env python3
 # check_images.py
 #
-# Recorre una carpeta (por defecto: static/images) y muestra:
-# - Tamaño WxH
-# - Tamaño de archivo
-# - Lado mayor
-# - Estado (OK / > 2048px / error)
+# Recorre una carpeta (por defecto: static/images, incluidas subcarpetas) y
+# audita cada imagen leyendo SOLO la cabecera, en paralelo (os.scandir +
+# pool de procesos):
+# - Tamaño WxH, formato y tamaño de archivo
+# - Estado: OK / > 2048px / con metadatos (EXIF, XMP, comentarios...) / error
+#
+# Salida en tabla (por defecto), JSON o CSV. Con --fix re-codifica en paralelo
+# las imágenes demasiado grandes o con metadatos usando el mismo pipeline que
+# las subidas (app/ads/images.py); las que no se pueden abrir no se tocan.
+# - Si alguna fila de la DB usa el fichero (imagen, variante o blob), el
+#   resultado se guarda como las subidas nuevas, con nombre por contenido
+#   (<sha256>.ext), y en una sola transacción se cambian las URLs de
+#   AdImage, AdImageRendition e ImageBlob y el fichero viejo entra en la cola
+#   del borrador (app/ads/deleter.py). Los nombres inmutables se sirven con
+#   caché de un año (app/ads/serve.py): reescribirlos en sitio no llegaría a
+#   navegadores ni CDN.
+# - Si nadie lo usa y el nombre no es inmutable, se reemplaza en sitio de
+#   forma atómica. Con nombre inmutable y sin referencias es una huérfana o
+#   un borrado pendiente: se informa y se deja a scripts/reconcile_storage.py.
+#
+# Uso:
+#   python check_images.py                              # tabla
+#   python check_images.py --format json --out audit.json
+#   python check_images.py --format csv --only-problems > problemas.csv
+#   python check_images.py --fix --workers 8
 #
 # Requiere: Pillow
 
 from pathlib import Path
 from PIL import Image, UnidentifiedImageError
 import argparse
+import csv
+import json
+import multiprocessing
 import os
 import sys
-from typing import Tuple
+import uuid
+from typing import Iterator, List
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." (pipeline de --fix)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import SessionLocal
+from app.models import AdImage, AdImageRendition, ImageBlob
+from app.ads.blobs import find_by_hash, referenced_urls
+from app.ads.deleter import enqueue_deletions
+from app.ads.images import PRIVATE_INFO_KEYS, TARGET_MAX_SIDE, ImageError, process_image
+from app.ads.renditions import FORMAT_EXT
+from app.ads.serve import is_immutable
+from app.ads.storage import disk_storage, shard_key
 
-TARGET_MAX_SIDE = 2048
 VALID_EXT = (".jpg", ".jpeg", ".png", ".webp")
+FIELDS = ("file", "format", "width", "height", "max_side", "bytes", "state", "error", "fixed_bytes", "fixed_file")
 
 def human_size(n: int) -> str:
     for unit in ["B", "KB", "MB", "GB"]:
@@ -26,13 +65,206 @@ def human_size(n: int) -> str:
         n /= 1024
     return f"{n:.1f} TB"
 
-def get_dims(p: Path) -> Tuple[int, int]:
-    with Image.open(p) as im:
-        return im.size  # (w, h)
+def iter_images(base: str) -> Iterator[str]:
+    """os.scandir recursivo: no crea objetos Path ni hace stat de más."""
+    stack = [base]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue  # temporales de escrituras atómicas
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in VALID_EXT:
+                    yield entry.path
+
+def inspect(path: str) -> dict:
+    """Se ejecuta en el pool: lee sólo la cabecera (Image.open no decodifica píxeles)."""
+    row = {"file": path, "format": None, "width": None, "height": None, "max_side": None,
+           "bytes": None, "state": "OK", "error": None, "fixed_bytes": None, "fixed_file": None}
+    try:
+        row["bytes"] = os.stat(path).st_size
+        with Image.open(path) as im:
+            w, h = im.size
+            row.update(format=im.format, width=w, height=h, max_side=max(w, h))
+            meta = [k for k in PRIVATE_INFO_KEYS if k in im.info]
+        issues = []
+        if max(w, h) > TARGET_MAX_SIDE:
+            issues.append(f"> {TARGET_MAX_SIDE}")
+        if meta:
+            issues.append("metadatos: " + ",".join(meta))
+        if issues:
+            row["state"] = " | ".join(issues)
+    except UnidentifiedImageError:
+        row.update(state="ERROR", error="no es imagen válida")
+    except Exception as e:
+        row.update(state="ERROR", error=str(e))
+    return row
+
+def file_urls(path: str) -> List[str]:
+    """URLs con las que la DB puede apuntar al fichero (ninguna si está fuera de static/images)."""
+    disk = disk_storage()
+    try:
+        key = Path(path).resolve().relative_to(disk.root.resolve()).as_posix()
+    except ValueError:
+        return []
+    urls = [disk.url(key)]
+    name = key.rsplit("/", 1)[-1]
+    if key != name and key == shard_key(name):
+        urls.append(disk.url(name))  # fila anterior a shard_images.py: URL plana
+    return urls
+
+def attach_refs(rows: List[dict]) -> None:
+    """En el proceso principal: anota en cada fila las URLs del fichero que usa la DB."""
+    db = SessionLocal()
+    try:
+        for row in rows:
+            row["refs"] = sorted(referenced_urls(db, file_urls(row["file"])))
+    finally:
+        db.close()
+
+def write_atomic(path: str, data: bytes) -> None:
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def fix(row: dict) -> dict:
+    """Se ejecuta en el pool: re-codifica con el pipeline de subidas y escribe el resultado."""
+    path = row["file"]
+    refs = row.get("refs") or []
+    if not refs and is_immutable(path):
+        row.update(error="--fix: sin referencias en la DB (huérfana o borrado pendiente), "
+                         "ver scripts/reconcile_storage.py")
+        return row
+    try:
+        with open(path, "rb") as f:
+            buf = f.read()
+        processed = process_image(buf, with_renditions=False, keep_format=True)
+        if processed.passthrough:
+            return row  # el pipeline la acepta tal cual
+        if refs:
+            # Como una subida nueva: nombre por contenido; la DB se actualiza en repoint()
+            disk = disk_storage()
+            key = disk.object_key(f"{processed.sha256}{FORMAT_EXT[processed.format.upper()]}")
+            row.update(fixed_file=key, created=disk._write(key, processed.data),
+                       sha256=processed.sha256, fixed_format=processed.format, quality=processed.quality)
+        else:
+            write_atomic(path, processed.data)
+        row.update(
+            state="ARREGLADA", fixed_bytes=len(processed.data), width=processed.width,
+            height=processed.height, max_side=max(processed.width, processed.height),
+        )
+    except (ImageError, OSError) as e:
+        row.update(state="ERROR", error=f"--fix: {e}")
+    return row
+
+def repoint(row: dict) -> None:
+    """
+    En el proceso principal, una transacción por fichero: imágenes, variantes y
+    blob pasan al nombre nuevo y el fichero viejo entra en la cola de borrado.
+    Si falla, la DB queda como estaba y se borra el fichero recién escrito.
+    """
+    disk = disk_storage()
+    new_url = disk.url(row["fixed_file"])
+    db = SessionLocal()
+    try:
+        twin = find_by_hash(db, row["sha256"])
+        if twin is not None and twin.url not in row["refs"]:
+            new_url = twin.url  # ese contenido ya estaba guardado: se reutiliza
+        refs = row["refs"]
+        db.query(AdImage).filter(AdImage.url.in_(refs)).update({
+            AdImage.url: new_url, AdImage.width: row["width"], AdImage.height: row["height"],
+            AdImage.bytes: row["fixed_bytes"], AdImage.format: row["fixed_format"],
+            AdImage.sha256: row["sha256"],
+        }, synchronize_session=False)
+        db.query(AdImageRendition).filter(AdImageRendition.url.in_(refs)).update({
+            AdImageRendition.url: new_url, AdImageRendition.width: row["width"],
+            AdImageRendition.height: row["height"], AdImageRendition.format: row["fixed_format"],
+        }, synchronize_session=False)
+        for blob in db.query(ImageBlob).filter(ImageBlob.url.in_(refs)).all():
+            if twin is not None and twin.id != blob.id:
+                # Dos blobs con el mismo contenido: las imágenes pasan al que ya existía
+                db.query(AdImage).filter(AdImage.blob_id == blob.id).update(
+                    {AdImage.blob_id: twin.id}, synchronize_session=False
+                )
+                db.query(ImageBlob).filter(ImageBlob.id == twin.id).update(
+                    {ImageBlob.refcount: ImageBlob.refcount + blob.refcount}, synchronize_session=False
+                )
+                db.delete(blob)
+            else:
+                blob.url, blob.sha256, blob.bytes = new_url, row["sha256"], row["fixed_bytes"]
+                blob.format, blob.quality = row["fixed_format"], row["quality"]
+        enqueue_deletions(db, file_urls(row["file"])[:1])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if row.get("created"):
+            disk._unlink([row["fixed_file"]])
+        row.update(state="ERROR", error=f"--fix: no se pudo actualizar la DB: {e}", fixed_file=None)
+        return
+    finally:
+        db.close()
+    if new_url != disk.url(row["fixed_file"]):
+        if row.get("created"):
+            disk._unlink([row["fixed_file"]])
+        row["fixed_file"] = disk.key_for(new_url) or new_url
+
+def is_problem(row: dict) -> bool:
+    return row["state"] != "OK"
+
+def fixable(row: dict) -> bool:
+    return row["state"] not in ("OK", "ERROR")
+
+class Report:
+    """Escribe cada fila según llega (tabla/CSV) o al final (JSON)."""
+
+    def __init__(self, fmt: str, out, base: str):
+        self.fmt, self.out, self.base = fmt, out, base
+        self.rows = []
+        if fmt == "csv":
+            self.writer = csv.DictWriter(out, fieldnames=FIELDS)
+            self.writer.writeheader()
+        elif fmt == "table":
+            print(f"Escaneando: {Path(base).resolve()}", file=out)
+            print("-" * 100, file=out)
+            print(f"{'Archivo':40} {'WxH':>14} {'LadoMax':>8} {'Tamaño':>10}  Estado", file=out)
+            print("-" * 100, file=out)
+
+    def add(self, row: dict) -> None:
+        row = {k: row.get(k) for k in FIELDS}
+        row["file"] = os.path.relpath(row["file"], self.base)
+        if self.fmt == "csv":
+            self.writer.writerow(row)
+        elif self.fmt == "json":
+            self.rows.append(row)
+        else:
+            size = human_size(row["bytes"]) if row["bytes"] is not None else "-"
+            dims = f"{row['width']}x{row['height']}" if row["width"] else "-"
+            state = row["state"] + (f": {row['error']}" if row["error"] else "")
+            if row["fixed_bytes"] is not None:
+                state += f" ({human_size(row['fixed_bytes'])})"
+            if row["fixed_file"]:
+                state += f" -> {row['fixed_file']}"
+            print(f"{row['file']:40.40s} {dims:>14} {row['max_side'] or '-':>8} {size:>10}  {state}", file=self.out)
+
+    def close(self, summary: dict) -> None:
+        if self.fmt == "json":
+            json.dump({"dir": str(Path(self.base).resolve()), "summary": summary, "items": self.rows},
+                      self.out, indent=1, ensure_ascii=False)
+            self.out.write("\n")
+        elif self.fmt == "table":
+            print("-" * 100, file=self.out)
+            print(
+                f"Resumen -> OK: {summary['ok']} | > {TARGET_MAX_SIDE}px: {summary['oversize']} | "
+                f"Con metadatos: {summary['metadata']} | Errores: {summary['errors']} | "
+                f"Arregladas: {summary['fixed']} | Total: {summary['total']}",
+                file=self.out,
+            )
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Audita imágenes y marca las que superan 2048 px en el lado mayor."
+        description="Audita imágenes (> 2048 px en el lado mayor, metadatos) y opcionalmente las arregla."
     )
     parser.add_argument(
         "--dir",
@@ -42,52 +274,63 @@ def main():
     parser.add_argument(
         "--strict",
         action="store_true",
-        help="Devuelve código de salida 1 si hay alguna imagen > 2048 px."
+        help="Devuelve código de salida 1 si queda alguna imagen con problemas."
     )
+    parser.add_argument("--format", choices=("table", "json", "csv"), default="table", help="Formato de salida")
+    parser.add_argument("--out", help="Fichero de salida (por defecto: stdout)")
+    parser.add_argument("--only-problems", action="store_true", help="Sólo lista las imágenes con problemas")
+    parser.add_argument("--fix", action="store_true", help="Re-codifica las imágenes grandes o con metadatos")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
     args = parser.parse_args()
 
-    base = Path(args.dir)
-    if not base.is_dir():
+    base = args.dir
+    if not os.path.isdir(base):
         print(f"✗ La carpeta no existe: {base}", file=sys.stderr)
         sys.exit(2)
 
-    files = [p for p in base.iterdir() if p.is_file() and p.suffix.lower() in VALID_EXT]
-    if not files:
-        print(f"(Sin imágenes con extensión {VALID_EXT} en {base})")
-        sys.exit(0)
-
-    over = 0
-    ok = 0
-    err = 0
-
-    # Encabezado
-    print(f"Escaneando: {base.resolve()}")
-    print("-" * 88)
-    print(f"{'Archivo':40} {'WxH':>14} {'LadoMax':>8} {'Tamaño':>10}  Estado")
-    print("-" * 88)
-
-    for f in sorted(files, key=lambda x: x.name.lower()):
-        try:
-            size_bytes = f.stat().st_size
-            w, h = get_dims(f)
-            max_side = max(w, h)
-            state = "OK" if max_side <= TARGET_MAX_SIDE else f"> {TARGET_MAX_SIDE}"
-            if max_side <= TARGET_MAX_SIDE:
-                ok += 1
-            else:
-                over += 1
-            print(f"{f.name:40.40s} {f'{w}x{h}':>14} {max_side:>8} {human_size(size_bytes):>10}  {state}")
-        except UnidentifiedImageError:
-            err += 1
-            print(f"{f.name:40.40s} {'-':>14} {'-':>8} {human_size(f.stat().st_size):>10}  ERROR: no es imagen válida")
-        except Exception as e:
-            err += 1
-            print(f"{f.name:40.40s} {'-':>14} {'-':>8} {human_size(f.stat().st_size):>10}  ERROR: {e}")
-
-    print("-" * 88)
-    print(f"Resumen -> OK: {ok} | > {TARGET_MAX_SIDE}px: {over} | Errores: {err} | Total: {ok+over+err}")
-
-    if args.strict and over > 0:
+    out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    report = Report(args.format, out, base)
+    summary = {"total": 0, "ok": 0, "oversize": 0, "metadata": 0, "errors": 0, "fixed": 0, "problems": 0}
+    to_fix = []
+
+    def account(row: dict) -> None:
+        if row["state"] == "ARREGLADA":
+            summary["fixed"] += 1
+        elif row["state"] == "ERROR":
+            summary["errors"] += 1
+        if not args.only_problems or is_problem(row):
+            report.add(row)
+
+    with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+        for row in pool.imap_unordered(inspect, iter_images(base), chunksize=256):
+            summary["total"] += 1
+            if row["state"] == "OK":
+                summary["ok"] += 1
+            if row["max_side"] and row["max_side"] > TARGET_MAX_SIDE:
+                summary["oversize"] += 1
+            if "metadatos" in row["state"]:
+                summary["metadata"] += 1
+            if fixable(row):
+                summary["problems"] += 1
+            if args.fix and fixable(row):
+                to_fix.append(row)
+                continue
+            account(row)
+
+        if to_fix:
+            attach_refs(to_fix)
+            for row in pool.imap_unordered(fix, to_fix, chunksize=4):
+                if row["state"] == "ARREGLADA" and row.get("refs"):
+                    repoint(row)
+                account(row)
+
+    if summary["total"] == 0 and args.format == "table":
+        print(f"(Sin imágenes con extensión {VALID_EXT} en {base})", file=out)
+    report.close(summary)
+    if args.out:
+        out.close()
+
+    if args.strict and summary["problems"] - summary["fixed"] > 0:
         sys.exit(1)
 
 if __name__ == "__main__":
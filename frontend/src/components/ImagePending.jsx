@@ -0,0 +1,46 @@
+// src/components/ImagePending.jsx
+// Miniatura de una imagen que todavía no tiene URL: en cola mientras el
+// servidor la procesa (status "queued") o fallida (status "failed", con el
+// motivo en image.error). Las imágenes listas se pintan con <img> como siempre.
+import React from "react";
+
+// true si la imagen (objeto de la API) aún no se puede mostrar
+export const isPending = (image) =>
+  !!image && typeof image === "object" && !image.url;
+
+// true si alguna imagen de la lista de anuncios sigue en cola (hay que refrescar)
+export const hasQueued = (ads) =>
+  (ads || []).some((ad) => (ad.images || []).some((im) => im?.status === "queued"));
+
+// Cada cuánto se vuelve a pedir la lista mientras haya imágenes en cola
+export const QUEUED_POLL_MS = 4000;
+
+const ImagePending = ({ image, width = 82, height = 62, radius = 6 }) => {
+  const failed = image?.status === "failed";
+  return (
+    <div
+      title={
+        failed
+          ? image?.error || "No se ha podido procesar la imagen"
+          : "Procesando imagen…"
+      }
+      style={{
+        width,
+        height,
+        borderRadius: radius,
+        border: "1px solid #ddd",
+        background: failed ? "#fdecea" : "#eef3f9",
+        color: failed ? "#c62828" : "#98a6b8",
+        display: "flex",
+        alignItems: "center",
+        justifyContent: "center",
+        fontSize: 11,
+        textAlign: "center",
+      }}
+    >
+      {failed ? "Error" : "Procesando…"}
+    </div>
+  );
+};
+
+export default ImagePending;
@@ -4,6 +4,7 @@ import { API_URL } from "../config";
 import { useAuth } from "../context/AuthContext";
 import "../styles/Admin.css";
 import Icon from "../components/Icon";
+import ImagePending, { isPending } from "../components/ImagePending";
 
 const AdminDashboard = () => {
   const { user } = useAuth();
@@ -160,18 +161,22 @@ const AdminDashboard = () => {
               <div className="images" style={{ display: "flex", gap: 8, flexWrap: "wrap" }}>
                 {(ad.images || []).map((im) => (
                   <div key={im.id} className="img-thumb">
-                    <img
-                      src={im.url?.startsWith("http") ? im.url : `${API_URL}${im.url}`}
-                      alt=""
-                      style={{
-                        width: 82,
-                        height: 62,
-                        objectFit: "cover",
-                        borderRadius: 6,
-                        border: "1px solid #ddd",
-                        display: "block",
-                      }}
-                    />
+                    {isPending(im) ? (
+                      <ImagePending image={im} />
+                    ) : (
+                      <img
+                        src={im.url?.startsWith("http") ? im.url : `${API_URL}${im.url}`}
+                        alt=""
+                        style={{
+                          width: 82,
+                          height: 62,
+                          objectFit: "cover",
+                          borderRadius: 6,
+                          border: "1px solid #ddd",
+                          display: "block",
+                        }}
+                      />
+                    )}
                     <button
                       type="button"
                       className="img-x"
@@ -6,6 +6,7 @@ import { API_URL } from "../config";
 import "../styles/RegisterForm.css";
 import "../styles/Admin.css";
 import Icon from "../components/Icon";
+import ImagePending, { hasQueued, isPending, QUEUED_POLL_MS } from "../components/ImagePending";
 
 // Acepta string o objeto { url: "..."}
 const toImg = (v) => {
@@ -132,6 +133,21 @@ const AdminPanel = () => {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [isAuthenticated]);
 
+  // Imágenes en cola (procesado diferido): refresca sólo los anuncios hasta que estén
+  useEffect(() => {
+    if (!hasQueued(ads)) return;
+    const t = setTimeout(async () => {
+      try {
+        const adsData = await fetchJSON(`${API_URL}/api/admin/ads`);
+        if (Array.isArray(adsData)) setAds(adsData);
+      } catch {
+        // se reintenta en el siguiente refresco
+      }
+    }, QUEUED_POLL_MS);
+    return () => clearTimeout(t);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [ads]);
+
   // --------- USERS ----------
   const handleBlockUser = async (u) => {
     try {
@@ -658,21 +674,25 @@ const AdminPanel = () => {
                     const key = typeof img === "object" ? img.id ?? i : i;
                     return (
                       <div key={key} className="img-thumb">
-                        <img
-                          src={src}
-                          alt=""
-                          title={typeof img === "object" ? img.url : String(img)}
-                          style={{
-                            width: 84,
-                            height: 84,
-                            objectFit: "cover",
-                            borderRadius: 8,
-                            border: "1px solid #dfe6ee",
-                            cursor: "zoom-in",
-                          }}
-                          onClick={() => setZoomSrc(src)}
-                          onError={(e) => (e.currentTarget.style.opacity = 0.3)}
-                        />
+                        {isPending(img) ? (
+                          <ImagePending image={img} width={84} height={84} radius={8} />
+                        ) : (
+                          <img
+                            src={src}
+                            alt=""
+                            title={typeof img === "object" ? img.url : String(img)}
+                            style={{
+                              width: 84,
+                              height: 84,
+                              objectFit: "cover",
+                              borderRadius: 8,
+                              border: "1px solid #dfe6ee",
+                              cursor: "zoom-in",
+                            }}
+                            onClick={() => setZoomSrc(src)}
+                            onError={(e) => (e.currentTarget.style.opacity = 0.3)}
+                          />
+                        )}
                         {typeof img === "object" && img.id && (
                           <button
                             type="button"
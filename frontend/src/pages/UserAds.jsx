@@ -4,6 +4,7 @@ import { useAuth } from "../context/AuthContext";
 import "../styles/RegisterForm.css";
 import BackButton from "../components/BackButton";
 import Icon from "../components/Icon";
+import ImagePending, { hasQueued, isPending, QUEUED_POLL_MS } from "../components/ImagePending";
 import { API_URL } from "../config";
 
 const API = (API_URL || "").replace(/\/+$/, ""); // "" => mismo origen
@@ -31,9 +32,9 @@ const UserAds = () => {
     (typeof window !== "undefined" && localStorage.getItem("token")) || "";
   const authHeaders = token ? { Authorization: `Bearer ${token}` } : {};
 
-  // Cargar anuncios del usuario
-  const loadAds = async () => {
-    setLoading(true);
+  // Cargar anuncios del usuario (silent: refresco sin el indicador de carga)
+  const loadAds = async ({ silent = false } = {}) => {
+    if (!silent) setLoading(true);
     setErr("");
 
     try {
@@ -74,6 +75,14 @@ const UserAds = () => {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [isAuthenticated, user?.id]);
 
+  // Imágenes en cola (el servidor las procesa tras responder): refresca hasta que estén
+  useEffect(() => {
+    if (!hasQueued(ads)) return;
+    const t = setTimeout(() => loadAds({ silent: true }), QUEUED_POLL_MS);
+    return () => clearTimeout(t);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [ads]);
+
   // Iniciar edición
   const startEdit = (ad) => {
     setEditId(ad.id);
@@ -347,24 +356,28 @@ const UserAds = () => {
                 >
                   {ad.images.map((img, i) => (
                     <div key={img.id || i} className="img-thumb" style={{ margin: "0 3px" }}>
-                      <img
-                        src={imageUrl(img.url)}
-                        alt={ad.title}
-                        style={{
-                          width: 82,
-                          height: 62,
-                          objectFit: "cover",
-                          borderRadius: 6,
-                          cursor: "zoom-in",
-                          border: "1px solid #ddd",
-                        }}
-                        onClick={() => openModal(imageUrl(img.url))}
-                        title="Haz clic para ver grande"
-                        onError={(e) => {
-                          e.currentTarget.style.opacity = "0.3";
-                          e.currentTarget.title = "Error al cargar imagen";
-                        }}
-                      />
+                      {isPending(img) ? (
+                        <ImagePending image={img} />
+                      ) : (
+                        <img
+                          src={imageUrl(img.url)}
+                          alt={ad.title}
+                          style={{
+                            width: 82,
+                            height: 62,
+                            objectFit: "cover",
+                            borderRadius: 6,
+                            cursor: "zoom-in",
+                            border: "1px solid #ddd",
+                          }}
+                          onClick={() => openModal(imageUrl(img.url))}
+                          title="Haz clic para ver grande"
+                          onError={(e) => {
+                            e.currentTarget.style.opacity = "0.3";
+                            e.currentTarget.title = "Error al cargar imagen";
+                          }}
+                        />
+                      )}
 
                       {editId === ad.id && (
                         <button
@@ -0,0 +1,122 @@
+# scripts/backfill_image_metadata.py
+#
+# Rellena los metadatos de AdImage (width, height, bytes, format, sha256) en
+# las filas anteriores a que se guardaran al ingerir. Lee cada fichero una
+# vez por URL (las imágenes que comparten blob reciben los mismos datos) y en
+# paralelo; de la imagen sólo se lee la cabecera (Image.open no decodifica).
+# Las filas sin created_at toman la fecha de su anuncio.
+# Idempotente: se puede relanzar y sólo procesa lo pendiente.
+#
+# Uso:
+#   python scripts/backfill_image_metadata.py [--batch 500] [--workers 8] [--dry-run]
+import io
+import os
+import sys
+import hashlib
+import argparse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from PIL import Image
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app import models
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_bytes(url: str) -> bytes:
+    if url.startswith("/"):
+        return (PROJECT_ROOT / url.lstrip("/")).read_bytes()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        return resp.read()
+
+
+def inspect(url: str):
+    """Se ejecuta en el pool: url -> (url, metadatos) o (url, None, error)."""
+    try:
+        data = load_bytes(url)
+        with Image.open(io.BytesIO(data)) as im:
+            w, h = im.size
+            fmt = (im.format or "").upper()
+        return url, {
+            "width": w, "height": h, "bytes": len(data), "format": fmt,
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }, None
+    except Exception as e:
+        return url, None, str(e)
+
+
+def fill_created_at(db) -> int:
+    """created_at de las filas antiguas = fecha de su anuncio (un solo UPDATE)."""
+    ad_created = (
+        select(models.Ad.created_at)
+        .where(models.Ad.id == models.AdImage.ad_id)
+        .scalar_subquery()
+    )
+    n = db.query(models.AdImage).filter(models.AdImage.created_at.is_(None)).update(
+        {models.AdImage.created_at: ad_created}, synchronize_session=False
+    )
+    db.commit()
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rellena los metadatos de imagen pendientes.")
+    parser.add_argument("--batch", type=int, default=500, help="URLs por lote")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo cuenta lo pendiente")
+    args = parser.parse_args()
+
+    pending = (models.AdImage.bytes.is_(None)) & (models.AdImage.url != "")
+    db = SessionLocal()
+    failed = set()
+    done = 0
+    try:
+        total = db.query(models.AdImage).filter(pending).count()
+        urls = db.query(models.AdImage.url).filter(pending).distinct().count()
+        no_date = db.query(models.AdImage).filter(models.AdImage.created_at.is_(None)).count()
+        print(f"[INFO] {total} imágenes sin metadatos ({urls} ficheros distintos), {no_date} sin created_at")
+        if args.dry_run:
+            return
+        if no_date:
+            print(f"[OK] created_at rellenado en {fill_created_at(db)} imágenes")
+        if not total:
+            return
+
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            while True:
+                q = db.query(models.AdImage.url).filter(pending)
+                if failed:
+                    q = q.filter(models.AdImage.url.notin_(failed))
+                batch = [u for (u,) in q.distinct().order_by(models.AdImage.url).limit(args.batch).all()]
+                if not batch:
+                    break
+                for url, meta, error in pool.map(inspect, batch, chunksize=8):
+                    if meta is None:
+                        failed.add(url)
+                        print(f"[ERR] {url}: {error}")
+                        continue
+                    done += db.query(models.AdImage).filter(pending, models.AdImage.url == url).update(
+                        {getattr(models.AdImage, k): v for k, v in meta.items()}, synchronize_session=False
+                    )
+                db.commit()
+                print(f"[OK] {done}/{total} imágenes con metadatos")
+    finally:
+        db.close()
+
+    if failed:
+        print(f"[WARN] {len(failed)} ficheros no se pudieron leer")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
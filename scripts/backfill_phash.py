@@ -0,0 +1,96 @@
+# scripts/backfill_phash.py
+#
+# Calcula el hash perceptual (AdImage.phash, ver app/ads/phash.py) de las
+# imágenes que aún no lo tienen (subidas antes de que existiera). Idempotente:
+# se puede relanzar y sólo procesa lo pendiente.
+#
+# Uso:
+#   python scripts/backfill_phash.py [--batch 200] [--workers 4] [--dry-run]
+import io
+import os
+import sys
+import argparse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from PIL import Image
+
+from app.database import SessionLocal
+from app import models
+from app.ads.images import dhash
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_bytes(url: str) -> bytes:
+    if url.startswith("/"):
+        return (PROJECT_ROOT / url.lstrip("/")).read_bytes()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        return resp.read()
+
+
+def compute(item):
+    """Se ejecuta en el pool: (id, url) -> (id, phash) o (id, None, error)."""
+    image_id, url = item
+    try:
+        with Image.open(io.BytesIO(load_bytes(url))) as im:
+            im.draft("L", (512, 512))  # JPEG: decodifica ya reducido
+            return image_id, dhash(im), None
+    except Exception as e:
+        return image_id, None, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calcula los hashes perceptuales pendientes.")
+    parser.add_argument("--batch", type=int, default=200, help="Imágenes por lote")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo cuenta lo pendiente")
+    args = parser.parse_args()
+
+    pending = (models.AdImage.phash.is_(None)) & (models.AdImage.url != "")
+    db = SessionLocal()
+    failed = set()
+    done = 0
+    try:
+        total = db.query(models.AdImage).filter(pending).count()
+        print(f"[INFO] {total} imágenes sin hash perceptual")
+        if args.dry_run or not total:
+            return
+
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            while True:
+                q = db.query(models.AdImage.id, models.AdImage.url).filter(pending)
+                if failed:
+                    q = q.filter(models.AdImage.id.notin_(failed))
+                batch = q.order_by(models.AdImage.id).limit(args.batch).all()
+                if not batch:
+                    break
+                updates = []
+                for image_id, phash, error in pool.map(compute, batch):
+                    if phash is None:
+                        failed.add(image_id)
+                        print(f"[ERR] imagen {image_id}: {error}")
+                        continue
+                    updates.append({"id": image_id, "phash": phash})
+                if updates:
+                    db.bulk_update_mappings(models.AdImage, updates)
+                db.commit()
+                done += len(updates)
+                print(f"[OK] {done}/{total} hashes calculados")
+    finally:
+        db.close()
+
+    if failed:
+        print(f"[WARN] {len(failed)} imágenes no se pudieron procesar")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
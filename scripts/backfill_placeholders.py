@@ -0,0 +1,95 @@
+# scripts/backfill_placeholders.py
+#
+# Calcula el placeholder LQIP (AdImage.placeholder, ver app/ads/images.py:lqip)
+# de las imágenes que aún no lo tienen (subidas antes de que existiera).
+# Se procesa una vez por URL: las imágenes que comparten blob reciben el mismo.
+# Idempotente: se puede relanzar y sólo procesa lo pendiente.
+#
+# Uso:
+#   python scripts/backfill_placeholders.py [--batch 200] [--workers 4] [--dry-run]
+import io
+import os
+import sys
+import argparse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from PIL import Image
+
+from app.database import SessionLocal
+from app import models
+from app.ads.images import LQIP_SIDE, lqip
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_bytes(url: str) -> bytes:
+    if url.startswith("/"):
+        return (PROJECT_ROOT / url.lstrip("/")).read_bytes()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        return resp.read()
+
+
+def compute(url: str):
+    """Se ejecuta en el pool: url -> (url, placeholder) o (url, None, error)."""
+    try:
+        with Image.open(io.BytesIO(load_bytes(url))) as im:
+            im.draft("RGB", (LQIP_SIDE * 4, LQIP_SIDE * 4))  # JPEG: decodifica ya reducido
+            return url, lqip(im), None
+    except Exception as e:
+        return url, None, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calcula los placeholders LQIP pendientes.")
+    parser.add_argument("--batch", type=int, default=200, help="URLs por lote")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo cuenta lo pendiente")
+    args = parser.parse_args()
+
+    pending = (models.AdImage.placeholder.is_(None)) & (models.AdImage.url != "")
+    db = SessionLocal()
+    failed = set()
+    done = 0
+    try:
+        total = db.query(models.AdImage).filter(pending).count()
+        urls = db.query(models.AdImage.url).filter(pending).distinct().count()
+        print(f"[INFO] {total} imágenes sin placeholder ({urls} ficheros distintos)")
+        if args.dry_run or not total:
+            return
+
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            while True:
+                q = db.query(models.AdImage.url).filter(pending)
+                if failed:
+                    q = q.filter(models.AdImage.url.notin_(failed))
+                batch = [u for (u,) in q.distinct().order_by(models.AdImage.url).limit(args.batch).all()]
+                if not batch:
+                    break
+                for url, placeholder, error in pool.map(compute, batch):
+                    if placeholder is None:
+                        failed.add(url)
+                        print(f"[ERR] {url}: {error}")
+                        continue
+                    done += db.query(models.AdImage).filter(pending, models.AdImage.url == url).update(
+                        {models.AdImage.placeholder: placeholder}, synchronize_session=False
+                    )
+                db.commit()
+                print(f"[OK] {done}/{total} placeholders calculados")
+    finally:
+        db.close()
+
+    if failed:
+        print(f"[WARN] {len(failed)} ficheros no se pudieron procesar")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# scripts/backfill_renditions.py
+#
+# Regenera las variantes responsive de las imágenes cuya versión de
+# especificación (AdImage.renditions_version) no coincide con la actual
+# (app/ads/renditions.py -> RENDITION_SPEC_VERSION). Idempotente: se puede
+# relanzar (p.ej. desde cron) y sólo procesa lo pendiente.
+#
+# Uso:
+#   python scripts/backfill_renditions.py [--batch 50] [--workers 4] [--dry-run]
+import io
+import os
+import sys
+import asyncio
+import argparse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from PIL import Image
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+
+from app.database import SessionLocal
+from app import models
+from app.ads.renditions import RENDITION_SPEC_VERSION, build_renditions_from_bytes
+from app.ads.storage import close_storage, delete_urls_blocking
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_bytes(url: str) -> bytes:
+    if url.startswith("/"):
+        return (PROJECT_ROOT / url.lstrip("/")).read_bytes()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        return resp.read()
+
+
+def render(item):
+    """Se ejecuta en el pool: (id, url) -> (id, (w, h, fmt), renditions) o (id, None, error)."""
+    image_id, url = item
+    try:
+        buf = load_bytes(url)
+        with Image.open(io.BytesIO(buf)) as im:
+            main = (im.width, im.height, (im.format or "PNG").upper())
+        return image_id, main, build_renditions_from_bytes(buf)
+    except Exception as e:
+        return image_id, None, str(e)
+
+
+async def store_all(jobs):
+    """Sube en paralelo [(datos, formato, stem)] con el backend activo; devuelve las URLs."""
+    from app.ads.routes import _store_bytes
+    try:
+        return await asyncio.gather(*(_store_bytes(data, fmt, stem) for data, fmt, stem in jobs))
+    finally:
+        await close_storage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenera variantes responsive pendientes.")
+    parser.add_argument("--batch", type=int, default=50, help="Imágenes por lote")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo cuenta lo pendiente")
+    args = parser.parse_args()
+
+    pending = or_(
+        models.AdImage.renditions_version.is_(None),
+        models.AdImage.renditions_version != RENDITION_SPEC_VERSION,
+    )
+    db = SessionLocal()
+    failed = set()
+    done = 0
+    try:
+        total = db.query(models.AdImage).filter(pending).count()
+        print(f"[INFO] Spec v{RENDITION_SPEC_VERSION}: {total} imágenes pendientes")
+        if args.dry_run or not total:
+            return
+
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            while True:
+                q = db.query(models.AdImage).options(selectinload(models.AdImage.renditions)).filter(pending)
+                if failed:
+                    q = q.filter(models.AdImage.id.notin_(failed))
+                batch = q.order_by(models.AdImage.id).limit(args.batch).all()
+                if not batch:
+                    break
+                by_id = {img.id: img for img in batch}
+
+                for image_id, main_info, result in pool.map(render, [(i.id, i.url) for i in batch]):
+                    img = by_id[image_id]
+                    if main_info is None:
+                        failed.add(image_id)
+                        print(f"[ERR] imagen {image_id} ({img.url}): {result}")
+                        continue
+                    width, height, fmt = main_info
+
+                    # Fuera las variantes anteriores (nunca la principal); antes de
+                    # subir las nuevas, que pueden llevar el mismo nombre
+                    delete_urls_blocking([r.url for r in img.renditions if r.url != img.url])
+                    for r in list(img.renditions):
+                        img.renditions.remove(r)
+
+                    stem = Path(img.url.split("?")[0]).stem
+                    urls = asyncio.run(store_all([(r.data, r.format, f"{stem}_{r.width}") for r in result]))
+                    img.renditions.append(models.AdImageRendition(
+                        width=width, height=height, format=fmt, url=img.url,
+                    ))
+                    for r, url in zip(result, urls):
+                        img.renditions.append(models.AdImageRendition(
+                            width=r.width, height=r.height, format=r.format, url=url,
+                        ))
+                    img.renditions_version = RENDITION_SPEC_VERSION
+                    done += 1
+                db.commit()
+                print(f"[OK] {done}/{total} imágenes regeneradas")
+    finally:
+        db.close()
+
+    if failed:
+        print(f"[WARN] {len(failed)} imágenes no se pudieron procesar")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# scripts/bench_images.py
+#
+# Benchmark del pipeline real de imágenes (app/ads/images.py -> process_image:
+# validar + limpiar + redimensionar + codificar + variantes) más la escritura
+# en disco (app/ads/storage.py -> DiskStorage, en una carpeta temporal).
+#
+# Genera corpus sintéticos JPEG/PNG/WebP de varios tamaños (hasta 8000x8000) y
+# ejecuta cada caso en serie (1 proceso) y en paralelo (N procesos). Cada caso
+# corre en procesos nuevos para que el pico de RSS sea el de ese caso.
+# Por caso informa: imágenes/s, latencia p50/p99, bytes de salida y pico de RSS.
+# Los resultados se guardan en JSON para comparar entre versiones (--compare).
+#
+# Uso:
+#   python scripts/bench_images.py                          # todo el corpus
+#   python scripts/bench_images.py --formats JPEG --sizes 4000x3000,8000x8000
+#   python scripts/bench_images.py -n 8 --workers 4 --out bench.json
+#   python scripts/bench_images.py --out new.json --compare old.json
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import PIL
+from PIL import Image, ImageFilter
+
+from app.ads.images import process_image
+from app.ads.storage import DiskStorage
+
+DEFAULT_FORMATS = ("JPEG", "PNG", "WEBP")
+DEFAULT_SIZES = ((1280, 960), (3000, 2000), (4000, 3000), (8000, 8000))
+SAVE_KW = {"JPEG": {"quality": 90}, "PNG": {}, "WEBP": {"quality": 90}}
+
+
+def synthetic(fmt: str, w: int, h: int) -> bytes:
+    """Imagen 'fotográfica' reproducible: fractal + ruido suavizado + degradado."""
+    base = Image.effect_mandelbrot((w, h), (-2.2, -1.4, 1.0, 1.4), 80)
+    noise = Image.effect_noise((w, h), 40).filter(ImageFilter.GaussianBlur(1.5))
+    grad = Image.linear_gradient("L").resize((w, h))
+    img = Image.merge("RGB", (base, noise, grad))
+    out = io.BytesIO()
+    img.save(out, format=fmt, **SAVE_KW[fmt])
+    return out.getvalue()
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KiB; macOS: bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_one(path: str, store_dir: str):
+    """Se ejecuta en el pool: pipeline + escritura de una imagen."""
+    buf = Path(path).read_bytes()
+    storage = DiskStorage(root=Path(store_dir))
+    t = time.perf_counter()
+    processed = process_image(buf)
+    stem = uuid.uuid4().hex  # clave única: medimos siempre la escritura
+    asyncio.run(storage.put(f"{stem}.{processed.format.lower()}", processed.data, ""))
+    for r in processed.renditions:
+        asyncio.run(storage.put(f"{stem}_{r.width}.{r.format.lower()}", r.data, ""))
+    ms = (time.perf_counter() - t) * 1000
+    total = len(processed.data) + sum(len(r.data) for r in processed.renditions)
+    return ms, len(processed.data), total, os.getpid(), peak_rss_mb()
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_case(path: str, n: int, workers: int, warmup: int):
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench-out-") as store_dir, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # Calentamiento: arranque de procesos + imports fuera de la medida
+        list(pool.map(run_one, [path] * max(warmup, 1) * workers, [store_dir] * max(warmup, 1) * workers))
+        t = time.perf_counter()
+        results = list(pool.map(run_one, [path] * n, [store_dir] * n))
+        wall = time.perf_counter() - t
+
+    lat = [r[0] for r in results]
+    rss_by_pid = {}
+    for r in results:
+        rss_by_pid[r[3]] = max(rss_by_pid.get(r[3], 0.0), r[4])
+    return {
+        "n": n,
+        "images_per_sec": round(n / wall, 3),
+        "p50_ms": round(percentile(lat, 50), 1),
+        "p99_ms": round(percentile(lat, 99), 1),
+        "mean_ms": round(statistics.fmean(lat), 1),
+        "output_bytes": results[0][1],
+        "output_bytes_total": results[0][2],
+        "peak_rss_mb": round(max(rss_by_pid.values()), 1),
+        "peak_rss_mb_sum": round(sum(rss_by_pid.values()), 1),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parents[1],
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return ""
+
+
+def parse_sizes(text: str):
+    sizes = []
+    for item in text.split(","):
+        w, _, h = item.lower().partition("x")
+        sizes.append((int(w), int(h or w)))
+    return sizes
+
+
+def case_key(r: dict):
+    return (r["format"], r["width"], r["height"], r["mode"], r["workers"])
+
+
+def compare(results, old_path: str) -> None:
+    old = {case_key(r): r for r in json.loads(Path(old_path).read_text())["results"]}
+    print(f"\nComparación con {old_path}:")
+    print(f"{'Caso':34} {'img/s':>16} {'p99 ms':>18} {'RSS MB':>16}")
+    for r in results:
+        o = old.get(case_key(r))
+        if o is None:
+            continue
+        name = f"{r['format']} {r['width']}x{r['height']} {r['mode']}"
+
+        def delta(key):
+            a, b = o[key], r[key]
+            pct = (b - a) / a * 100 if a else 0.0
+            return f"{a:g}->{b:g} ({pct:+.0f}%)"
+        print(f"{name:34} {delta('images_per_sec'):>16} {delta('p99_ms'):>18} {delta('peak_rss_mb'):>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de imágenes.")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS), help="JPEG,PNG,WEBP")
+    parser.add_argument("--sizes", default=",".join(f"{w}x{h}" for w, h in DEFAULT_SIZES), help="p.ej. 4000x3000,8000x8000")
+    parser.add_argument("-n", type=int, default=6, help="Imágenes medidas por caso y modo")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Procesos en modo paralelo")
+    parser.add_argument("--warmup", type=int, default=1, help="Iteraciones de calentamiento por proceso")
+    parser.add_argument("--out", default="bench_images.json", help="Fichero JSON de resultados")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior para mostrar diferencias")
+    args = parser.parse_args()
+
+    formats = [f.strip().upper() for f in args.formats.split(",") if f.strip()]
+    sizes = parse_sizes(args.sizes)
+    modes = [("serial", 1)] + ([("parallel", args.workers)] if args.workers > 1 else [])
+
+    print(f"Pillow {PIL.__version__} | {os.cpu_count()} CPUs | n={args.n} | paralelo={args.workers} procesos")
+    print("-" * 104)
+    print(f"{'Caso':24} {'Entrada':>10} {'Modo':>10} {'img/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'Salida':>10} {'+variantes':>11} {'RSS MB':>8}")
+    print("-" * 104)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-in-") as corpus:
+        for fmt in formats:
+            for w, h in sizes:
+                path = Path(corpus) / f"{w}x{h}.{fmt.lower()}"
+                path.write_bytes(synthetic(fmt, w, h))
+                size_in = path.stat().st_size
+                for mode, workers in modes:
+                    r = run_case(str(path), args.n, workers, args.warmup)
+                    r.update({"format": fmt, "width": w, "height": h, "input_bytes": size_in,
+                              "mode": mode, "workers": workers})
+                    results.append(r)
+                    print(f"{fmt + f' {w}x{h}':24} {size_in:>10} {mode:>10} {r['images_per_sec']:>8.2f} "
+                          f"{r['p50_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['output_bytes']:>10} "
+                          f"{r['output_bytes_total']:>11} {r['peak_rss_mb']:>8.0f}")
+                path.unlink()
+    print("-" * 104)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "n": args.n,
+            "workers": args.workers,
+        },
+        "results": results,
+    }
+    Path(args.out).write_text(json.dumps(report, indent=2))
+    print(f"[OK] Resultados en {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
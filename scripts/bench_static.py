@@ -0,0 +1,143 @@
+# scripts/bench_static.py
+#
+# Benchmark del servido de imágenes: el mount genérico de StaticFiles (como
+# estaba /static) frente a ImageFiles (app/ads/serve.py), sobre el mismo corpus
+# de ficheros con nombre por contenido y en proceso (httpx + ASGITransport,
+# sin red: mide el coste de la app, no el del servidor).
+#
+# Escenarios por tamaño de fichero:
+#   get         GET completo (200)
+#   revalidate  GET con If-None-Match del ETag recibido (304 si se respeta)
+#   range       GET con Range: bytes=0-65535 (206)
+# Además informa de la cabecera Cache-Control de cada uno: con `immutable` el
+# navegador no vuelve a pedir la imagen en visitas repetidas (0 peticiones).
+#
+# El envío sin copia (zerocopysend/pathsend) depende del servidor ASGI y no se
+# ejercita aquí; con nginx delante, ver IMAGE_ACCEL_REDIRECT.
+#
+# Uso:
+#   python scripts/bench_static.py [-n 500] [--concurrency 16] [--sizes 20000,200000,2000000]
+#   python scripts/bench_static.py --out bench_static.json
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import statistics
+import tempfile
+from pathlib import Path
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+from app.ads.serve import ImageFiles
+
+DEFAULT_SIZES = (20_000, 200_000, 2_000_000)
+RANGE = "bytes=0-65535"
+
+
+def make_corpus(root: Path, sizes) -> list:
+    names = []
+    for size in sizes:
+        data = os.urandom(size)
+        name = f"{hashlib.sha256(data).hexdigest()}.jpg"
+        (root / name).write_bytes(data)
+        names.append((size, name))
+    return names
+
+
+def build_apps(root: Path) -> dict:
+    return {
+        "StaticFiles": Starlette(routes=[Mount("/static/images", StaticFiles(directory=str(root)))]),
+        "ImageFiles": Starlette(routes=[Mount("/static/images", ImageFiles(directory=str(root)))]),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, url: str, headers: dict, n: int, concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies, statuses, transferred = [], {}, 0
+
+    async def one():
+        nonlocal transferred
+        async with sem:
+            t = time.perf_counter()
+            r = await client.get(url, headers=headers)
+            latencies.append((time.perf_counter() - t) * 1000)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+            transferred += len(r.content)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "req_per_sec": n / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "statuses": statuses,
+        "bytes": transferred,
+    }
+
+
+async def bench(args) -> list:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-static-") as tmp:
+        root = Path(tmp)
+        corpus = make_corpus(root, args.sizes)
+        for impl, app in build_apps(root).items():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for size, name in corpus:
+                    url = f"/static/images/{name}"
+                    first = await client.get(url)
+                    etag = first.headers.get("etag", "")
+                    cache = first.headers.get("cache-control", "-")
+                    scenarios = {
+                        "get": {},
+                        "revalidate": {"if-none-match": etag},
+                        "range": {"range": RANGE},
+                    }
+                    for scenario, headers in scenarios.items():
+                        r = await run_scenario(client, url, headers, args.n, args.concurrency)
+                        r.update({"impl": impl, "size": size, "scenario": scenario, "cache_control": cache})
+                        results.append(r)
+                        codes = ",".join(f"{k}x{v}" for k, v in sorted(r["statuses"].items()))
+                        print(f"{impl:12} {size:>9} {scenario:>11} {r['req_per_sec']:>9.0f} {r['p50_ms']:>8.2f} "
+                              f"{r['p99_ms']:>8.2f} {r['bytes'] / args.n:>10.0f}  {codes}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de StaticFiles frente a ImageFiles.")
+    parser.add_argument("-n", type=int, default=500, help="Peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Peticiones simultáneas")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="Tamaños de fichero en bytes")
+    parser.add_argument("--out", help="Fichero JSON de resultados")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    print(f"n={args.n} | concurrencia={args.concurrency}")
+    print("-" * 84)
+    print(f"{'Impl':12} {'Tamaño':>9} {'Escenario':>11} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'B/resp':>10}  Estados")
+    print("-" * 84)
+    results = asyncio.run(bench(args))
+    print("-" * 84)
+    for impl in ("StaticFiles", "ImageFiles"):
+        cache = next(r["cache_control"] for r in results if r["impl"] == impl)
+        print(f"{impl}: Cache-Control = {cache}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"n": args.n, "concurrency": args.concurrency, "results": results}, f, indent=1)
+        print(f"[OK] Resultados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# scripts/check_image_modes.py
+#
+# Regresión de modos de color poco habituales: pasa por el pipeline completo
+# (app/ads/images.py -> process_image, con variantes) PNG de 16 bits, bitonales,
+# con paleta y alfa, etc., y comprueba que no revientan, que la salida queda en
+# un modo apto para navegador y que el rango de grises de 16 bits se conserva
+# (escalado a 8 bits, no recortado). Falla (código 1) si alguno no lo cumple.
+#
+# Uso:
+#   python scripts/check_image_modes.py
+import io
+import os
+import sys
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from PIL import Image
+
+from app.ads.images import process_image
+
+W, H = 600, 400
+# Modos de salida aptos para navegador (P: PNG con paleta del codificador)
+OUTPUT_MODES = ("L", "LA", "P", "RGB", "RGBA")
+
+
+def gradient16() -> Image.Image:
+    """PNG de 16 bits en gris: degradado horizontal de 0 a 65535."""
+    img = Image.new("I;16", (W, H))
+    img.putdata([x * 65535 // (W - 1) for _ in range(H) for x in range(W)])
+    return img
+
+
+def cases():
+    yield "PNG 16 bits (I;16)", gradient16(), "PNG"
+    yield "PNG 32 bits (I)", gradient16().convert("I"), "PNG"
+    yield "PNG bitonal (1)", Image.new("1", (W, H), 1), "PNG"
+    yield "PNG gris + alfa (LA)", Image.new("LA", (W, H), (90, 128)), "PNG"
+    pal = Image.new("P", (W, H), 3)
+    pal.info["transparency"] = 3
+    yield "PNG paleta con transparencia (P)", pal, "PNG"
+    yield "JPEG CMYK", Image.new("CMYK", (W, H), (0, 80, 160, 20)), "JPEG"
+    yield "WebP RGBA", Image.new("RGBA", (W, H), (10, 20, 30, 128)), "WEBP"
+
+
+def main():
+    failures = 0
+    for name, img, fmt in cases():
+        buf = io.BytesIO()
+        img.save(buf, format=fmt)
+        problems = []
+        try:
+            result = process_image(buf.getvalue())
+            out = Image.open(io.BytesIO(result.data))
+            if out.mode not in OUTPUT_MODES:
+                problems.append(f"modo de salida {out.mode}")
+            if img.mode.startswith("I") and out.convert("L").getextrema() != (0, 255):
+                problems.append(f"rango {out.convert('L').getextrema()} (debería ser 0-255)")
+            if not result.renditions:
+                problems.append("sin variantes")
+        except Exception as e:
+            problems.append(f"{type(e).__name__}: {e}")
+        failures += bool(problems)
+        print(f"[{'FAIL' if problems else ' OK '}] {name}" + (f": {', '.join(problems)}" if problems else ""))
+
+    print(f"\n{failures} caso(s) fallidos." if failures else "\nTodos los modos pasan por el pipeline.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# scripts/check_indexes.py
+#
+# Comprueba con EXPLAIN que las consultas calientes usan sus índices (los
+# crea app/migrations.py) y que las ordenadas no necesitan un paso de
+# ordenación aparte. Falla (código 1) si alguna no lo hace.
+#
+# En Postgres se desactiva el seq scan durante el EXPLAIN: con tablas
+# pequeñas el planificador lo prefiere aunque el índice exista, y lo que se
+# comprueba es que el índice sirve para la consulta.
+#
+# Uso:
+#   python scripts/check_indexes.py             # DB de DATABASE_URL (ya migrada)
+#   python scripts/check_indexes.py --scratch   # SQLite temporal recién migrada
+import os
+import sys
+import argparse
+import tempfile
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import create_engine, select, text
+
+from app.models import Ad, AdImage, AdImageRendition
+from app.migrations import current_version, migrate, LATEST_VERSION
+
+# (nombre, consulta, índice que debe usar, ¿ordenada por el propio índice?)
+HOT_QUERIES = [
+    ("imágenes de un anuncio (listados, borrado)",
+     select(AdImage).where(AdImage.ad_id == 1), "ix_ad_images_ad_id", False),
+    ("imágenes de varios anuncios (selectinload)",
+     select(AdImage).where(AdImage.ad_id.in_([1, 2, 3])), "ix_ad_images_ad_id", False),
+    ("variantes de varias imágenes (selectinload)",
+     select(AdImageRendition).where(AdImageRendition.image_id.in_([1, 2, 3])),
+     "ix_ad_image_renditions_image_id", False),
+    ("cola de moderación",
+     select(Ad).where(Ad.status == "pending").order_by(Ad.created_at.desc()).limit(50),
+     "ix_ads_status_created_at", True),
+    ("anuncios de un usuario",
+     select(Ad).where(Ad.user_id == 1).order_by(Ad.id.desc()), "ix_ads_user_id_id", True),
+]
+
+
+def explain(conn, stmt) -> str:
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        return "\n".join(row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    return "\n".join(row[0] for row in conn.execute(text("EXPLAIN " + sql)))
+
+
+def has_sort(plan: str, dialect: str) -> bool:
+    if dialect == "sqlite":
+        return "TEMP B-TREE FOR ORDER BY" in plan
+    return any(line.strip().lstrip("-> ").startswith(("Sort", "Incremental Sort")) for line in plan.splitlines())
+
+
+def check(engine) -> int:
+    failures = 0
+    with engine.connect() as conn:
+        version = current_version(conn)
+        if version < LATEST_VERSION:
+            print(f"[FAIL] DB en la versión {version} (última {LATEST_VERSION}): lanza scripts/migrate.py")
+            return 1
+        try:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for name, stmt, index, ordered in HOT_QUERIES:
+                plan = explain(conn, stmt)
+                problems = []
+                if index not in plan:
+                    problems.append(f"no usa {index}")
+                if ordered and has_sort(plan, conn.dialect.name):
+                    problems.append("ordena aparte")
+                failures += bool(problems)
+                print(f"[{'FAIL' if problems else ' OK '}] {name}" + (f": {', '.join(problems)}" if problems else ""))
+                if problems:
+                    print("       " + plan.replace("\n", "\n       "))
+        finally:
+            conn.rollback()  # deshace el SET LOCAL
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprueba con EXPLAIN los índices de las consultas calientes.")
+    parser.add_argument("--scratch", action="store_true", help="Usa una SQLite temporal recién migrada")
+    args = parser.parse_args()
+
+    if args.scratch:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'check.db')}")
+            migrate(engine)
+            failures = check(engine)
+            engine.dispose()
+    else:
+        from app.database import engine
+        failures = check(engine)
+
+    print(f"\n{failures} consulta(s) sin su índice." if failures else "\nTodas las consultas calientes usan su índice.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# scripts/check_jpeg_draft.py
+#
+# Control de calidad del atajo "draft" para JPEG grandes (app/ads/images.py):
+# compara la salida con reducción en el decodificador contra la referencia
+# (decodificación completa + LANCZOS) y falla si la diferencia supera la
+# tolerancia. También muestra el tiempo de cada camino.
+#
+# Uso:
+#   python scripts/check_jpeg_draft.py                 # corpus sintético
+#   python scripts/check_jpeg_draft.py foto1.jpg ...   # ficheros reales
+#   python scripts/check_jpeg_draft.py --min-psnr 38
+import io
+import os
+import sys
+import math
+import time
+import argparse
+from pathlib import Path
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+from app.ads.images import TARGET_MAX_SIDE, JPEG_DRAFT_MIN_RATIO, clean, open_validate
+
+SYNTHETIC_SIZES = ((4096, 3072), (6000, 4000), (8000, 6000), (8000, 8000))
+
+
+def synthetic_jpeg(w: int, h: int) -> bytes:
+    """JPEG 'fotográfico' reproducible: fractal + ruido suavizado + degradado."""
+    base = Image.effect_mandelbrot((w, h), (-2.2, -1.4, 1.0, 1.4), 80)
+    noise = Image.effect_noise((w, h), 40).filter(ImageFilter.GaussianBlur(1.5))
+    grad = Image.linear_gradient("L").resize((w, h))
+    img = Image.merge("RGB", (base, noise, grad))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    rms = ImageStat.Stat(diff).rms
+    mse = sum(x * x for x in rms) / len(rms)
+    return float("inf") if mse == 0 else 20 * math.log10(255.0 / math.sqrt(mse))
+
+
+def run(buf: bytes, allow_draft: bool):
+    t = time.perf_counter()
+    img, fmt = open_validate(buf)
+    out = clean(img, fmt, allow_draft=allow_draft)
+    return out, (time.perf_counter() - t) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara JPEG draft vs. decodificación completa.")
+    parser.add_argument("files", nargs="*", help="JPEGs a comprobar (por defecto: corpus sintético)")
+    parser.add_argument("--min-psnr", type=float, default=35.0, help="PSNR mínimo aceptado (dB)")
+    args = parser.parse_args()
+
+    if args.files:
+        cases = [(Path(f).name, Path(f).read_bytes()) for f in args.files]
+    else:
+        cases = [(f"synthetic {w}x{h}", synthetic_jpeg(w, h)) for w, h in SYNTHETIC_SIZES]
+
+    print(f"Draft si lado mayor >= {int(TARGET_MAX_SIDE * JPEG_DRAFT_MIN_RATIO)} px | PSNR mínimo {args.min_psnr} dB")
+    print("-" * 84)
+    print(f"{'Caso':28} {'Salida':>11} {'Ref ms':>8} {'Draft ms':>9} {'PSNR dB':>8}  Estado")
+    print("-" * 84)
+
+    bad = 0
+    for name, buf in cases:
+        ref, t_ref = run(buf, allow_draft=False)
+        new, t_new = run(buf, allow_draft=True)
+        if ref.size != new.size:
+            bad += 1
+            print(f"{name:28.28s} {'-':>11} {t_ref:>8.0f} {t_new:>9.0f} {'-':>8}  ERROR: tamaño {new.size} != {ref.size}")
+            continue
+        q = psnr(ref, new)
+        ok = q >= args.min_psnr
+        bad += 0 if ok else 1
+        size = f"{new.width}x{new.height}"
+        print(f"{name:28.28s} {size:>11} {t_ref:>8.0f} {t_new:>9.0f} {q:>8.2f}  {'OK' if ok else 'FUERA DE TOLERANCIA'}")
+
+    print("-" * 84)
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# scripts/check_storage.py
+#
+# Prueba de humo del backend de almacenamiento configurado (app/ads/storage.py):
+# sube objetos, comprueba que se sirven por su URL pública, que una segunda
+# subida de la misma clave no lo recrea, y los borra (uno a uno y en bloque).
+#
+# Contra un S3 local tipo MinIO:
+#   docker run -p 9000:9000 minio/minio server /data
+#   STORAGE_BACKEND=s3 S3_ENDPOINT=http://localhost:9000 S3_BUCKET=deotramano \
+#   S3_ACCESS_KEY_ID=minioadmin S3_SECRET_ACCESS_KEY=minioadmin \
+#   python scripts/check_storage.py
+#   (el bucket debe existir y permitir lectura anónima para comprobar las URLs)
+#
+# Uso:
+#   python scripts/check_storage.py [--objects 5] [--no-fetch]
+import os
+import sys
+import uuid
+import asyncio
+import argparse
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import httpx
+
+from app.ads.storage import DiskStorage, close_storage, get_storage
+
+
+async def fetch(backend, url: str) -> int:
+    if isinstance(backend, DiskStorage):
+        return 200 if backend.path(backend.key_for(url)).is_file() else 404
+    async with httpx.AsyncClient(timeout=30) as client:
+        return (await client.get(url)).status_code
+
+
+async def run(n: int, check_fetch: bool) -> int:
+    backend = get_storage()
+    print(f"[INFO] Backend: {backend.name}")
+    bad = 0
+    keys = [f"check-{uuid.uuid4().hex}.txt" for _ in range(n)]
+    try:
+        created = await asyncio.gather(*(backend.put(k, k.encode(), "text/plain") for k in keys))
+        if not all(created):
+            bad += 1
+            print("[ERR] put devolvió 'ya existía' para claves nuevas")
+        if not await backend.put(keys[0], keys[0].encode(), "text/plain"):
+            print("[OK] put de una clave existente no la recrea")
+        else:
+            print("[WARN] el backend no detecta claves existentes (se sobrescriben)")
+
+        urls = [backend.url(k) for k in keys]
+        if any(backend.key_for(u) is None for u in urls):
+            bad += 1
+            print("[ERR] key_for() no reconoce las URLs del propio backend")
+        if check_fetch:
+            codes = [await fetch(backend, u) for u in urls]
+            bad += sum(c != 200 for c in codes)
+            print(f"[{'OK' if all(c == 200 for c in codes) else 'ERR'}] GET de las URLs públicas: {codes}")
+
+        await backend.delete(keys[0])
+        await backend.delete_many(keys[1:])
+        print(f"[OK] borrados 1 + {len(keys) - 1} (en bloque)")
+        if check_fetch:
+            codes = [await fetch(backend, u) for u in urls]
+            gone = all(c in (403, 404) for c in codes)
+            bad += 0 if gone else 1
+            print(f"[{'OK' if gone else 'ERR'}] tras borrar: {codes}")
+    finally:
+        await close_storage()
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de humo del almacenamiento de imágenes.")
+    parser.add_argument("--objects", type=int, default=5, help="Objetos de prueba")
+    parser.add_argument("--no-fetch", action="store_true", help="No comprobar las URLs públicas")
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(run(max(2, args.objects), not args.no_fetch)) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,8 @@ from passlib.context import CryptContext
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 from sqlalchemy.exc import IntegrityError
 
-from app.database import SessionLocal, Base, engine
+from app.database import SessionLocal, engine
+from app.migrations import migrate
 from app import models
 
 
@@ -70,8 +71,8 @@ def main():
     if db_url:
         print(f"[INFO] Usando DATABASE_URL: {mask_url(db_url)}")
 
-    # Crea tablas por si la DB está vacía
-    Base.metadata.create_all(bind=engine)
+    # Crea/actualiza el esquema por si la DB está vacía o atrasada
+    migrate(engine)
 
     password_attr = resolve_password_attr()
 
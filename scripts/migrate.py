@@ -0,0 +1,44 @@
+# scripts/migrate.py
+#
+# Aplica las migraciones pendientes del esquema (ver app/migrations.py) en la
+# DB de DATABASE_URL. Pensado para el paso de despliegue, con DB_AUTO_MIGRATE=0
+# en las apps; con la migración automática activa también es inofensivo.
+#
+# Uso:
+#   python scripts/migrate.py            # aplica las pendientes
+#   python scripts/migrate.py --status   # versión actual y pendientes, sin tocar nada
+import os
+import sys
+import argparse
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.database import engine
+from app.migrations import LATEST_VERSION, current_version, migrate, pending
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones versionadas del esquema de la DB.")
+    parser.add_argument("--status", action="store_true", help="Sólo muestra la versión y lo pendiente")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        version = current_version(conn)
+    print(f"[db] {engine.dialect.name}: versión {version} (última {LATEST_VERSION})")
+
+    if args.status:
+        for m in pending(engine):
+            print(f"  pendiente {m.version}: {m.name}")
+        return
+
+    applied = migrate(engine)
+    if not applied:
+        print("[db] Nada que migrar.")
+
+
+if __name__ == "__main__":
+    main()
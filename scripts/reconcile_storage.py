@@ -0,0 +1,85 @@
+# scripts/reconcile_storage.py
+#
+# Compara la DB con el almacenamiento de imágenes (app/ads/reconcile.py):
+# ficheros huérfanos (sin ninguna fila que los use) y filas cuya URL apunta a
+# un fichero que ya no existe. Por defecto sólo informa.
+#
+# Uso:
+#   python scripts/reconcile_storage.py                       # informe
+#   python scripts/reconcile_storage.py --delete --grace-hours 24
+#   python scripts/reconcile_storage.py --mark-missing        # imágenes sin fichero -> failed
+#   python scripts/reconcile_storage.py --format json --out reconcile.json
+import os
+import sys
+import json
+import argparse
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.ads.reconcile import GRACE_HOURS, run_blocking
+
+
+def human_size(n: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def print_text(report, verbose: bool) -> None:
+    print(f"[INFO] Backend: {report.backend} | {report.stored_objects} objetos ({human_size(report.stored_bytes)}) "
+          f"| {report.db_keys} claves en la DB | {report.seconds}s")
+    if report.skipped_urls:
+        print(f"[INFO] {report.skipped_urls} URLs de otro backend (no comprobadas)")
+    if report.cold:
+        print(f"[INFO] {report.cold} URLs sólo en el nivel frío (anuncios archivados/rechazados)")
+    print(f"[{'WARN' if report.orphans else 'OK'}] Huérfanos: {report.orphans} ({human_size(report.orphan_bytes)}), "
+          f"{report.orphans_recent} dentro del periodo de gracia de {report.grace_hours:g} h")
+    if report.delete:
+        print(f"[OK] Borrados: {report.orphans_deleted} (re-comprobados y en uso: {report.orphans_rescued})")
+    print(f"[{'WARN' if report.dangling else 'OK'}] URLs sin fichero: {report.dangling}"
+          + (f" ({report.marked_failed} imágenes marcadas como failed)" if report.marked_failed else ""))
+    if verbose:
+        for o in report.orphan_keys:
+            print(f"  huérfano  {o['key']}  {human_size(o['bytes'])}{'  (reciente)' if o['recent'] else ''}")
+        for d in report.dangling_keys:
+            print(f"  sin fichero  {d['url']}  [{', '.join(d['tables'])}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcilia la DB con el almacenamiento de imágenes.")
+    parser.add_argument("--delete", action="store_true", help="Borra los huérfanos más viejos que el periodo de gracia")
+    parser.add_argument("--grace-hours", type=float, default=GRACE_HOURS,
+                        help=f"Antigüedad mínima de un huérfano para borrarlo (por defecto: {GRACE_HOURS:g})")
+    parser.add_argument("--mark-missing", action="store_true",
+                        help="Marca como failed las imágenes cuyo fichero no existe")
+    parser.add_argument("--format", choices=("text", "json"), default="text", help="Formato de salida")
+    parser.add_argument("--out", help="Fichero de salida para --format json (por defecto: stdout)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Lista cada huérfano y cada URL sin fichero")
+    parser.add_argument("--strict", action="store_true",
+                        help="Código de salida 1 si quedan huérfanos fuera de gracia o URLs sin fichero")
+    args = parser.parse_args()
+
+    report = run_blocking(delete=args.delete, grace_hours=args.grace_hours, mark_missing=args.mark_missing)
+
+    if args.format == "json":
+        out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+        json.dump(report.as_dict(), out, indent=1, ensure_ascii=False)
+        out.write("\n")
+        if args.out:
+            out.close()
+    else:
+        print_text(report, args.verbose)
+
+    pending = report.orphans - report.orphans_recent - report.orphans_deleted - report.orphans_rescued
+    if args.strict and (pending > 0 or report.dangling > 0):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# scripts/shard_images.py
+#
+# Migración en caliente de static/images al reparto en dos niveles
+# (<hash>.ext -> ab/cd/<hash>.ext, ver app/ads/storage.py:shard_key).
+# Se puede ejecutar con la app en marcha y relanzar cuantas veces haga falta.
+#
+# Por lotes de --batch ficheros de la carpeta raíz:
+#   1) mueve cada fichero a su carpeta (os.replace: atómico, mismo disco);
+#   2) reescribe en una transacción las URLs de ad_images, ad_image_renditions,
+#      image_blobs y pending_deletions.
+# Entre 1) y 2) la URL plana sigue resolviendo: /static/images y las lecturas
+# del backend de disco prueban la ruta repartida si la plana no existe.
+# Al final un barrido reescribe las URLs planas que queden (p.ej. de una
+# subida que reutilizó un blob justo mientras se migraba).
+#
+# Los nombres que no son por contenido (ads/ad_3_1.png, Azul.jpg...) no se tocan.
+#
+# Uso:
+#   python scripts/shard_images.py [--batch 500] [--sleep 0.2] [--dry-run]
+import os
+import sys
+import time
+import argparse
+from typing import Dict, List
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import bindparam, update
+
+from app.database import SessionLocal
+from app.models import AdImage, AdImageRendition, ImageBlob, PendingDeletion
+from app.ads.storage import disk_storage, shard_key
+
+URL_TABLES = (AdImage, AdImageRendition, ImageBlob, PendingDeletion)
+
+
+def flat_names(root: str, limit: int) -> List[str]:
+    """Hasta `limit` ficheros de la carpeta raíz con nombre repartible."""
+    out = []
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+            if shard_key(entry.name) != entry.name:
+                out.append(entry.name)
+                if len(out) >= limit:
+                    break
+    return out
+
+
+def move_files(disk, names: List[str]) -> List[str]:
+    """Mueve cada fichero a ab/cd/. Devuelve los nombres movidos."""
+    moved = []
+    for name in names:
+        src, dest = disk.path(name), disk.path(shard_key(name))
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if dest.exists():
+                src.unlink()  # por contenido: el repartido es idéntico
+            else:
+                os.replace(src, dest)
+        except FileNotFoundError:
+            continue  # lo ha borrado la app entre medias
+        moved.append(name)
+    return moved
+
+
+def rewrite_urls(db, mapping: Dict[str, str]) -> int:
+    """URL plana -> URL repartida en todas las tablas, en una transacción."""
+    if not mapping:
+        return 0
+    params = [{"old_url": old, "new_url": new} for old, new in mapping.items()]
+    rows = 0
+    for model in URL_TABLES:
+        table = model.__table__
+        stmt = update(table).where(table.c.url == bindparam("old_url")).values(url=bindparam("new_url"))
+        rows += db.connection().execute(stmt, params).rowcount or 0
+    db.commit()
+    return rows
+
+
+def sweep(db, disk) -> Dict[str, str]:
+    """URLs planas que siguen en la DB y cuyo fichero ya está repartido."""
+    mapping = {}
+    prefix = disk.url_prefix
+    for model in URL_TABLES:
+        q = db.query(model.url).filter(model.url.like(prefix + "%")).distinct()
+        for (url,) in q.yield_per(1000):
+            key = disk.key_for(url)
+            if key and shard_key(key) != key and not disk.path(key).exists() and disk.path(shard_key(key)).exists():
+                mapping[url] = disk.url(shard_key(key))
+    return mapping
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reparte static/images en carpetas ab/cd/ sin parar la app.")
+    parser.add_argument("--batch", type=int, default=500, help="Ficheros por lote")
+    parser.add_argument("--sleep", type=float, default=0.2, help="Pausa entre lotes (s), para no saturar el disco")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo cuenta lo pendiente")
+    args = parser.parse_args()
+
+    disk = disk_storage()
+    root = str(disk.root)
+    if args.dry_run:
+        pending = len(flat_names(root, sys.maxsize))
+        print(f"[INFO] {pending} ficheros por repartir en {root}")
+        return
+
+    db = SessionLocal()
+    files = rows = 0
+    try:
+        while True:
+            names = flat_names(root, args.batch)
+            if not names:
+                break
+            moved = move_files(disk, names)
+            rows += rewrite_urls(db, {disk.url(n): disk.url(shard_key(n)) for n in moved})
+            files += len(moved)
+            print(f"[OK] {files} ficheros movidos, {rows} URLs reescritas")
+            time.sleep(args.sleep)
+
+        stragglers = sweep(db, disk)
+        if stragglers:
+            rows += rewrite_urls(db, stragglers)
+            print(f"[OK] {len(stragglers)} URLs planas rezagadas reescritas")
+    finally:
+        db.close()
+    print(f"[OK] Migración completa: {files} ficheros, {rows} URLs")
+
+
+if __name__ == "__main__":
+    main()
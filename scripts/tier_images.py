@@ -0,0 +1,61 @@
+# scripts/tier_images.py
+#
+# Pasa al nivel frío las imágenes de anuncios archivados/rechazados (ver
+# app/ads/tiering.py) sin esperar al job periódico de la app, y borra los
+# paquetes de anuncios que ya no existen. Idempotente.
+#
+# Uso:
+#   python scripts/tier_images.py --dry-run              # qué anuncios se enfriarían
+#   python scripts/tier_images.py [--days 30] [--limit 200]
+#   python scripts/tier_images.py --ad-id 12 --ad-id 15  # anuncios concretos (ignora --days)
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Asegura imports estilo "from app..." aunque ejecutes como script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.database import SessionLocal
+from app.ads.storage import close_storage
+from app.ads.tiering import COLD_AFTER_DAYS, COLD_DIR, TIERING_BATCH, candidates, freeze_ad, run_once
+
+
+async def run(args) -> dict:
+    try:
+        if args.ad_id:
+            results = [await freeze_ad(ad_id) for ad_id in args.ad_id]
+            return {"ads": results}
+        return await run_once(args.limit, args.days)
+    finally:
+        await close_storage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mueve al nivel frío las imágenes de anuncios archivados/rechazados.")
+    parser.add_argument("--days", type=float, default=COLD_AFTER_DAYS, help="Días en archived/rejected antes de enfriar")
+    parser.add_argument("--limit", type=int, default=TIERING_BATCH, help="Máximo de anuncios en esta pasada")
+    parser.add_argument("--ad-id", type=int, action="append", help="Enfría sólo este anuncio (repetible)")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo lista los anuncios candidatos")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        db = SessionLocal()
+        try:
+            ids = candidates(db, args.limit, args.days)
+        finally:
+            db.close()
+        print(f"[INFO] {len(ids)} anuncios por enfriar (> {args.days:g} días): {ids}")
+        return
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=1))
+    print(f"[OK] Paquetes en {COLD_DIR}")
+
+
+if __name__ == "__main__":
+    main()
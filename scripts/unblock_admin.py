@@ -6,7 +6,8 @@ from sqlalchemy.orm import Session
 
 load_dotenv()
 
-from app.database import SessionLocal, Base, engine
+from app.database import SessionLocal, engine
+from app.migrations import migrate
 from app.models import User
 
 def main():
@@ -14,7 +15,7 @@ def main():
     parser.add_argument("--email", required=True, help="Email del usuario a desbloquear y elevar a admin")
     args = parser.parse_args()
 
-    Base.metadata.create_all(bind=engine)
+    migrate(engine)
     db: Session = SessionLocal()
     try:
         u = db.query(User).filter(User.email == args.email).first()